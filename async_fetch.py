@@ -0,0 +1,166 @@
+# async_fetch.py — asyncio-движок: сотни запросов «в полёте» с лимитами на каждый хост
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+
+@dataclass
+class HostLimits:
+    concurrency: int = 4     # одновременных запросов к хосту
+    rate: float = 2.0        # запросов в секунду в среднем (token bucket)
+    burst: int = 4           # сколько запросов можно сделать «залпом»
+    delay: float = 0.0       # вежливая пауза после каждого запроса, сек
+
+
+DEFAULT_HOST_LIMITS: Dict[str, HostLimits] = {
+    "dnkparfum.ru": HostLimits(concurrency=8, rate=4.0, burst=8, delay=0.1),
+    "perfumex.ru": HostLimits(concurrency=4, rate=2.0, burst=4, delay=0.25),
+}
+FALLBACK_LIMITS = HostLimits()
+
+
+def load_host_limits(path: Optional[Path]) -> Dict[str, HostLimits]:
+    """
+    JSON вида {"dnkparfum.ru": {"concurrency": 16, "rate": 8, "burst": 16, "delay": 0.05}}.
+    Незаданные поля берутся из значений по умолчанию для домена.
+    """
+    limits = dict(DEFAULT_HOST_LIMITS)
+    if path is None:
+        return limits
+    raw = json.loads(Path(path).read_text(encoding="utf-8"))
+    for host, cfg in raw.items():
+        base = asdict(limits.get(host, FALLBACK_LIMITS))
+        base.update(cfg or {})
+        limits[host.lower()] = HostLimits(**base)
+    return limits
+
+
+def host_key(url: str, limits: Dict[str, HostLimits]) -> str:
+    """Домен из таблицы лимитов, к которому относится URL (поддомены — к родителю)."""
+    host = (urlsplit(url).hostname or "").lower()
+    for domain in limits:
+        if host == domain or host.endswith("." + domain):
+            return domain
+    return host
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class GroupOutcome:
+    url: Optional[str] = None        # какой URL из группы дал результат
+    result: Any = None               # то, что вернул fetch_fn (None — не получилось)
+    errors: List[str] = field(default_factory=list)
+
+
+class AsyncFetchEngine:
+    """
+    fetch_fn(url) — обычная синхронная функция (HTTP-путь из main/perfumex_main),
+    возвращает результат или None, если на странице нет данных. Движок гоняет её
+    в пуле потоков, а очередь, лимиты и паузы держит в asyncio:
+
+      • Semaphore на хост — не больше `concurrency` одновременных запросов;
+      • TokenBucket на хост — не чаще `rate` в секунду (с запасом `burst`);
+      • `delay` после каждого запроса — слот хоста занят ещё немного.
+
+    Группы фоллбэков обрабатываются параллельно, URL внутри группы — по порядку.
+    """
+
+    def __init__(self,
+                 fetch_fn: Callable[[str], Any],
+                 limits: Optional[Dict[str, HostLimits]] = None,
+                 max_in_flight: int = 256,
+                 on_attempt: Optional[Callable[[str, bool, float], None]] = None):
+        self.fetch_fn = fetch_fn
+        self.on_attempt = on_attempt  # (url, ok, elapsed_ms) — для статистики url_health
+        self.limits = limits if limits is not None else dict(DEFAULT_HOST_LIMITS)
+        self.max_in_flight = max_in_flight
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _host_state(self, url: str):
+        key = host_key(url, self.limits)
+        lim = self.limits.get(key, FALLBACK_LIMITS)
+        if key not in self._sems:
+            self._sems[key] = asyncio.Semaphore(lim.concurrency)
+            self._buckets[key] = TokenBucket(lim.rate, lim.burst)
+        return lim, self._sems[key], self._buckets[key]
+
+    async def fetch(self, url: str, executor: ThreadPoolExecutor) -> Any:
+        lim, sem, bucket = self._host_state(url)
+        async with sem:
+            await bucket.acquire()
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()  # без ожидания в очереди хоста
+            ok = False
+            try:
+                result = await loop.run_in_executor(executor, self.fetch_fn, url)
+                ok = result is not None
+                return result
+            finally:
+                self._report(url, ok, started)
+                if lim.delay > 0:
+                    await asyncio.sleep(lim.delay)
+
+    async def _run_group(self, urls: List[str], executor: ThreadPoolExecutor) -> GroupOutcome:
+        outcome = GroupOutcome()
+        for url in urls:
+            try:
+                result = await self.fetch(url, executor)
+            except Exception as e:
+                outcome.errors.append(f"{url}: {e}")
+                continue
+            if result is not None:
+                outcome.url, outcome.result = url, result
+                break
+            outcome.errors.append(f"{url}: данные не найдены в HTML")
+        return outcome
+
+    def _report(self, url: str, ok: bool, started: float) -> None:
+        if self.on_attempt:
+            self.on_attempt(url, ok, (time.perf_counter() - started) * 1000)
+
+    async def _run_all(self, groups: List[List[str]],
+                       on_done: Optional[Callable[[int, GroupOutcome], None]]) -> List[GroupOutcome]:
+        threads = max(1, min(self.max_in_flight, sum(l.concurrency for l in self.limits.values()) or 1))
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http") as executor:
+            async def _one(i: int, urls: List[str]):
+                outcome = await self._run_group(urls, executor)
+                if on_done:
+                    on_done(i, outcome)  # в потоке event loop: долгую работу (запись в БД) отдавать в свой поток
+                return outcome
+
+            return list(await asyncio.gather(*(_one(i, g) for i, g in enumerate(groups))))
+
+    def run_groups(self, groups: List[List[str]],
+                   on_done: Optional[Callable[[int, GroupOutcome], None]] = None) -> List[GroupOutcome]:
+        """Синхронная обёртка для cmd_fetch: возвращает исходы в порядке групп."""
+        self._sems.clear()
+        self._buckets.clear()
+        return asyncio.run(self._run_all(groups, on_done))
@@ -0,0 +1,441 @@
+# bench.py — замеры производительности (браузерные профили, БД, отчёты)
+#
+#   python3 bench.py profiles --links links.txt [--site perfumex] [--repeat 3]
+#   python3 bench.py ingest [--products 200 --rounds 20]
+#   python3 bench.py schema [--rows 3000000 --products 5000]
+#   python3 bench.py snapshot [--rows 1000000 --products 2000]
+#   python3 bench.py report [--rows 10000 100000 1000000 --products 2000]
+
+import argparse
+import json
+import multiprocessing
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+def _print_table(header: list, rows: list) -> None:
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    line = "  ".join(str(h).ljust(w) for h, w in zip(header, widths))
+    print(line)
+    print("-" * len(line))
+    for r in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(r, widths)))
+
+
+# ---------- profiles: время загрузки, трафик и доля извлечённых карточек для full / lean ----------
+
+def bench_profiles(args: argparse.Namespace) -> None:
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    from browser_profiles import measure_page_load
+
+    if args.site == "perfumex":
+        import perfumex_main as site
+        import perfumex_locators as L
+        required = [L.PRODUCT_TITLE, L.PRICE_VALUE]
+    else:
+        import main as site
+        import locators
+        required = [locators.product, locators.price]
+
+    urls = [g[0] for g in site.load_links_txt(Path(args.links))][: args.limit]
+    if not urls:
+        print("Нет ссылок для замера.")
+        return
+
+    def ready(driver):
+        for loc in required:
+            WebDriverWait(driver, args.timeout).until(EC.presence_of_element_located(loc))
+
+    def extracted(driver) -> bool:
+        # Профиль годится, только если название и цена не просто есть в DOM, а читаются как текст
+        return all(driver.find_element(*loc).text.strip() for loc in required)
+
+    results = {}
+    for profile in args.profiles:
+        driver = site.build_driver(browser=args.browser, headless=True, profile=profile)
+        samples = []
+        attempts = ok = 0
+        try:
+            for _ in range(args.repeat):
+                for url in urls:
+                    attempts += 1
+                    try:
+                        samples.append(measure_page_load(driver, url, ready))
+                        if extracted(driver):
+                            ok += 1
+                        else:
+                            print(f"   [{profile}] {url}: пустое название или цена")
+                    except Exception as e:
+                        print(f"   [{profile}] {url}: {e}")
+        finally:
+            driver.quit()
+        if samples:
+            results[profile] = {
+                "pages": len(samples),
+                "extracted": f"{ok}/{attempts}",
+                "load_ms_p50": statistics.median(s["load_ms"] for s in samples),
+                "load_ms_max": max(s["load_ms"] for s in samples),
+                "kb_p50": round(statistics.median(s["bytes"] for s in samples) / 1024, 1),
+                "requests_p50": statistics.median(s["requests"] for s in samples),
+            }
+
+    base = results.get("full")
+    rows = []
+    for profile, r in results.items():
+        speedup = f"x{base['load_ms_p50'] / r['load_ms_p50']:.2f}" if base and r["load_ms_p50"] else "—"
+        rows.append([profile, r["pages"], r["extracted"], r["load_ms_p50"], r["load_ms_max"], r["kb_p50"],
+                     r["requests_p50"], speedup])
+    _print_table(["profile", "pages", "extracted", "load p50, ms", "load max, ms", "KB p50", "requests p50",
+                  "vs full"], rows)
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# ---------- ingest: запись цен так же, как store() в cmd_fetch ----------
+
+def _use_temp_db(db_module, tmp: Path, name: str) -> None:
+    db_module.DB_PATH = tmp / f"{name}.sqlite3"
+    db_module.init_db()
+
+
+def bench_ingest(args: argparse.Namespace) -> None:
+    import db
+    from db_session import DEFAULT_PRAGMAS
+
+    names = [f"Товар {i:05d}" for i in range(args.products)]
+    total = args.products * args.rounds
+
+    def one_run(bulk: bool) -> float:
+        started = time.perf_counter()
+        for r in range(args.rounds):
+            if bulk:
+                ids = db.upsert_products(names)
+                db.insert_prices((ids[name], 1000 + r) for name in names)
+                continue
+            for name in names:
+                pid = db.upsert_product(name)
+                db.latest_and_previous_price(pid)
+                db.insert_price(pid, 1000 + r)
+        return time.perf_counter() - started
+
+    modes = {
+        # как было: соединение на каждый вызов, PRAGMA по умолчанию (synchronous=FULL)
+        "per-call (old)": ({"foreign_keys": "ON"}, False),
+        "per-call + pragmas": (DEFAULT_PRAGMAS, False),
+        "session": (DEFAULT_PRAGMAS, True),
+        # пакетный API: upsert_products + insert_prices на каждый «прогон»
+        "session + bulk": (DEFAULT_PRAGMAS, True),
+    }
+    results = {}
+    saved_path, saved_pragmas = db.DB_PATH, db._connections.pragmas
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for i, (mode, (pragmas, use_session)) in enumerate(modes.items()):
+                db._connections.pragmas = dict(pragmas)
+                _use_temp_db(db, Path(tmp), f"ingest{i}")
+                if use_session:
+                    with db.session(commit_every=args.commit_every, commit_interval=args.commit_interval):
+                        elapsed = one_run(bulk=mode.endswith("bulk"))
+                else:
+                    elapsed = one_run(bulk=False)
+                results[mode] = {"rows": total, "seconds": round(elapsed, 3), "rows_per_s": round(total / elapsed)}
+    finally:
+        db.DB_PATH, db._connections.pragmas = saved_path, saved_pragmas
+
+    base = results["per-call (old)"]["rows_per_s"]
+    rows = [[m, r["rows"], r["seconds"], r["rows_per_s"], f"x{r['rows_per_s'] / base:.1f}"] for m, r in results.items()]
+    _print_table(["mode", "rows", "seconds", "rows/s", "vs old"], rows)
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# ---------- schema: размер файла и задержки запросов v1 (TEXT) против v2 (INTEGER мс) ----------
+
+def _fill_history(db_module, rows: int, products: int) -> None:
+    """Синтетическая история за год: товары по кругу, цена меняется раз в 20 замеров."""
+    step = max(60, 365 * 86400 * products // rows)  # секунд между замерами одного товара
+    db_module.upsert_products(f"Товар {i:05d}" for i in range(products))
+    conn = db_module.get_conn()
+    with conn:
+        conn.execute(
+            """
+            WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n + 1 < ?)
+            INSERT INTO prices(product_id, price, checked_at)
+            SELECT 1 + n % ?, 1000 + (n / ? / 20) % 7 * 50,
+                   datetime('2023-01-01', '+' || (n / ? * ?) || ' seconds')
+            FROM seq
+            """,
+            (rows, products, products, products, step),
+        )
+    conn.close()
+
+
+def _time_queries(db_module, products: int, samples: int) -> dict:
+    rnd = random.Random(42)
+    pids = [rnd.randint(1, products) for _ in range(samples)]
+    v2 = db_module.schema_version() >= 2
+    lo, hi = ("2023-02-01 00:00:00", "2023-03-01 00:00:00")
+    if v2:
+        lo, hi = (int(datetime.fromisoformat(x).replace(tzinfo=timezone.utc).timestamp() * 1000) for x in (lo, hi))
+    out = {}
+    conn = db_module.get_conn()
+    try:
+        started = time.perf_counter()
+        for pid in pids:
+            conn.execute("SELECT price FROM prices WHERE product_id=? ORDER BY checked_at DESC LIMIT 2",
+                         (pid,)).fetchall()
+        out["last2_us"] = round((time.perf_counter() - started) / samples * 1e6, 1)
+        started = time.perf_counter()
+        for pid in pids:
+            conn.execute("SELECT checked_at, price FROM prices WHERE product_id=? AND checked_at >= ? AND checked_at < ?",
+                         (pid, lo, hi)).fetchall()
+        out["month_range_us"] = round((time.perf_counter() - started) / samples * 1e6, 1)
+    finally:
+        conn.close()
+    started = time.perf_counter()
+    db_module.dump_history()
+    out["dump_history_s"] = round(time.perf_counter() - started, 2)
+    return out
+
+
+def bench_schema(args: argparse.Namespace) -> None:
+    import shutil
+    import db
+
+    saved_path = db.DB_PATH
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            v1, v2 = Path(tmp) / "v1.sqlite3", Path(tmp) / "v2.sqlite3"
+            db.DB_PATH = v1
+            db.init_db()
+            started = time.perf_counter()
+            _fill_history(db, args.rows, args.products)
+            print(f"История v1: {args.rows} строк за {time.perf_counter() - started:.1f} с")
+            conn = db.get_conn()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+            shutil.copy(v1, v2)
+            db.DB_PATH = v2
+            started = time.perf_counter()
+            db.migrate_to_v2()
+            print(f"Миграция v1 → v2: {time.perf_counter() - started:.1f} с")
+            db.DB_PATH = v1
+            conn = db.get_conn()
+            conn.isolation_level = None
+            conn.execute("VACUUM")  # сравниваем оба файла в упакованном виде
+            conn.close()
+            for label, path in (("v1 (TEXT)", v1), ("v2 (INTEGER ms)", v2)):
+                db.DB_PATH = path
+                results[label] = {"size_mb": round(path.stat().st_size / 1e6, 1),
+                                  **_time_queries(db, args.products, args.samples)}
+    finally:
+        db.DB_PATH = saved_path
+
+    rows = [[k, r["size_mb"], r["last2_us"], r["month_range_us"], r["dump_history_s"]] for k, r in results.items()]
+    _print_table(["schema", "size, MB", "last 2, µs", "month range, µs", "dump_history, s"], rows)
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# ---------- snapshot: «Текущие цены» — pandas по всей истории против SQL ----------
+
+def _snapshot_pandas(db_module):
+    """Прежний путь отчёта: вся история в DataFrame, groupby(...).apply на каждый товар."""
+    import pandas as pd
+
+    df = pd.DataFrame(db_module.dump_history(), columns=["product_id", "name", "price", "checked_at"])
+    df_sorted = df.sort_values(["product_id", "checked_at"], ascending=[True, True])
+    latest = df_sorted.loc[df_sorted.groupby("product_id")["checked_at"].idxmax()].copy()
+    second_idx = (
+        df_sorted.groupby("product_id")
+        .apply(lambda g: g.iloc[-2].name if len(g) >= 2 else None)
+        .dropna()
+        .astype(int)
+    )
+    prev = df_sorted.loc[second_idx]
+    latest = latest.merge(prev[["product_id", "price"]].rename(columns={"price": "prev_price"}),
+                          on="product_id", how="left")
+    return latest
+
+
+def bench_snapshot(args: argparse.Namespace) -> None:
+    import db
+
+    saved_path = db.DB_PATH
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db.DB_PATH = Path(tmp) / "snapshot.sqlite3"
+            db.init_db()
+            _fill_history(db, args.rows, args.products)
+            modes = {
+                "pandas groupby.apply (old)": lambda: _snapshot_pandas(db),
+                "SQL ROW_NUMBER/LAG": db.latest_snapshot_from_history,
+                "latest_prices": db.latest_snapshot,
+            }
+            out = {}
+            for mode, fn in modes.items():
+                started = time.perf_counter()
+                out[mode] = fn()
+                results[mode] = {"rows": args.rows, "seconds": round(time.perf_counter() - started, 3)}
+    finally:
+        db.DB_PATH = saved_path
+
+    # одинаковые ли цены: (product_id, price, prev_price) во всех трёх путях
+    old = {(r.product_id, r.price, None if r.prev_price != r.prev_price else int(r.prev_price))
+           for r in out["pandas groupby.apply (old)"].itertuples()}
+    for mode in ("SQL ROW_NUMBER/LAG", "latest_prices"):
+        results[mode]["same_as_old"] = old == {(r[0], r[2], r[3]) for r in out[mode]}
+    base = results["pandas groupby.apply (old)"]["seconds"]
+    rows = [[m, r["rows"], r["seconds"], f"x{base / max(r['seconds'], 1e-3):.1f}", r.get("same_as_old", "")]
+            for m, r in results.items()]
+    _print_table(["mode", "history rows", "seconds", "vs old", "same result"], rows)
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# ---------- report: Excel-отчёт — запись, перечитывание и стили по ячейкам против write-only ----------
+
+def _report_reload(db_module, out_path: Path) -> None:
+    """Прежний путь листа «История»: pandas.ExcelWriter, затем load_workbook и стили по каждой ячейке."""
+    import openpyxl
+    import pandas as pd
+    from openpyxl.styles import Alignment, Font
+    from openpyxl.utils import get_column_letter
+
+    with pd.ExcelWriter(out_path, engine="openpyxl") as xw:
+        startrow = 0
+        for df in db_module.iter_history_frames():
+            df.to_excel(xw, sheet_name="История", index=False, header=startrow == 0, startrow=startrow)
+            startrow += len(df) + (1 if startrow == 0 else 0)
+    wb = openpyxl.load_workbook(out_path)
+    ws = wb["История"]
+    ws.freeze_panes = "A2"
+    dims = {}
+    for row in ws.iter_rows(values_only=True):
+        for i, cell in enumerate(row, 1):
+            if cell is not None:
+                dims[i] = max(dims.get(i, 0), len(str(cell)))
+    for col_idx, width in dims.items():
+        ws.column_dimensions[get_column_letter(col_idx)].width = min(max(width + 2, 12), 60)
+    for c in ws[1]:
+        c.font = Font(bold=True)
+        c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    ws.row_dimensions[1].height = 28
+    for row in range(2, ws.max_row + 1):
+        ws.cell(row=row, column=3).number_format = "#,##0"
+    wb.save(out_path)
+
+
+def _report_case(mode: str, db_path: str, out_path: str) -> tuple:
+    """Один замер в отдельном процессе: (секунды, пиковая память процесса, МБ)."""
+    import resource
+    import sys
+    import db
+    import report
+    from report_pipeline import run_report
+
+    db.DB_PATH = Path(db_path)
+    started = time.perf_counter()
+    if mode == "old":
+        _report_reload(db, Path(out_path))
+    else:  # тот же лист «История», что и в отчёте
+        run_report(db, Path(out_path), [s for s in report.report_sheets() if s.needs_history])
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # байты на macOS, КБ на Linux
+    return elapsed, peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def bench_report(args: argparse.Namespace) -> None:
+    import db
+
+    saved_path = db.DB_PATH
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for n in args.rows:
+                db.DB_PATH = Path(tmp) / f"report{n}.sqlite3"
+                db.init_db()
+                _fill_history(db, n, args.products)
+                db.refresh_rollups()
+                modes = [("new", "write-only")]
+                if n <= args.old_max_rows:
+                    modes.insert(0, ("old", "reload + restyle (old)"))
+                for mode, label in modes:
+                    out = Path(tmp) / f"report{n}_{mode}.xlsx"
+                    with ctx.Pool(1) as pool:  # свежий процесс — честная пиковая память
+                        seconds, peak_mb = pool.apply(_report_case, (mode, str(db.DB_PATH), str(out)))
+                    results[f"{n} {label}"] = {"rows": n, "mode": label, "seconds": round(seconds, 2),
+                                               "peak_mb": round(peak_mb), "xlsx_mb": round(out.stat().st_size / 1e6, 1)}
+                    print(f"{n} строк, {label}: {seconds:.1f} с")
+    finally:
+        db.DB_PATH = saved_path
+
+    rows = []
+    for r in results.values():
+        old = results.get(f"{r['rows']} reload + restyle (old)")
+        vs = f"x{old['seconds'] / max(r['seconds'], 1e-3):.1f}" if old else ""
+        rows.append([r["rows"], r["mode"], r["seconds"], r["peak_mb"], r["xlsx_mb"], vs])
+    _print_table(["history rows", "mode", "seconds", "peak RSS, MB", "xlsx, MB", "vs old"], rows)
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности price tracker")
+    sub = parser.add_subparsers(required=True)
+
+    p = sub.add_parser("profiles", help="Сравнить профили загрузки браузера на реальных ссылках")
+    p.add_argument("--site", default="dnkparfum", choices=["dnkparfum", "perfumex"])
+    p.add_argument("--links", default="links.txt", help="Файл со ссылками (берётся первый URL каждой строки)")
+    p.add_argument("--limit", type=int, default=10, help="Сколько ссылок замерять")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--profiles", nargs="+", default=["full", "lean"])
+    p.add_argument("--browser", default="chrome", choices=["chrome", "yandex"])
+    p.add_argument("--timeout", type=int, default=30)
+    p.add_argument("--out", default=None, help="Сохранить результаты в JSON")
+    p.set_defaults(func=bench_profiles)
+
+    p = sub.add_parser("ingest", help="Скорость записи цен в SQLite: соединение на вызов против сессии")
+    p.add_argument("--products", type=int, default=200)
+    p.add_argument("--rounds", type=int, default=20, help="Сколько «прогонов fetch» по всем товарам")
+    p.add_argument("--commit-every", type=int, default=500)
+    p.add_argument("--commit-interval", type=float, default=2.0)
+    p.add_argument("--out", default=None, help="Сохранить результаты в JSON")
+    p.set_defaults(func=bench_ingest)
+
+    p = sub.add_parser("schema", help="Схема v1 против v2: размер БД и задержки запросов на большой истории")
+    p.add_argument("--rows", type=int, default=3_000_000)
+    p.add_argument("--products", type=int, default=5000)
+    p.add_argument("--samples", type=int, default=2000, help="Сколько случайных товаров опрашивать")
+    p.add_argument("--out", default=None, help="Сохранить результаты в JSON")
+    p.set_defaults(func=bench_schema)
+
+    p = sub.add_parser("snapshot", help="Лист «Текущие цены»: pandas по всей истории против SQL")
+    p.add_argument("--rows", type=int, default=1_000_000)
+    p.add_argument("--products", type=int, default=2000)
+    p.add_argument("--out", default=None, help="Сохранить результаты в JSON")
+    p.set_defaults(func=bench_snapshot)
+
+    p = sub.add_parser("report", help="Лист «История»: запись + перечитывание + стили по ячейкам против write-only")
+    p.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--products", type=int, default=2000)
+    p.add_argument("--old-max-rows", type=int, default=100_000,
+                   help="Старый путь дольше и тяжелее по памяти — на больших историях только новый")
+    p.add_argument("--out", default=None, help="Сохранить результаты в JSON")
+    p.set_defaults(func=bench_report)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# browser_profiles.py — профили загрузки страниц для build_driver (общий для main.py и perfumex_main.py)
+#
+#   full    — как раньше: окно 1920x1080, страница грузится целиком (pageLoadStrategy=normal).
+#   lean    — pageLoadStrategy=eager (не ждём картинки/iframe), картинки выключены,
+#             через CDP блокируются картинки, видео, шрифты и счётчики/трекеры.
+#
+# Замерить профили на своих ссылках: python3 bench.py profiles --links links.txt
+
+import time
+from typing import Dict, List
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options as ChromeOptions
+
+PROFILES = ("full", "lean")
+
+MEDIA_PATTERNS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico", "*.bmp",
+    "*.mp4", "*.webm", "*.mp3", "*.ogg",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+]
+TRACKER_PATTERNS = [
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*mc.yandex.ru*", "*yandex.ru/metrika*", "*top-fwz1.mail.ru*", "*vk.com/rtrg*",
+    "*connect.facebook.net*", "*jivosite.com*", "*code.jivo.ru*", "*callibri.ru*",
+    "*roistat*", "*carrotquest*", "*bitrix24.ru/b*",
+]
+_BLOCKED_BY_PROFILE: Dict[str, List[str]] = {
+    "full": [],
+    "lean": MEDIA_PATTERNS + TRACKER_PATTERNS,
+}
+_LOAD_STRATEGY = {"full": "normal", "lean": "eager"}
+
+
+def apply_profile(options: ChromeOptions, profile: str = "full") -> None:
+    """Настройки, которые задаются до запуска браузера."""
+    if profile not in PROFILES:
+        raise ValueError(f"Неизвестный профиль загрузки: {profile!r} (доступны: {', '.join(PROFILES)})")
+    if profile == "full":
+        options.add_argument("--window-size=1920,1080")
+        return
+
+    options.page_load_strategy = _LOAD_STRATEGY[profile]
+    options.add_argument("--window-size=1280,800")
+    # Картинки не запрашиваются и не декодируются/кэшируются вовсе
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.default_content_setting_values.notifications": 2,
+    })
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-background-networking")
+
+
+def after_start(driver: webdriver.Chrome, profile: str = "full") -> None:
+    """Настройки, которые задаются через CDP уже запущенному браузеру."""
+    patterns = _BLOCKED_BY_PROFILE.get(profile) or []
+    if not patterns:
+        return
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+
+
+_TRAFFIC_JS = """
+const nav = performance.getEntriesByType('navigation')[0] || {};
+const res = performance.getEntriesByType('resource');
+let bytes = nav.transferSize || 0;
+for (const r of res) bytes += (r.transferSize || 0);
+return {bytes: bytes, requests: res.length + 1,
+        dom_ready_ms: nav.domContentLoadedEventEnd || 0};
+"""
+
+
+def measure_page_load(driver: webdriver.Chrome, url: str, ready) -> Dict[str, float]:
+    """
+    Открывает url и ждёт ready(driver) (например, появления цены).
+    Возвращает время до готовности и объём трафика по Performance API.
+    Чужие домены без Timing-Allow-Origin отдают transferSize=0 — байты занижены,
+    но для сравнения профилей между собой этого достаточно.
+    """
+    started = time.perf_counter()
+    driver.get(url)
+    ready(driver)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats = driver.execute_script(_TRAFFIC_JS) or {}
+    return {
+        "load_ms": round(elapsed_ms, 1),
+        "dom_ready_ms": round(float(stats.get("dom_ready_ms") or 0), 1),
+        "bytes": int(stats.get("bytes") or 0),
+        "requests": int(stats.get("requests") or 0),
+    }
@@ -0,0 +1,72 @@
+# change_cache.py — пропуск неизменившихся карточек (fetch --skip-unchanged)
+#
+# По каждому URL в таблице page_cache хранятся ETag / Last-Modified последнего ответа
+# и хэш извлечённых полей (название + цена). HTTP-путь шлёт условный запрос и при 304
+# не разбирает страницу вовсе; если же страница пришла (или взята браузером), но поля
+# совпали с прошлым разом — в prices ничего не пишется.
+
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+# Результат fetch-функции «страница не менялась (304)» — разбирать и писать нечего
+UNCHANGED = object()
+
+
+def fields_hash(*values) -> str:
+    return hashlib.sha1("\x1f".join(str(v) for v in values).encode("utf-8")).hexdigest()
+
+
+class ChangeCache:
+    def __init__(self, db_module):
+        self.db = db_module
+        self._rows: Dict[str, Tuple[Optional[str], Optional[str], Optional[str]]] = db_module.load_page_cache()
+        self._staged: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    def validators(self, url: str) -> Tuple[Optional[str], Optional[str]]:
+        """(etag, last_modified) для условного запроса."""
+        with self._lock:
+            etag, last_modified, _ = self._rows.get(url, (None, None, None))
+        return etag, last_modified
+
+    def not_modified(self, url: str) -> None:
+        """Сервер ответил 304."""
+        with self._lock:
+            self.skipped += 1
+
+    def remember_validators(self, url: str, etag: Optional[str], last_modified: Optional[str]) -> None:
+        """Валидаторы свежего ответа; в БД попадут вместе с хэшем в commit()."""
+        with self._lock:
+            self._staged[url] = (etag, last_modified)
+
+    def unchanged(self, url: str, *values) -> bool:
+        """True — извлечённые поля те же, что в прошлый раз (в prices писать не нужно)."""
+        h = fields_hash(*values)
+        with self._lock:
+            same = self._rows.get(url, (None, None, None))[2] == h
+            if same:
+                self.skipped += 1
+        return same
+
+    def commit(self, url: str, *values) -> None:
+        """Запомнить состояние URL после успешной обработки (запись в БД прошла или была не нужна)."""
+        h = fields_hash(*values)
+        with self._lock:
+            old = self._rows.get(url, (None, None, None))
+            etag, last_modified = self._staged.pop(url, (old[0], old[1]))
+            self._rows[url] = (etag, last_modified, h)
+        self.db.save_page_cache(url, etag, last_modified, h)
+
+
+def fetch_html(fetcher, url: str, cache: Optional[ChangeCache] = None):
+    """HTML страницы через http_fetch.HttpFetcher; с кэшем — условным запросом (UNCHANGED при 304)."""
+    if cache is None:
+        return fetcher.get_html(url)
+    page_html, etag, last_modified = fetcher.fetch(url, *cache.validators(url))
+    if page_html is None:
+        cache.not_modified(url)
+        return UNCHANGED
+    cache.remember_validators(url, etag, last_modified)
+    return page_html
@@ -0,0 +1,209 @@
+# db_session.py — управление соединениями SQLite (общий для db.py и perfumex_db.py)
+#
+# Без сессии каждая функция db.* открывает своё соединение и коммитит сразу (как раньше).
+# Внутри `with db.session():` все функции работают через ОДНО долгоживущее соединение:
+#   • подготовленные выражения кэшируются (cached_statements);
+#   • записи копятся в транзакции и коммитятся пачками — каждые `commit_every` изменений
+#     или `commit_interval` секунд, и обязательно при выходе из сессии;
+#   • каждая пишущая функция работает в своей точке сохранения (SAVEPOINT): если она упала на полпути,
+#     откатываются только её записи, а в общую транзакцию попадает лишь то, что завершилось целиком;
+#   • PRAGMA synchronous/cache_size/mmap_size настраиваются один раз на соединение.
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+DEFAULT_PRAGMAS: Dict[str, object] = {
+    "foreign_keys": "ON",
+    "synchronous": "NORMAL",   # в режиме WAL безопасно: теряется максимум последняя транзакция при сбое ОС
+    "cache_size": -65536,      # 64 МБ страничного кэша
+    "mmap_size": 268435456,    # 256 МБ memory-mapped I/O
+    "temp_store": "MEMORY",
+    "busy_timeout": 10000,
+}
+DEFAULT_COMMIT_EVERY = 500
+DEFAULT_COMMIT_INTERVAL = 2.0
+
+# Схема v2 (PRAGMA user_version=2): prices.checked_at — INTEGER, миллисекунды Unix-времени (UTC),
+# вместо TEXT 'YYYY-MM-DD HH:MM:SS' (~19 байт и точность до секунды). v1 — исходная схема.
+SCHEMA_V1, SCHEMA_V2 = 1, 2
+EPOCH_MS_NOW_SQL = "CAST(ROUND((julianday('now') - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def text_to_ms_sql(expr: str) -> str:
+    """SQL: текстовая дата (UTC) -> миллисекунды; NULL -> сейчас."""
+    return f"CAST(ROUND((julianday(COALESCE({expr}, 'now')) - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def ts_text_sql(col: str) -> str:
+    """SQL: checked_at любой версии схемы -> текст 'YYYY-MM-DD HH:MM:SS' (как отдавала v1)."""
+    return (f"CASE typeof({col}) WHEN 'integer' "
+            f"THEN strftime('%Y-%m-%d %H:%M:%S', {col} / 1000, 'unixepoch') ELSE {col} END")
+
+
+# Периоды агрегатов price_rollups: SQL начала периода ('YYYY-MM-DD') по текстовой дате {ts}
+ROLLUP_BUCKET_SQL: Dict[str, str] = {
+    "day": "date({ts})",
+    "week": "date({ts}, 'weekday 0', '-6 days')",  # понедельник
+    "month": "date({ts}, 'start of month')",
+}
+
+
+
+def interval_observations(first: str, last: str, count: int, since_day: str) -> Iterator[Tuple[str, int]]:
+    """
+    Замеры строки-интервала (count замеров с first по last, текст UTC) по дням для price_rollups,
+    начиная с since_day ('YYYY-MM-DD'): на каждый день — (время первого замера дня, 1) и
+    (время последнего, остальные замеры дня). Моменты промежуточных замеров не хранятся —
+    считаем их равномерно распределёнными между first и last (так и идёт fetch по расписанию).
+    """
+    t0 = datetime.fromisoformat(first).replace(microsecond=0)
+    t1 = datetime.fromisoformat(last).replace(microsecond=0)
+    span, steps = int((t1 - t0).total_seconds()), count - 1
+    if span <= 0:
+        if first[:10] >= since_day:
+            yield first, 1
+            yield last, steps
+        return
+
+    def at(i: int) -> str:
+        return (t0 + timedelta(seconds=i * span // steps)).isoformat(" ")
+
+    day0 = t0.date()
+    offset = int((t0 - datetime.combine(day0, datetime.min.time())).total_seconds())
+    first_day = max(0, (datetime.fromisoformat(since_day).date() - day0).days)
+    for day in range(first_day, (t1.date() - day0).days + 1):
+        start = day * 86400 - offset  # начало дня в секундах от t0
+        # номера замеров i со временем t0 + i·span/steps внутри [start, start + сутки)
+        lo = max(0, -(-start * steps // span))
+        hi = min(count, -(-(start + 86400) * steps // span))
+        if hi > lo:
+            yield at(lo), 1
+            if hi - lo > 1:
+                yield at(hi - 1), hi - lo - 1
+
+class ConnectionManager:
+    def __init__(self, path_fn: Callable[[], Path], pragmas: Optional[Dict[str, object]] = None):
+        self.path_fn = path_fn  # функция, а не путь: DB_PATH модуля можно переопределить
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self._shared: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self._pending = 0
+        self._last_commit = 0.0
+        self.commit_every = DEFAULT_COMMIT_EVERY
+        self.commit_interval = DEFAULT_COMMIT_INTERVAL
+        self.commits = 0
+        self._depth = 0
+        self._versions: Dict[str, int] = {}
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path_fn(), cached_statements=256, check_same_thread=False)
+        for key, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {key}={value};")
+        return conn
+
+    def schema_version(self) -> int:
+        """PRAGMA user_version файла БД (0 у старых файлов считается v1); кэшируется по пути."""
+        key = str(self.path_fn())
+        if key not in self._versions:
+            with self.connection() as conn:
+                self._versions[key] = conn.execute("PRAGMA user_version").fetchone()[0] or SCHEMA_V1
+        return self._versions[key]
+
+    def forget_schema_version(self) -> None:
+        self._versions.pop(str(self.path_fn()), None)
+
+    @property
+    def in_session(self) -> bool:
+        return self._shared is not None
+
+    @contextmanager
+    def connection(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        """Соединение для одной функции db.*: общее (в сессии) или своё (коммит + закрытие)."""
+        with self._lock:
+            shared = self._shared
+            if shared is not None:
+                if not write:
+                    yield shared
+                    return
+                if not shared.in_transaction:
+                    shared.execute("BEGIN")  # иначе RELEASE внешней точки сохранения сам закоммитит
+                self._depth += 1
+                savepoint = f"sp{self._depth}"
+                shared.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    yield shared
+                except BaseException:
+                    # Ошибка откатывает только записи этой функции, накопленные до неё остаются
+                    self._end_savepoint(shared, savepoint, rollback=True)
+                    raise
+                finally:
+                    self._depth -= 1
+                self._end_savepoint(shared, savepoint)
+                self._pending += 1
+                self._maybe_commit()
+                return
+        conn = self.connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _end_savepoint(conn: sqlite3.Connection, savepoint: str, rollback: bool = False) -> None:
+        try:
+            if rollback:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+            conn.execute(f"RELEASE {savepoint}")
+        except sqlite3.OperationalError:
+            pass  # executescript() (init_db) коммитит сам — точки сохранения уже нет
+
+    def _maybe_commit(self) -> None:
+        if (self._pending >= self.commit_every
+                or time.monotonic() - self._last_commit >= self.commit_interval):
+            self.commit()
+
+    def commit(self) -> None:
+        with self._lock:
+            if self._shared is not None and self._pending:
+                self._shared.commit()
+                self.commits += 1
+            self._pending = 0
+            self._last_commit = time.monotonic()
+
+    @contextmanager
+    def session(self,
+                commit_every: int = DEFAULT_COMMIT_EVERY,
+                commit_interval: float = DEFAULT_COMMIT_INTERVAL) -> Iterator[sqlite3.Connection]:
+        """Одно соединение на весь прогон; вложенные сессии переиспользуют внешнюю."""
+        with self._lock:
+            outer = self._shared
+            if outer is None:
+                self._shared = self.connect()
+                self.commit_every, self.commit_interval = commit_every, commit_interval
+                self._pending, self._last_commit = 0, time.monotonic()
+        if outer is not None:
+            yield outer
+            return
+        try:
+            yield self._shared
+            self.commit()
+        except BaseException:
+            with self._lock:
+                # Уже полученные цены не теряем и при ошибке/Ctrl+C: недописанное откатила точка
+                # сохранения в connection(), в транзакции только завершённые записи
+                try:
+                    self._shared.commit()
+                except sqlite3.Error:
+                    self._shared.rollback()
+                self._pending = 0
+            raise
+        finally:
+            with self._lock:
+                self._shared.close()
+                self._shared = None
@@ -0,0 +1,155 @@
+# driver_pool.py — пул переиспользуемых сессий WebDriver (общий для main.py и perfumex_main.py)
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+DEFAULT_MAX_PAGES = 100
+
+
+class DriverPool:
+    """
+    Держит до `size` запущенных браузеров и выдаёт их по запросу:
+
+        with DriverPool(lambda: build_driver(...), size=1) as pool:
+            with pool.driver() as drv:
+                drv.get(url)
+
+    • Сессия создаётся лениво и переиспользуется между URL.
+    • После `max_pages` страниц сессия закрывается и при следующем запросе создаётся заново.
+    • Перед выдачей и после ошибки сессия проверяется; «упавший» браузер выбрасывается.
+    • `on_create(driver)` вызывается для каждой новой сессии (например, авторизация на perfumex).
+    """
+
+    def __init__(self,
+                 factory: Callable[[], webdriver.Chrome],
+                 size: int = 1,
+                 max_pages: int = DEFAULT_MAX_PAGES,
+                 on_create: Optional[Callable[[webdriver.Chrome], None]] = None):
+        if size < 1:
+            raise ValueError("Размер пула должен быть >= 1")
+        self.factory = factory
+        self.size = size
+        self.max_pages = max_pages
+        self.on_create = on_create
+        self._idle: "queue.LifoQueue[webdriver.Chrome]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._pages: dict[int, int] = {}
+        self._live: set = set()
+        self._closed = False
+
+    # ---- жизненный цикл сессий ----
+
+    def _create(self) -> webdriver.Chrome:
+        driver = self.factory()
+        try:
+            if self.on_create:
+                self.on_create(driver)
+        except Exception:
+            self._quit(driver)
+            raise
+        with self._lock:
+            self._live.add(driver)
+            self._pages[id(driver)] = 0
+        return driver
+
+    def _quit(self, driver: webdriver.Chrome) -> None:
+        with self._lock:
+            self._live.discard(driver)
+            self._pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def is_healthy(driver: webdriver.Chrome) -> bool:
+        """Дешёвая проверка: сессия отвечает на простейший запрос."""
+        try:
+            driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    # ---- выдача / возврат ----
+
+    def acquire(self) -> webdriver.Chrome:
+        if self._closed:
+            raise RuntimeError("Пул браузеров уже закрыт")
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if self.is_healthy(driver):
+                    return driver
+                self._quit(driver)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, driver: webdriver.Chrome, broken: bool = False) -> None:
+        try:
+            with self._lock:
+                pages = self._pages.get(id(driver), 0) + 1
+                self._pages[id(driver)] = pages
+            if broken or self._closed or (self.max_pages and pages >= self.max_pages):
+                self._quit(driver)
+            else:
+                self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    def warm_up(self, count: Optional[int] = None) -> None:
+        """Заранее поднять сессии (ошибки запуска/авторизации всплывают сразу, а не на первом URL)."""
+        count = min(count or self.size, self.size)
+        if count == 1:
+            self._idle.put(self._create())
+            return
+        with ThreadPoolExecutor(max_workers=count) as ex:
+            for driver in ex.map(lambda _: self._create(), range(count)):
+                self._idle.put(driver)
+
+    def driver(self) -> "_Lease":
+        """Контекстный менеджер: взять сессию, вернуть её в пул (или выбросить, если она упала)."""
+        return _Lease(self)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            leftovers = list(self._live)
+        for driver in leftovers:
+            self._quit(driver)
+
+    def __enter__(self) -> "DriverPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class _Lease:
+    def __init__(self, pool: DriverPool):
+        self.pool = pool
+        self.driver: Optional[webdriver.Chrome] = None
+
+    def __enter__(self) -> webdriver.Chrome:
+        self.driver = self.pool.acquire()
+        return self.driver
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Таймаут ожидания локатора — не повод перезапускать браузер; проверяем, жива ли сессия
+        broken = exc_type is not None and not DriverPool.is_healthy(self.driver)
+        self.pool.release(self.driver, broken=broken)
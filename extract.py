@@ -0,0 +1,78 @@
+# extract.py — извлечение всех полей карточки за один вызов execute_script
+#
+# Вместо «WebDriverWait + find_element» на каждое поле (по несколько HTTP-запросов к chromedriver
+# на поле и на каждый цикл ожидания) страница опрашивается одним скриптом, который ищет все
+# поля сразу и возвращает их тексты, только когда видны все. Набор полей описывается словарём
+# {имя_поля: локатор} — см. locators.FIELDS и perfumex_locators.PRODUCT_FIELDS.
+
+from typing import Dict, Tuple
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+from url_health import check_cancelled
+
+Locator = Tuple[str, str]
+FieldSpec = Dict[str, Locator]
+
+_EXTRACT_JS = r"""
+const specs = arguments[0];
+function candidates(by, value) {
+  if (by === 'xpath') {
+    const snap = document.evaluate(value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const out = [];
+    for (let i = 0; i < snap.snapshotLength; i++) out.push(snap.snapshotItem(i));
+    return out;
+  }
+  if (by === 'css selector') return Array.from(document.querySelectorAll(value));
+  if (by === 'id') { const el = document.getElementById(value); return el ? [el] : []; }
+  if (by === 'class name') return Array.from(document.getElementsByClassName(value));
+  return [];
+}
+function visible(el) {
+  if (!el || !el.getClientRects || el.getClientRects().length === 0) return false;
+  const st = window.getComputedStyle(el);
+  return st.visibility !== 'hidden' && st.display !== 'none' && st.opacity !== '0';
+}
+const out = {};
+for (const [name, by, value] of specs) {
+  const el = candidates(by, value).find(visible);
+  if (!el) return null;
+  out[name] = (el.innerText || el.textContent || '').replace(/\s+/g, ' ').trim();
+}
+return out;
+"""
+
+_SUPPORTED = {By.XPATH, By.CSS_SELECTOR, By.ID, By.CLASS_NAME}
+
+
+def _specs(fields: FieldSpec) -> list:
+    specs = []
+    for name, (by, value) in fields.items():
+        if by not in _SUPPORTED:
+            raise ValueError(f"Локатор {by!r} для поля {name!r} не поддерживается")
+        specs.append([name, by, value])
+    return specs
+
+
+def extract_fields(driver: webdriver.Chrome, fields: FieldSpec,
+                   timeout: float = 30, poll: float = 0.2) -> Dict[str, str]:
+    """
+    Ждёт, пока ВСЕ поля станут видимыми, и возвращает {имя_поля: текст}.
+    Каждый цикл ожидания — ровно один запрос execute_script. В гонке --race проигравшая
+    попытка прерывается на ближайшем цикле (url_health.RaceCancelled).
+    """
+    specs = _specs(fields)
+
+    def poll_fields(d):
+        check_cancelled()
+        return d.execute_script(_EXTRACT_JS, specs)
+
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=poll).until(poll_fields)
+    except TimeoutException:
+        raise TimeoutException(
+            f"За {timeout} с на странице не появились поля: {', '.join(fields)}"
+        ) from None
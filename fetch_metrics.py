@@ -0,0 +1,90 @@
+# fetch_metrics.py — замеры по фазам прогона fetch (fetch --metrics-out run.json)
+#
+# Фазы: build_driver (запуск браузера), login (вход perfumex), navigation (driver.get),
+# extract (ожидание и извлечение полей), http (GET без браузера), parse (разбор цены), db (запись в SQLite).
+# В JSON попадают все замеры по URL и сводка p50/p95/max по каждой фазе —
+# удобно сравнивать прогоны между собой и ловить регрессии.
+
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+PHASES = ("build_driver", "login", "navigation", "extract", "http", "parse", "db")
+
+
+def _percentile(sorted_vals: List[float], pct: float) -> float:
+    """Перцентиль по ближайшему рангу (как в большинстве APM)."""
+    if not sorted_vals:
+        return 0.0
+    k = max(0, math.ceil(pct / 100 * len(sorted_vals)) - 1)
+    return sorted_vals[k]
+
+
+class RunMetrics:
+    def __init__(self, tracker: str):
+        self.tracker = tracker
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, phase: str, url: Optional[str] = None):
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.spans.append({"url": url, "phase": phase, "ms": round(ms, 2), "ok": ok})
+
+    def summary(self) -> Dict[str, dict]:
+        by_phase: Dict[str, List[float]] = {}
+        with self._lock:
+            for s in self.spans:
+                by_phase.setdefault(s["phase"], []).append(s["ms"])
+        out = {}
+        for phase in sorted(by_phase, key=lambda p: PHASES.index(p) if p in PHASES else len(PHASES)):
+            vals = sorted(by_phase[phase])
+            out[phase] = {
+                "count": len(vals),
+                "total_ms": round(sum(vals), 1),
+                "p50_ms": round(_percentile(vals, 50), 1),
+                "p95_ms": round(_percentile(vals, 95), 1),
+                "max_ms": round(vals[-1], 1),
+            }
+        return out
+
+    def print_summary(self) -> None:
+        print(f"Время по фазам (всего {time.perf_counter() - self._t0:.1f} с):")
+        for phase, st in self.summary().items():
+            print(f"   {phase:<13} n={st['count']:<5} p50={st['p50_ms']:>9.1f} мс  "
+                  f"p95={st['p95_ms']:>9.1f} мс  max={st['max_ms']:>9.1f} мс  всего={st['total_ms'] / 1000:.1f} с")
+
+    def write_json(self, path: Path, **extra) -> None:
+        payload = {
+            "tracker": self.tracker,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "wall_ms": round((time.perf_counter() - self._t0) * 1000, 1),
+            **extra,
+            "summary": self.summary(),
+            "spans": self.spans,
+        }
+        Path(path).write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+class _NullMetrics:
+    """Заглушка, чтобы fetch_once/fetch_product можно было вызывать без замеров."""
+
+    @contextmanager
+    def span(self, phase: str, url: Optional[str] = None):
+        yield
+
+
+NULL_METRICS = _NullMetrics()
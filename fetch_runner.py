@@ -0,0 +1,42 @@
+# fetch_runner.py — обход групп URL в один или несколько потоков (общий для main.py и perfumex_main.py)
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, List, TypeVar
+
+T = TypeVar("T")
+LogFn = Callable[[str], None]
+
+
+def run_groups(groups: Iterable[T],
+               handle_group: Callable[[T, LogFn], None],
+               workers: int = 1) -> None:
+    """
+    Вызывает handle_group(group, log) для каждой группы.
+
+    • workers == 1 — строго по порядку, вывод печатается сразу (как раньше).
+    • workers > 1 — группы раздаются пулу потоков; строки каждой группы копятся
+      и печатаются одним блоком по её завершении, чтобы вывод не перемешивался.
+      Порядок фоллбэков внутри группы сохраняется — его соблюдает сам handle_group.
+    """
+    if workers <= 1:
+        for group in groups:
+            handle_group(group, print)
+        return
+
+    print_lock = threading.Lock()
+
+    def _run(group: T) -> None:
+        lines: List[str] = []
+        try:
+            handle_group(group, lines.append)
+        except Exception as e:
+            lines.append(f"   Ошибка обработчика группы: {e}")
+        finally:
+            with print_lock:
+                print("\n".join(lines), flush=True)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch") as ex:
+        futures = [ex.submit(_run, g) for g in groups]
+        for f in as_completed(futures):
+            f.result()
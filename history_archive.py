@@ -0,0 +1,247 @@
+# history_archive.py — архив старой истории цен в Parquet (archive-history) и чтение «БД + архив»
+#
+# Замеры старше N дней выгружаются целыми месяцами в <archive_dir>/month=YYYY-MM/prices.parquet
+# (hive-разбиение: pyarrow.dataset / pandas.read_parquet читают весь каталог как одну таблицу)
+# и по желанию удаляются из SQLite — живая БД остаётся маленькой для записи. Отчёты читают
+# историю через load_history / load_history_frames: архив и SQLite сливаются по (товар, время),
+# замер, который есть и там и там (в том числе внутри интервала, свёрнутого compact-history уже
+# после выгрузки), отдаётся один раз — из SQLite. pyarrow нужен, только когда архив есть.
+
+import heapq
+import os
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+ARCHIVE_ROOT = Path("archive")
+ARCHIVE_FILE = "prices.parquet"
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Типы колонок ARCHIVE_COLUMNS обоих трекеров; даты — настоящий timestamp, а не текст
+_TYPES = {
+    "product_id": "int64", "name": "string", "price": "int64", "price_minor": "int64", "currency": "string",
+    "checked_at": "timestamp", "last_seen": "timestamp", "check_count": "int64", "id": "int64",
+}
+
+
+def require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Для Parquet (архив и выгрузка истории) нужен pyarrow: pip install pyarrow") from e
+    return pa, pc, pq
+
+
+def default_archive_dir(db_module) -> Path:
+    """archive/<имя файла БД> — у price_tracker и perfumex свои архивы."""
+    return ARCHIVE_ROOT / db_module.DB_PATH.stem
+
+
+def archive_cutoff(older_than_days: int, now: Optional[datetime] = None) -> str:
+    """Граница архива: начало месяца, в который попадает «сейчас минус N дней» (UTC) — только целые месяцы."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    return (now - timedelta(days=older_than_days)).strftime("%Y-%m-01 00:00:00")
+
+
+def _next_month(month: str) -> str:
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+
+def archive_files(archive_dir: Path, since: Optional[str] = None, until: Optional[str] = None) -> List[Path]:
+    """Файлы месяцев архива по порядку; с since/until — только месяцы, пересекающие [since, until)."""
+    files = []
+    for path in sorted(Path(archive_dir).glob(f"month=*/{ARCHIVE_FILE}")):
+        month = path.parent.name[len("month="):]
+        if since is not None and f"{_next_month(month)}-01 00:00:00" <= since:
+            continue
+        if until is not None and f"{month}-01 00:00:00" >= until:
+            continue
+        files.append(path)
+    return files
+
+
+def arrow_schema(columns: Sequence[str]):
+    """Схема pyarrow для колонок истории (HISTORY_COLUMNS / ARCHIVE_COLUMNS) — как в архиве."""
+    pa, _, _ = require_pyarrow()
+    types = {"int64": pa.int64(), "string": pa.string(), "timestamp": pa.timestamp("s")}
+    return pa.schema([(name, types[_TYPES[name]]) for name in columns])
+
+
+def to_arrow_table(db_module, rows: List[tuple], columns: Optional[Sequence[str]] = None):
+    """Строки iter_history(raw=True) -> pyarrow.Table со схемой архива; columns — другие колонки (HISTORY_COLUMNS)."""
+    pa, pc, _ = require_pyarrow()
+    arrays, fields = [], []
+    for name, values in zip(columns or db_module.ARCHIVE_COLUMNS, zip(*rows)):
+        if _TYPES[name] == "timestamp":
+            arr = pc.strptime(pa.array(values, type=pa.string()), format=TS_FORMAT, unit="s")
+        else:
+            arr = pa.array(values, type=getattr(pa, _TYPES[name])())
+        arrays.append(arr)
+        fields.append(pa.field(name, arr.type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def archive_history(db_module,
+                    older_than_days: int,
+                    archive_dir: Optional[Path] = None,
+                    prune: bool = False,
+                    chunk_size: int = 50_000) -> Tuple[int, int, List[Path]]:
+    """
+    Выгрузить замеры старше archive_cutoff(older_than_days) помесячно в Parquet. Месяц, уже бывший
+    в архиве, переписывается целиком: строки из SQLite заменяют свои копии (по id), остальные
+    сохраняются. prune=True — после записи всех файлов удалить выгруженное из SQLite
+    (db_module.prune_history). Возвращает (строк выгружено, строк удалено, записанные файлы).
+    """
+    pa, pc, pq = require_pyarrow()
+    archive_dir = Path(archive_dir or default_archive_dir(db_module))
+    cutoff = archive_cutoff(older_than_days)
+    first, _ = db_module.history_bounds()
+    if first is None or first >= cutoff:
+        return 0, 0, []
+
+    archived, files = 0, []
+    month = first[:7]
+    while f"{month}-01 00:00:00" < cutoff:
+        since, month = f"{month}-01 00:00:00", _next_month(month)
+        rows = db_module.iter_history(since=since, until=f"{month}-01 00:00:00", raw=True, page_size=chunk_size)
+        parts = []
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            parts.append(to_arrow_table(db_module, chunk))
+        if not parts:
+            continue
+        table = pa.concat_tables(parts)
+        archived += table.num_rows
+        path = archive_dir / f"month={since[:7]}" / ARCHIVE_FILE
+        if path.exists():
+            old = pq.read_table(path)
+            old = old.filter(pc.invert(pc.is_in(old["id"], value_set=table["id"])))
+            table = pa.concat_tables([old, table.cast(old.schema)])
+        # порядок строк — как у iter_history: по товару и времени (на нём держится слияние в load_history)
+        table = table.sort_by([("name", "ascending"), ("checked_at", "ascending"), ("id", "ascending")])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, path)
+        files.append(path)
+
+    pruned = db_module.prune_history(cutoff) if prune else 0
+    return archived, pruned, files
+
+
+def _iter_archive_file(db_module, path: Path, batch_size: int) -> Iterator[tuple]:
+    """Строки файла архива в виде iter_history(raw=True): даты — текстом 'YYYY-MM-DD HH:MM:SS'."""
+    pa, pc, pq = require_pyarrow()
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=list(db_module.ARCHIVE_COLUMNS)):
+        columns = []
+        for col in batch.columns:
+            if pa.types.is_timestamp(col.type):
+                col = pc.strftime(col.cast(pa.timestamp("s")), format=TS_FORMAT)
+            columns.append(col.to_pylist())
+        yield from zip(*columns)
+
+
+def _ts_ms(value: str) -> int:
+    """Текстовая дата (UTC, как отдаёт iter_history) -> миллисекунды Unix-времени."""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def load_history(db_module,
+                 archive_dir: Optional[Path] = None,
+                 expand: bool = False,
+                 page_size: int = 10_000,
+                 **filters) -> Iterator[tuple]:
+    """
+    История HISTORY_COLUMNS из SQLite и архива вместе — в порядке iter_history (имя товара, время).
+    filters — фильтры iter_history (product_ids, since, until, у perfumex ещё currency);
+    без файлов архива это просто db_module.iter_history.
+    """
+    archive_dir = Path(archive_dir or default_archive_dir(db_module))
+    files = archive_files(archive_dir, filters.get("since"), filters.get("until"))
+    if not files:
+        yield from db_module.iter_history(expand=expand, page_size=page_size, **filters)
+        return
+
+    columns = db_module.ARCHIVE_COLUMNS
+    n = len(db_module.HISTORY_COLUMNS)
+    ts = n - 1  # checked_at — последняя из HISTORY_COLUMNS
+    product_ids = None
+    if filters.get("product_ids") is not None:
+        filters["product_ids"] = list(filters["product_ids"])  # нужен дважды: SQLite и фильтр архива
+        product_ids = set(filters["product_ids"])
+    since, until = filters.get("since"), filters.get("until")
+    equal = [(columns.index(k), v) for k, v in filters.items()
+             if k not in ("product_ids", "since", "until") and v is not None]
+
+    def archived(path):
+        for row in _iter_archive_file(db_module, path, page_size):
+            if product_ids is not None and row[0] not in product_ids:
+                continue
+            if (since is not None and row[ts] < since) or (until is not None and row[ts] >= until):
+                continue
+            if all(row[i] == v for i, v in equal):
+                yield row
+
+    def keyed(rows, from_db):
+        for row in rows:
+            yield (row[1], _ts_ms(row[ts]), row[-1]), from_db, row
+
+    # Ключ слияния — (товар, время в мс, id), как упорядочен prices в v2 (текст v1 тоже приводится к мс).
+    # SQLite первым: при равном ключе heapq.merge отдаёт его строку (там актуальный last_seen)
+    streams = [keyed(db_module.iter_history(raw=True, page_size=page_size, **filters), True)]
+    streams += [keyed(archived(p), False) for p in files]
+    name, db_at, db_ids, covered = None, None, set(), -1
+    for (row_name, at, _), from_db, row in heapq.merge(*streams, key=lambda item: item[0]):
+        if row_name != name:
+            name, db_at, db_ids, covered = row_name, None, set(), -1
+        last_seen, check_count = row[n], row[n + 1]
+        if from_db:
+            if at != db_at:
+                db_at, db_ids = at, set()
+            db_ids.add(row[-1])
+            if last_seen is not None:
+                covered = max(covered, _ts_ms(last_seen))
+        elif (at == db_at and row[-1] in db_ids) or at <= covered:
+            continue  # замер уже есть в SQLite: та же строка (id) или вошёл в интервал после compact-history
+        yield row[:n]
+        if expand and check_count > 1 and last_seen is not None and last_seen > row[ts]:
+            yield (*row[:ts], last_seen)
+
+
+def archive_distinct(db_module, column: str, archive_dir: Optional[Path] = None) -> list:
+    """Разные значения колонки column по всем файлам архива ([] — архива нет); читается только она."""
+    files = archive_files(Path(archive_dir or default_archive_dir(db_module)))
+    if not files:
+        return []
+    pa, pc, pq = require_pyarrow()
+    values = set()
+    for path in files:
+        values.update(pc.unique(pq.read_table(path, columns=[column])[column]).to_pylist())
+    return list(values)
+
+def load_history_frames(db_module,
+                        chunk_size: int = 10_000,
+                        archive_dir: Optional[Path] = None,
+                        **filters) -> Iterator:
+    """load_history() пачками pandas.DataFrame с колонками HISTORY_COLUMNS — для листа «История»."""
+    archive_dir = Path(archive_dir or default_archive_dir(db_module))
+    if not archive_files(archive_dir, filters.get("since"), filters.get("until")):
+        yield from db_module.iter_history_frames(chunk_size=chunk_size, **filters)
+        return
+    import pandas as pd
+
+    rows = load_history(db_module, archive_dir, page_size=chunk_size, **filters)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield pd.DataFrame(chunk, columns=list(db_module.HISTORY_COLUMNS))
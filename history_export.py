@@ -0,0 +1,130 @@
+# history_export.py — выгрузка истории цен в CSV / JSON Lines / Parquet (команда export)
+#
+# Для BI и аналитики: история идёт потоком из SQLite и архива Parquet (load_history) прямо в файл,
+# без pandas и openpyxl — память не зависит от размера истории, и нет предела строк листа Excel.
+# Колонки — HISTORY_COLUMNS трекера как есть (цены в копейках / минорных единицах, даты UTC).
+# CSV и JSONL можно сжать gzip или zstd; у Parquet это кодек сжатия внутри файла.
+
+import argparse
+import csv
+import gzip
+import json
+import os
+from itertools import islice
+from pathlib import Path
+from typing import Optional, Tuple
+
+from history_archive import arrow_schema, load_history, require_pyarrow, to_arrow_table
+from history_import import normalize_checked_at
+
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+COMPRESSIONS = ("gzip", "zstd")
+_SUFFIXES = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+EXPORT_BATCH = 50_000
+
+
+def guess_format(out_path: Path) -> Tuple[Optional[str], Optional[str]]:
+    """(формат, сжатие) по имени файла: history.csv.gz -> ('csv', 'gzip'); неизвестное — None."""
+    suffixes = [s.lower() for s in Path(out_path).suffixes]
+    compression = _SUFFIXES.get(suffixes[-1]) if suffixes else None
+    if compression:
+        suffixes = suffixes[:-1]
+    fmt = suffixes[-1].lstrip(".") if suffixes else None
+    if fmt == "ndjson":
+        fmt = "jsonl"
+    return (fmt if fmt in EXPORT_FORMATS else None), compression
+
+
+def checked_at_arg(value: str) -> Optional[str]:
+    """type= для --since/--until: дата в формате checked_at или понятная ошибка argparse вместо трейсбэка."""
+    try:
+        return normalize_checked_at(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"неверная дата {value!r}: нужен формат ГГГГ-ММ-ДД или ГГГГ-ММ-ДД ЧЧ:ММ:СС (UTC)"
+        ) from None
+
+
+def _open_text(path: Path, compression: Optional[str]):
+    if compression is None:
+        return path.open("w", encoding="utf-8", newline="")
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6)
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.open(path, "wt", encoding="utf-8", newline="")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("Для сжатия zstd нужен zstandard: pip install zstandard") from e
+    return zstandard.open(path, "wt", encoding="utf-8", newline="")
+
+
+def _write_csv(f, columns, rows) -> int:
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    n = 0
+    while True:
+        chunk = list(islice(rows, EXPORT_BATCH))
+        if not chunk:
+            return n
+        writer.writerows(chunk)
+        n += len(chunk)
+
+
+def _write_jsonl(f, columns, rows) -> int:
+    n = 0
+    for row in rows:
+        f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        f.write("\n")
+        n += 1
+    return n
+
+
+def _write_parquet(db_module, path: Path, columns, rows, compression: Optional[str]) -> int:
+    _, _, pq = require_pyarrow()
+    n = 0
+    with pq.ParquetWriter(path, arrow_schema(columns), compression=compression or "snappy") as writer:
+        while True:
+            chunk = list(islice(rows, EXPORT_BATCH))
+            if not chunk:
+                return n
+            writer.write_table(to_arrow_table(db_module, chunk, columns))
+            n += len(chunk)
+
+
+def export_history(db_module,
+                   out_path: Path,
+                   fmt: str = "csv",
+                   compression: Optional[str] = None,
+                   expand: bool = False,
+                   archive_dir: Optional[Path] = None,
+                   **filters) -> int:
+    """
+    Записать историю HISTORY_COLUMNS в out_path потоком (сначала во временный файл рядом, потом
+    переименование — оборванная выгрузка не оставит половину файла). fmt — из EXPORT_FORMATS,
+    compression — None или из COMPRESSIONS; filters — фильтры load_history (product_ids, since,
+    until, у perfumex ещё currency). Возвращает число строк.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt!r}")
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Неизвестное сжатие: {compression!r}")
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    columns = list(db_module.HISTORY_COLUMNS)
+    rows = load_history(db_module, archive_dir, expand=expand, **filters)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    try:
+        if fmt == "parquet":
+            n = _write_parquet(db_module, tmp, columns, rows, compression)
+        else:
+            with _open_text(tmp, compression) as f:
+                n = (_write_csv if fmt == "csv" else _write_jsonl)(f, columns, rows)
+        os.replace(tmp, out_path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return n
@@ -0,0 +1,88 @@
+# history_import.py — загрузка истории цен из CSV (import-csv)
+#
+# Понимает выгрузки других трекеров и лист «История» из нашего отчёта, сохранённый как CSV:
+# колонки ищутся по имени (name/Товар, price/Цена, currency/Валюта, checked_at/Когда проверено),
+# разделитель — запятая или точка с запятой. Строки с неразобранной датой пропускаются, как и с ценой. Строки идут пачками через upsert_products +
+# insert_prices, поэтому миллион строк грузится за секунды, а не часы.
+
+import csv
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+COLUMN_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "name": ("name", "product", "товар"),
+    "price": ("price", "цена", "цена (₽)"),
+    "price_minor": ("price_minor",),
+    "currency": ("currency", "валюта"),
+    "checked_at": ("checked_at", "когда проверено", "date", "дата"),
+}
+
+
+# Кроме ISO 8601 понимаем даты, как их показывает Excel с русской локалью (лист «История» в CSV)
+CHECKED_AT_FORMATS = ("%Y-%m-%d %H:%M:%S", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y")
+
+
+def normalize_checked_at(value: Optional[str]) -> Optional[str]:
+    """
+    Дата в формате, в котором её пишет SQLite datetime('now'): 'YYYY-MM-DD HH:MM:SS' (UTC).
+    Пусто — None (будет «сейчас»); даты с часовым поясом переводятся в UTC.
+    Не дата — ValueError (в prices такая строка сломала бы latest_prices и агрегаты).
+    """
+    value = (value or "").strip()
+    if not value:
+        return None
+    for fmt in CHECKED_AT_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def read_csv_rows(path: Path) -> Iterator[Dict[str, str]]:
+    """Строки CSV как словари с каноническими ключами из COLUMN_ALIASES (прочие колонки отбрасываются)."""
+    with Path(path).open(encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t") if sample else csv.excel
+        reader = csv.reader(f, dialect)
+        header = next(reader, None)
+        if header is None:
+            return
+        lookup = {alias: key for key, aliases in COLUMN_ALIASES.items() for alias in aliases}
+        columns = [(i, lookup[h.strip().lower()]) for i, h in enumerate(header) if h.strip().lower() in lookup]
+        if "name" not in {k for _, k in columns}:
+            raise ValueError(f"В {path} нет колонки с названием товара (name / Товар)")
+        for raw in reader:
+            if raw:
+                yield {key: raw[i] for i, key in columns if i < len(raw)}
+
+
+def import_rows(db_module,
+                rows: Iterable[tuple],
+                chunk_size: int = DEFAULT_CHUNK_SIZE,
+                on_chunk: Optional[Callable[[int], None]] = None) -> Tuple[int, int]:
+    """
+    rows: (name, *поля цены, checked_at) — как ждёт db_module.insert_prices после замены name на id.
+    Возвращает (товаров в файле, вставлено цен).
+    """
+    names_seen = set()
+    inserted = 0
+    it = iter(rows)
+    while True:
+        chunk: List[tuple] = list(islice(it, chunk_size))
+        if not chunk:
+            break
+        ids = db_module.upsert_products(r[0] for r in chunk)
+        names_seen.update(ids)
+        inserted += db_module.insert_prices((ids[r[0]], *r[1:]) for r in chunk)
+        if on_chunk:
+            on_chunk(inserted)
+    return len(names_seen), inserted
@@ -0,0 +1,113 @@
+# http_fetch.py — быстрый путь без браузера: HTTP GET + те же локаторы по готовому HTML
+
+from typing import Optional, Tuple
+
+import requests
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
+from selenium.webdriver.common.by import By
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "ru-RU,ru;q=0.9,en;q=0.8",
+}
+
+
+class HttpFetcher:
+    """
+    requests.Session с пулом keep-alive соединений: TCP/TLS-рукопожатие делается
+    один раз на хост, а не на каждый товар. Потокобезопасен для GET-запросов,
+    поэтому один экземпляр можно отдать всем воркерам.
+    """
+
+    def __init__(self, timeout: float = 15, pool_size: int = 10, headers: Optional[dict] = None):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get_html(self, url: str) -> str:
+        return self.fetch(url)[0]
+
+    def fetch(self, url: str,
+              etag: Optional[str] = None,
+              last_modified: Optional[str] = None) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """
+        Условный GET: (html, etag, last_modified). html=None — сервер ответил 304 Not Modified.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        resp = self.session.get(url, timeout=self.timeout, headers=headers or None)
+        if resp.status_code == 304:
+            return None, etag, last_modified
+        resp.raise_for_status()
+        if not resp.encoding or resp.encoding.lower() == "iso-8859-1":
+            resp.encoding = resp.apparent_encoding
+        return resp.text, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+
+    def load_cookies(self, cookies: list) -> None:
+        """Перенести куки из браузера (driver.get_cookies()) — например, авторизацию perfumex."""
+        for c in cookies:
+            self.session.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path", "/"))
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "HttpFetcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def parse_document(page_html: str):
+    return lxml_html.fromstring(page_html)
+
+
+def _normalize(text: str) -> str:
+    # Как .text у Selenium: переносы/табы/NBSP схлопываются в один пробел
+    return " ".join(text.replace(" ", " ").split())
+
+
+def find_text(doc, locator: tuple) -> Optional[str]:
+    """
+    Применяет Selenium-локатор (By.XPATH / By.CSS_SELECTOR / By.ID / By.CLASS_NAME)
+    к разобранному документу. Возвращает текст первого непустого узла или None.
+    """
+    by, value = locator
+    if by == By.XPATH:
+        nodes = doc.xpath(value)
+    elif by == By.CSS_SELECTOR:
+        nodes = doc.cssselect(value)
+    elif by == By.ID:
+        nodes = doc.xpath("//*[@id=$v]", v=value)
+    elif by == By.CLASS_NAME:
+        nodes = doc.xpath("//*[contains(concat(' ', normalize-space(@class), ' '), $v)]", v=f" {value} ")
+    else:
+        raise ValueError(f"Локатор {by!r} не поддерживается в HTTP-режиме")
+
+    for node in nodes:
+        text = _normalize(node.text_content() if hasattr(node, "text_content") else str(node))
+        if text:
+            return text
+    return None
+
+
+def find_fields(doc, fields: dict) -> Optional[dict]:
+    """Все поля спецификации {имя: локатор} разом; None, если хоть одного нет."""
+    out = {}
+    for name, locator in fields.items():
+        text = find_text(doc, locator)
+        if not text:
+            return None
+        out[name] = text
+    return out
@@ -0,0 +1,156 @@
+# ingest_queue.py — запись цен в БД одним потоком-писателем (fetch)
+#
+# Воркеры fetch не пишут в prices сами: put() ставит запись в ограниченную очередь (если она
+# полна, воркер ждёт — backpressure), а один поток забирает записи пачками и пишет их
+# db_module.ingest_rows() одной транзакцией. Так нет ни `database is locked` между воркерами,
+# ни fsync на каждую цену.
+#
+# Перед постановкой в очередь запись с порядковым номером дописывается в spill-файл (JSONL рядом
+# с БД). Номер последней записанной пачки лежит в meta в той же транзакции, что и цены, поэтому
+# если процесс упал, при следующем старте из spill-файла дописывается только недошедший хвост —
+# без потерь и без дублей. После штатного close() файл удаляется.
+#
+# put(row, on_written) — on_written() вызывается писателем, когда пачка с этой записью уже в БД
+# (так fetch отмечает страницу в change_cache только после реальной записи цены).
+
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+_STOP = object()
+
+
+def now_text() -> str:
+    """Время замера в формате checked_at ('YYYY-MM-DD HH:MM:SS', UTC) — фиксируется в момент fetch."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def default_spill_path(db_module) -> Path:
+    return db_module.DB_PATH.with_suffix(".ingest.jsonl")
+
+
+class IngestQueue:
+    """
+    `with IngestQueue(db) as ingest: ingest.put((name, price, checked_at))` — формат записи как
+    у db_module.ingest_rows. Выход из with дописывает очередь до конца.
+    """
+
+    def __init__(self,
+                 db_module,
+                 maxsize: int = DEFAULT_QUEUE_SIZE,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 spill_path: Optional[Path] = None):
+        self.db = db_module
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.spill_path = Path(spill_path or default_spill_path(db_module))
+        self._queue: "queue.Queue" = queue.Queue(maxsize)
+        self._lock = threading.Lock()  # номер, строка spill-файла и место в очереди — в одном порядке
+        self._seq = 0
+        self._spill = None
+        self._thread: Optional[threading.Thread] = None
+        self.error: Optional[BaseException] = None
+        self.written = 0
+        self.replayed = 0
+        self.batches = 0
+
+    def __enter__(self) -> "IngestQueue":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def start(self) -> None:
+        self.replayed = self._replay()
+        self._seq = max(self._seq, self.db.ingest_seq())
+        self._spill = self.spill_path.open("a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def _replay(self) -> int:
+        """Дописать записи spill-файла, которые не дошли до БД в прошлый раз. Возвращает их число."""
+        if not self.spill_path.exists():
+            return 0
+        done = self.db.ingest_seq()
+        pending: List[Tuple[int, tuple, None]] = []
+        with self.spill_path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    seq, row = json.loads(line)
+                except ValueError:
+                    break  # строка оборвана — процесс упал на середине записи
+                self._seq = max(self._seq, seq)
+                if seq > done:
+                    pending.append((seq, tuple(row), None))
+        for i in range(0, len(pending), self.batch_size):
+            self._write(pending[i:i + self.batch_size])
+        self.spill_path.unlink()
+        return len(pending)
+
+    def put(self, row: tuple, on_written: Optional[Callable[[], None]] = None) -> None:
+        """
+        Поставить запись в очередь; если очередь полна — ждать писателя.
+        on_written() вызовется из потока-писателя после того, как запись попала в БД.
+        """
+        if self.error is not None:
+            raise RuntimeError(f"Запись в БД остановлена: {self.error}") from self.error
+        with self._lock:
+            self._seq += 1
+            self._spill.write(json.dumps([self._seq, row], ensure_ascii=False) + "\n")
+            self._spill.flush()
+            self._queue.put((self._seq, row, on_written))
+
+    def _write(self, batch: List[Tuple[int, tuple, Optional[Callable[[], None]]]]) -> None:
+        self.db.ingest_rows([row for _, row, _ in batch], batch[-1][0])
+        self.written += len(batch)
+        self.batches += 1
+        for _, _, on_written in batch:
+            if on_written is not None:
+                try:
+                    on_written()
+                except Exception:
+                    pass  # цены уже в БД; не отмеченная страница просто обработается заново
+
+    def _run(self) -> None:
+        batch: List[Tuple[int, tuple, Optional[Callable[[], None]]]] = []
+        deadline = 0.0
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()) if batch else None)
+            except queue.Empty:
+                item = None
+            if item is not _STOP and item is not None:
+                if self.error is not None:
+                    continue  # после ошибки только освобождаем очередь: записи остались в spill-файле
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            if batch and (item is _STOP or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    self.error = e
+                batch = []
+            if item is _STOP:
+                return
+
+    def close(self) -> None:
+        """Дописать очередь и остановить писателя; spill-файл удаляется, если всё записано."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._spill.close()
+        if self.error is None:
+            self.spill_path.unlink(missing_ok=True)
@@ -1,4 +1,7 @@
 from selenium.webdriver.common.by import By
 
 price = (By.XPATH, "//span[contains(@class, 'price__new-val') and contains(text(), '₽')]")
-product = (By.XPATH, "//h1[contains(@class, 'switcher-title')]")
\ No newline at end of file
+product = (By.XPATH, "//h1[contains(@class, 'switcher-title')]")
+
+# Поля карточки для извлечения за один проход (extract.extract_fields / http_fetch.find_fields)
+FIELDS = {"name": product, "price": price}
@@ -3,16 +3,27 @@ import json
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options as ChromeOptions
 from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
 import db
 import locators
+from browser_profiles import PROFILES, apply_profile, after_start
+from extract import extract_fields
+from fetch_metrics import NULL_METRICS, RunMetrics
+from change_cache import ChangeCache, UNCHANGED, fetch_html
+from db_session import DEFAULT_COMMIT_EVERY, DEFAULT_COMMIT_INTERVAL
+from driver_pool import DriverPool, DEFAULT_MAX_PAGES
+from fetch_runner import run_groups
+from history_export import COMPRESSIONS, EXPORT_FORMATS, checked_at_arg
+from history_import import DEFAULT_CHUNK_SIZE
+from ingest_queue import DEFAULT_QUEUE_SIZE, IngestQueue, now_text
+from report_cache import HISTORY_SHEET_ROWS
+from url_health import UrlHealth, check_cancelled, try_urls
 from utils import parse_rub
 
 DEFAULT_URLS_FILE = Path("urls.json")
@@ -58,8 +69,11 @@ def load_links_txt(links_file: Path):
 
 def build_driver(browser: str = "chrome",
                  headless: bool = True,
-                 driver_path: str | None = None) -> webdriver.Chrome:
+                 driver_path: str | None = None,
+                 profile: str = "full") -> webdriver.Chrome:
     """
+    profile — профиль загрузки страниц (см. browser_profiles.py): full / lean.
+
     Поддержка:
       - macOS + Chrome (Selenium Manager подтянет chromedriver автоматически)
       - macOS + Yandex Browser (Chromium-based)
@@ -68,7 +82,7 @@ def build_driver(browser: str = "chrome",
       - Windows (оставлены закомментированные примеры путей для быстрого переключения)
     """
     options = ChromeOptions()
-    options.add_argument("--window-size=1920,1080")
+    apply_profile(options, profile)
     if headless:
         options.add_argument("--headless=new")
 
@@ -94,10 +108,12 @@ def build_driver(browser: str = "chrome",
 
         if driver_path and Path(driver_path).exists():
             service = ChromeService(executable_path=driver_path)
-            return webdriver.Chrome(service=service, options=options)
+            driver = webdriver.Chrome(service=service, options=options)
         else:
             # Фоллбэк: пусть Selenium сам попробует подобрать драйвер
-            return webdriver.Chrome(options=options)
+            driver = webdriver.Chrome(options=options)
+        after_start(driver, profile)
+        return driver
 
     # ---- Chrome (по умолчанию) ----
     # macOS / Windows: Selenium Manager подтянет chromedriver сам при наличии Google Chrome
@@ -106,31 +122,83 @@ def build_driver(browser: str = "chrome",
     #   options.binary_location = r"C:\Program Files\Google\Chrome\Application\chrome.exe"
     # Windows (Yandex) — если вдруг понадобится:
     #   options.binary_location = r"C:\Users\%USERNAME%\AppData\Local\Yandex\YandexBrowser\Application\browser.exe"
-    return webdriver.Chrome(options=options)
+    driver = webdriver.Chrome(options=options)
+    after_start(driver, profile)
+    return driver
 
 
 def fetch_once(url: str, timeout: int = 30,
                browser: str = "chrome",
                headless: bool = True,
-               driver_path: str | None = None) -> tuple[str, int]:
-    driver = build_driver(browser=browser, headless=headless, driver_path=driver_path)
-    driver.get(url)
+               driver_path: str | None = None,
+               driver: webdriver.Chrome | None = None,
+               metrics=NULL_METRICS) -> tuple[str, int]:
+    """
+    Если передан `driver` (например, из DriverPool) — используем его и не закрываем.
+    Иначе поднимаем отдельный браузер только на этот URL.
+    metrics — fetch_metrics.RunMetrics для замеров по фазам.
+    """
+    own_driver = driver is None
+    if own_driver:
+        with metrics.span("build_driver", url):
+            driver = build_driver(browser=browser, headless=headless, driver_path=driver_path)
     try:
-        WebDriverWait(driver, timeout).until(EC.visibility_of_element_located(locators.product))
-        name = driver.find_element(*locators.product).text.strip()
-        WebDriverWait(driver, timeout).until(EC.visibility_of_element_located(locators.price))
-        price_text = driver.find_element(*locators.price).text.strip()
-        price_val = parse_rub(price_text)
+        check_cancelled()
+        with metrics.span("navigation", url):
+            driver.get(url)
+        # Название и цена — одним ожиданием/скриптом, а не двумя WebDriverWait + find_element
+        with metrics.span("extract", url):
+            fields = extract_fields(driver, locators.FIELDS, timeout=timeout)
+        name = fields["name"]
+        price_text = fields["price"]
+        with metrics.span("parse", url):
+            price_val = parse_rub(price_text)
         if price_val is None:
             raise ValueError(f"Не удалось распарсить цену: '{price_text}'")
         return name, price_val
     finally:
-        driver.quit()
+        if own_driver:
+            driver.quit()
 
 
-def cmd_init_db(_: argparse.Namespace) -> None:
-    db.init_db()
-    print(f"Инициализация БД: {db.DB_PATH.resolve()}")
+def fetch_http(url: str, fetcher, cache=None, metrics=NULL_METRICS):
+    """
+    Быстрый путь без браузера: GET + те же локаторы по серверному HTML.
+    Возвращает (name, price), None — если на странице нет нужных узлов (нужен JS),
+    тогда вызывающий код идёт в Selenium; change_cache.UNCHANGED — сервер ответил 304.
+    Сетевые ошибки пробрасываются как есть.
+    """
+    from http_fetch import parse_document, find_fields
+
+    with metrics.span("http", url):
+        page_html = fetch_html(fetcher, url, cache)
+    if page_html is UNCHANGED:
+        return UNCHANGED
+    with metrics.span("extract", url):
+        fields = find_fields(parse_document(page_html), locators.FIELDS)
+    if fields is None:
+        return None
+    name, price_text = fields["name"], fields["price"]
+    with metrics.span("parse", url):
+        price_val = parse_rub(price_text)
+    if price_val is None:
+        return None
+    return name, price_val
+
+
+def cmd_init_db(args: argparse.Namespace) -> None:
+    db.init_db(schema=args.schema)
+    print(f"Инициализация БД: {db.DB_PATH.resolve()} (схема v{db.schema_version()})")
+
+
+def cmd_migrate_db(_: argparse.Namespace) -> None:
+    size_before = db.DB_PATH.stat().st_size if db.DB_PATH.exists() else 0
+    moved = db.migrate_to_v2()
+    if not moved and db.schema_version() >= 2:
+        print(f"БД уже в схеме v2: {db.DB_PATH.resolve()}")
+        return
+    size_after = db.DB_PATH.stat().st_size
+    print(f"БД переведена на схему v2: {moved} цен, размер {size_before / 1e6:.1f} → {size_after / 1e6:.1f} МБ")
 
 
 def _iterate_entries_from_json(cfg_json):
@@ -169,39 +237,247 @@ def cmd_fetch(args: argparse.Namespace) -> None:
         print("Список ссылок пуст. Добавьте их в links.txt или urls.json (или data.url*).")
         return
 
-    for conf_name, urls in entries:
-        title = conf_name or "auto (name со страницы)"
-        print(f"→ Обрабатываю группу: {title}")
-        last_error = None
-        fetched = False
-        for url in urls:
-            print(f"   Пробую URL: {url}")
+    metrics = RunMetrics("dnkparfum")
+    total_groups = len(entries)
+
+    def _new_driver() -> webdriver.Chrome:
+        with metrics.span("build_driver"):
+            return build_driver(browser=args.browser, headless=not args.headful,
+                                driver_path=args.driver_path, profile=args.profile)
+
+    # Браузеры поднимаются один раз и переиспользуются для всех URL (включая фоллбэки)
+    workers = max(1, args.workers)
+    pool = DriverPool(
+        _new_driver,
+        size=workers * max(1, args.race),
+        max_pages=args.recycle_after,
+    )
+    # Цены пишет один поток пачками; воркеры только ставят их в очередь
+    ingest = IngestQueue(db, maxsize=args.queue_size, batch_size=args.commit_every,
+                         flush_interval=args.commit_interval)
+    fetcher = None
+    if args.engine in ("http", "async"):
+        from http_fetch import HttpFetcher
+        fetcher = HttpFetcher(pool_size=max(10, workers))
+
+    cache = ChangeCache(db) if args.skip_unchanged else None
+    health = None if args.keep_order else UrlHealth(db)
+
+    def store(url: str, scraped_name: str, price_val: int, log) -> None:
+        with metrics.span("db", url):
+            if cache is not None and cache.unchanged(url, scraped_name, price_val):
+                cache.commit(url, scraped_name, price_val)
+                log(f"   Без изменений: {scraped_name} — {price_val} ₽")
+                return
+            prev = db.latest_price_by_name(scraped_name)  # уникальность по имени товара
+            # страницу в кэше отмечаем, только когда писатель действительно записал цену в БД
+            on_written = None if cache is None else (lambda: cache.commit(url, scraped_name, price_val))
+            ingest.put((scraped_name, price_val, now_text()), on_written)
+        log(f"   ОК: {scraped_name} — {price_val} ₽ (предыдущее: {prev if prev is not None else '—'})")
+
+    def scrape(url: str, log):
+        if args.engine == "http":
             try:
-                scraped_name, price_val = fetch_once(
-                    url,
-                    browser=args.browser,
-                    headless=not args.headful,
-                    driver_path=args.driver_path
-                )
-                pid = db.upsert_product(scraped_name)  # уникальность по имени товара
-                latest, prev = db.latest_and_previous_price(pid)
-                db.insert_price(pid, price_val)
-                print(f"   ОК: {scraped_name} — {price_val} ₽ (предыдущее: {prev if prev is not None else '—'})")
-                fetched = True
-                break  # первый удачный URL из фоллбэков
+                result = fetch_http(url, fetcher, cache, metrics)
             except Exception as e:
-                last_error = e
-                print(f"   Ошибка: {e}")
-        if not fetched:
-            print(f"   Не удалось получить цену ни по одному URL. Последняя ошибка: {last_error}")
+                result = None
+                log(f"   HTTP: {e}")
+            if result is not None:
+                return result
+            log("   HTTP: локаторы не найдены в HTML — открываю в браузере")
+        check_cancelled()  # гонку уже выиграл другой URL — браузер из пула не занимаем
+        with pool.driver() as driver:
+            return fetch_once(url, driver=driver, metrics=metrics)
+
+    def handle_group(entry, log) -> None:
+        conf_name, urls = entry
+        title = conf_name or "auto (name со страницы)"
+        log(f"→ Обрабатываю группу: {title}")
+        try:
+            # самый быстрый из рабочих URL — первым; с --race K первые K запускаются наперегонки
+            url, result = try_urls(urls, lambda u: scrape(u, log), log, health, race=args.race)
+        except Exception as e:
+            log(f"   Не удалось получить цену ни по одному URL. Последняя ошибка: {e}")
+            return
+        if result is UNCHANGED:
+            log("   Без изменений (304 Not Modified)")
+            return
+        try:
+            store(url, *result, log)
+        except Exception as e:
+            log(f"   Ошибка: {e}")
+
+    # Одно соединение с БД на весь прогон: записи уходят пачками, а не коммитом на каждую цену
+    with db.session(commit_every=args.commit_every, commit_interval=args.commit_interval), ingest:
+        if ingest.replayed:
+            print(f"Дописаны цены прошлого прерванного запуска: {ingest.replayed}")
+        try:
+            if args.engine == "async":
+                entries = _fetch_async_stage(entries, fetcher, cache, health, metrics, args, store)
+                if entries:
+                    print(f"→ Без цены в HTML осталось товаров: {len(entries)} — обрабатываю в браузере")
+            with pool:  # браузер поднимается лениво — только если HTTP-путь не справился
+                run_groups(entries, handle_group, workers=workers)
+        finally:
+            if fetcher is not None:
+                fetcher.close()
+            if health is not None:
+                health.flush()
+    if ingest.error is not None:
+        print(f"Не все цены записаны в БД ({ingest.error}). Они сохранены в {ingest.spill_path} "
+              "и будут дописаны при следующем запуске fetch")
+    with metrics.span("db"):
+        db.refresh_rollups()  # агрегаты по дням/неделям/месяцам — только затронутые периоды
+    if cache is not None:
+        print(f"Пропущено без изменений: {cache.skipped}")
+    if args.metrics_out:
+        metrics.print_summary()
+        metrics.write_json(Path(args.metrics_out), engine=args.engine, workers=workers, groups=total_groups)
+        print(f"Замеры сохранены: {Path(args.metrics_out).resolve()}")
+
+
+def _fetch_async_stage(entries, fetcher, cache, health, metrics, args: argparse.Namespace, store):
+    """
+    Все группы разом через asyncio-движок с лимитами на хост.
+    Возвращает группы, по которым цену в HTML найти не удалось, — их добивает браузер.
+    """
+    from async_fetch import AsyncFetchEngine, load_host_limits
+
+    limits = load_host_limits(Path(args.host_limits) if args.host_limits else None)
+    engine = AsyncFetchEngine(lambda url: fetch_http(url, fetcher, cache, metrics), limits=limits,
+                              on_attempt=health.record if health else None)
+    leftovers = []
+    # store() читает SQLite и ждёт места в очереди ingest — в event loop это тормозило бы все загрузки.
+    # Один поток-писатель: цены пишутся по одной, в порядке готовности групп
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+
+    def write(url: str, result: tuple, lines: list[str]) -> None:
+        try:
+            store(url, *result, lines.append)
+        except Exception as e:
+            lines.append(f"   Ошибка записи в БД: {e}")
+        print("\n".join(lines))
+
+    def on_done(i: int, outcome) -> None:
+        conf_name, urls = entries[i]
+        lines = [f"→ Группа: {conf_name or urls[0]}"]
+        lines += [f"   HTTP: {err}" for err in outcome.errors]
+        if outcome.result is UNCHANGED:
+            lines.append("   Без изменений (304 Not Modified)")
+        elif outcome.result is not None:
+            writer.submit(write, outcome.url, outcome.result, lines)
+            return
+        else:
+            leftovers.append(i)
+        print("\n".join(lines))
+
+    with writer:
+        engine.run_groups([health.order(urls) if health else urls for _, urls in entries], on_done)
+    return [entries[i] for i in sorted(leftovers)]
+
+
+def cmd_rebuild_latest(args: argparse.Namespace) -> None:
+    db.init_db()
+    if args.check:
+        bad = db.check_latest_prices()
+        print(f"Текущие цены расходятся с историей у {len(bad)} товаров" + (f": {bad[:20]}" if bad else ""))
+        return
+    count = db.rebuild_latest_prices()
+    print(f"Таблица текущих цен пересобрана: {count} товаров")
+
+
+def cmd_history_mode(args: argparse.Namespace) -> None:
+    db.init_db()
+    if args.mode:
+        db.set_history_mode(args.mode)
+    print(f"Режим хранения истории: {db.history_mode()}")
+
+
+def cmd_compact_history(_: argparse.Namespace) -> None:
+    db.init_db()
+    size_before = db.DB_PATH.stat().st_size
+    before, after = db.compact_history()
+    db.set_history_mode("intervals")
+    db.refresh_rollups()
+    db.vacuum()
+    size_after = db.DB_PATH.stat().st_size
+    print(f"История свёрнута: строк {before} → {after}, размер {size_before / 1e6:.1f} → {size_after / 1e6:.1f} МБ; "
+          "дальше одинаковые цены подряд продлевают последнюю строку (режим intervals)")
+
+
+def cmd_backfill_rollups(_: argparse.Namespace) -> None:
+    db.init_db()
+    written = db.refresh_rollups(full=True)
+    print(f"Агрегаты по дням/неделям/месяцам пересчитаны: {written} строк")
+
+
+def cmd_archive_history(args: argparse.Namespace) -> None:
+    from history_archive import archive_cutoff, archive_history
+
+    db.init_db()
+    size_before = db.DB_PATH.stat().st_size
+    archived, pruned, files = archive_history(db, args.older_than, archive_dir=args.archive_dir, prune=args.prune)
+    if pruned:
+        db.vacuum()
+    print(f"В архив (до {archive_cutoff(args.older_than)[:10]}) выгружено строк: {archived}, файлов месяцев: {len(files)}")
+    if args.prune:
+        size_after = db.DB_PATH.stat().st_size
+        print(f"Удалено из БД строк: {pruned}, размер {size_before / 1e6:.1f} → {size_after / 1e6:.1f} МБ")
+
+
+def cmd_export(args: argparse.Namespace) -> None:
+    from history_export import export_history, guess_format
+
+    db.init_db()
+    out_path = Path(args.output)
+    fmt, compression = guess_format(out_path)
+    fmt, compression = args.format or fmt or "csv", args.compression or compression
+    filters = {"since": args.since, "until": args.until}
+    if args.product:
+        filters["product_ids"] = db.find_products(args.product)
+        if not filters["product_ids"]:
+            print("Товары по --product не найдены, выгружать нечего.")
+            return
+    written = export_history(db, out_path, fmt, compression, expand=args.expand_history,
+                             archive_dir=args.archive_dir, **filters)
+    print(f"Выгружено строк: {written} → {out_path.resolve()} ({fmt}" + (f", {compression})" if compression else ")"))
+
+
+def cmd_import_csv(args: argparse.Namespace) -> None:
+    from history_import import import_rows, normalize_checked_at, read_csv_rows
+
+    db.init_db()
+    bad = 0
+
+    def rows():
+        nonlocal bad
+        for r in read_csv_rows(Path(args.csv)):
+            name, price = (r.get("name") or "").strip(), parse_rub(r.get("price", ""))
+            try:
+                checked_at = normalize_checked_at(r.get("checked_at"))
+            except ValueError:
+                price = None  # дата не разобрана — строка пропускается, как с плохой ценой
+            if not name or price is None:
+                bad += 1
+                continue
+            yield name, price, checked_at
+
+    with db.session():
+        products, inserted = import_rows(db, rows(), chunk_size=args.chunk_size,
+                                         on_chunk=lambda n: print(f"   загружено строк: {n}"))
+    db.refresh_rollups()
+    print(f"Импорт завершён: {inserted} цен по {products} товарам" + (f", пропущено строк: {bad}" if bad else ""))
 
 
 def cmd_report(args: argparse.Namespace) -> None:
     from report import build_excel_report
+    db.init_db()
+    db.refresh_rollups()
     out_path = Path(args.output)
     try:
-        out_path = build_excel_report(out_path)
-        print(f"Отчёт сформирован: {out_path.resolve()}")
+        build_excel_report(out_path, expand_history=args.expand_history, full=args.full,
+                           history_rows=args.sheet_rows, shard_files=args.shard_files, months=args.months,
+                           log=lambda message: print(f"{message}: {out_path.resolve()}"))
     except PermissionError:
         print(
             "Не удалось записать файл отчёта. Похоже, он сейчас открыт в Excel/Numbers.\n"
@@ -214,8 +490,14 @@ def main():
     sub = parser.add_subparsers(required=True)
 
     p1 = sub.add_parser("init-db", help="Создать/инициализировать БД")
+    p1.add_argument("--schema", type=int, default=1, choices=[1, 2],
+                    help="2 — время замера целым числом (мс) и покрывающий индекс: компактнее и быстрее "
+                         "на большой истории. Действует только для новой БД, старую переводит migrate-db.")
     p1.set_defaults(func=cmd_init_db)
 
+    p6 = sub.add_parser("migrate-db", help="Перевести существующую БД на схему v2 (на месте)")
+    p6.set_defaults(func=cmd_migrate_db)
+
     p2 = sub.add_parser("fetch", help="Собрать данные (скрапинг) и записать в БД")
     p2.add_argument("--urls", default=str(DEFAULT_URLS_FILE), help="Файл со списком URL (urls.json)")
     p2.add_argument("--links", default=None, help="Простой текстовый файл со ссылками (links.txt)")
@@ -226,12 +508,103 @@ def main():
                     help="Запуск с окном браузера (по умолчанию headless).")
     p2.add_argument("--driver-path", default=None,
                     help="Путь к драйверу (например, yandexdriver на macOS). Можно вместо этого задать переменную YA_DRIVER.")
+    p2.add_argument("--profile", default="full", choices=PROFILES,
+                    help="Профиль загрузки страниц: full — целиком (по умолчанию); lean — без картинок/шрифтов/"
+                         "счётчиков и без ожидания полной загрузки.")
+    p2.add_argument("--recycle-after", type=int, default=DEFAULT_MAX_PAGES,
+                    help=f"Перезапускать браузер после N страниц (по умолчанию {DEFAULT_MAX_PAGES}, 0 — никогда).")
+    p2.add_argument("--workers", type=int, default=1,
+                    help="Сколько браузеров обрабатывают товары параллельно (по умолчанию 1 — по очереди).")
+    p2.add_argument("--engine", default="browser", choices=["browser", "http", "async"],
+                    help="browser — всегда через браузер; http — сначала быстрый HTTP-запрос без браузера, "
+                         "браузер только если цена не найдена в HTML; async — то же, но все товары "
+                         "запрашиваются одновременно с лимитами на сайт (см. --host-limits).")
+    p2.add_argument("--race", type=int, default=1,
+                    help="Запускать первые N фоллбэков строки одновременно и брать первый успешный "
+                         "(по умолчанию 1 — по очереди).")
+    p2.add_argument("--keep-order", action="store_true",
+                    help="Пробовать фоллбэки строго в порядке файла (по умолчанию первым идёт "
+                         "самый быстрый из рабочих URL по истории прошлых запусков).")
+    p2.add_argument("--skip-unchanged", action="store_true",
+                    help="Не записывать цену, если карточка не изменилась с прошлого раза "
+                         "(для --engine http/async — условные запросы ETag/Last-Modified).")
+    p2.add_argument("--commit-every", type=int, default=DEFAULT_COMMIT_EVERY,
+                    help=f"Коммитить записи в БД пачками по N изменений (по умолчанию {DEFAULT_COMMIT_EVERY}).")
+    p2.add_argument("--commit-interval", type=float, default=DEFAULT_COMMIT_INTERVAL,
+                    help=f"…или не реже чем раз в N секунд (по умолчанию {DEFAULT_COMMIT_INTERVAL:g}).")
+    p2.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                    help=f"Сколько цен может ждать записи в БД; при полной очереди воркеры ждут (по умолчанию {DEFAULT_QUEUE_SIZE}).")
+    p2.add_argument("--metrics-out", default=None,
+                    help="Сохранить замеры времени по фазам (запуск браузера, загрузка, извлечение, "
+                         "разбор, запись в БД) в JSON, например run.json, и напечатать сводку p50/p95/max.")
+    p2.add_argument("--host-limits", default=None,
+                    help="JSON с лимитами по доменам для --engine async: "
+                         '{"dnkparfum.ru": {"concurrency": 8, "rate": 4, "burst": 8, "delay": 0.1}}')
     p2.set_defaults(func=cmd_fetch)
 
     p3 = sub.add_parser("report", help="Сформировать Excel отчёт в корне проекта")
     p3.add_argument("--output", default="price_report.xlsx", help="Путь к файлу отчёта .xlsx")
+    p3.add_argument("--expand-history", action="store_true",
+                    help="В листе «История» показывать и последний замер каждого интервала (режим intervals).")
+    p3.add_argument("--full", action="store_true",
+                    help="Пересобрать отчёт целиком, не используя кэш прошлой сборки (<отчёт>.cache).")
+    p3.add_argument("--sheet-rows", type=int, default=HISTORY_SHEET_ROWS,
+                    help=f"Строк на лист «История» (по умолчанию {HISTORY_SHEET_ROWS}); больше — история делится "
+                         "на листы по диапазонам товаров, а «История» становится оглавлением со ссылками")
+    p3.add_argument("--shard-files", action="store_true",
+                    help="Части «Истории» писать не листами, а отдельными файлами <отчёт>.history-N.xlsx")
+    p3.add_argument("--months", action="store_true",
+                    help="Добавить лист «По месяцам»: мин./макс./средняя/последняя цена за месяц из агрегатов")
     p3.set_defaults(func=cmd_report)
 
+    p4 = sub.add_parser("import-csv", help="Загрузить историю цен из CSV (name, price, checked_at)")
+    p4.add_argument("csv", help="CSV с колонками name/Товар, price/Цена (₽), checked_at/Когда проверено")
+    p4.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                    help=f"Строк в одной пачке записи (по умолчанию {DEFAULT_CHUNK_SIZE}).")
+    p4.set_defaults(func=cmd_import_csv)
+
+    p5 = sub.add_parser("rebuild-latest", help="Пересобрать таблицу текущих цен (latest_prices) из истории")
+    p5.add_argument("--check", action="store_true",
+                    help="Только сверить latest_prices с историей (оконными функциями SQL), ничего не меняя")
+    p5.set_defaults(func=cmd_rebuild_latest)
+
+    p7 = sub.add_parser("history-mode", help="Показать/сменить режим хранения истории (points/intervals)")
+    p7.add_argument("mode", nargs="?", choices=db.HISTORY_MODES,
+                    help="points — строка на каждый замер (по умолчанию); intervals — одинаковая цена подряд "
+                         "хранится одной строкой с last_seen и числом замеров.")
+    p7.set_defaults(func=cmd_history_mode)
+
+    p8 = sub.add_parser("compact-history", help="Свернуть повторы цен в интервалы, включить режим intervals и сжать БД")
+    p8.set_defaults(func=cmd_compact_history)
+
+    p9 = sub.add_parser("backfill-rollups", help="Пересчитать агрегаты по дням/неделям/месяцам по всей истории")
+    p9.set_defaults(func=cmd_backfill_rollups)
+
+    p10 = sub.add_parser("archive-history", help="Выгрузить старую историю цен в Parquet помесячно (archive/<БД>/month=YYYY-MM)")
+    p10.add_argument("--older-than", type=int, default=365,
+                     help="Архивировать замеры старше N дней (целыми месяцами; по умолчанию 365)")
+    p10.add_argument("--prune", action="store_true",
+                     help="После выгрузки удалить эти строки из SQLite (отчёт читает их из архива)")
+    p10.add_argument("--archive-dir", default=None,
+                     help="Каталог архива (по умолчанию archive/<имя файла БД>)")
+    p10.set_defaults(func=cmd_archive_history)
+
+    p11 = sub.add_parser("export", help="Выгрузить историю цен в CSV / JSON Lines / Parquet (потоком, для BI)")
+    p11.add_argument("--output", default="price_history.csv",
+                     help="Файл выгрузки; формат и сжатие берутся из имени: .csv, .jsonl, .parquet, + .gz / .zst")
+    p11.add_argument("--format", default=None, choices=EXPORT_FORMATS, help="Формат, если не подходит имя файла")
+    p11.add_argument("--compression", default=None, choices=COMPRESSIONS,
+                     help="Сжатие gzip или zstd (для parquet — кодек внутри файла; zstd для csv/jsonl — пакет zstandard)")
+    p11.add_argument("--product", action="append", default=None,
+                     help="Только товары, в названии которых есть подстрока (можно указать несколько раз)")
+    p11.add_argument("--since", default=None, type=checked_at_arg, help="С даты/времени включительно (YYYY-MM-DD[ HH:MM:SS], UTC)")
+    p11.add_argument("--until", default=None, type=checked_at_arg, help="По дату/время, не включая (YYYY-MM-DD[ HH:MM:SS], UTC)")
+    p11.add_argument("--expand-history", action="store_true",
+                     help="Добавить последний замер каждого интервала (режим intervals), как в отчёте")
+    p11.add_argument("--archive-dir", default=None,
+                     help="Каталог архива Parquet (по умолчанию archive/<имя файла БД>)")
+    p11.set_defaults(func=cmd_export)
+
     args = parser.parse_args()
     args.func(args)
 
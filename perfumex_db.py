@@ -1,8 +1,14 @@
 # perfumex_db.py — SQLite для perfumex.ru (уникальность по имени)
 
 import sqlite3
+from itertools import islice
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Dict, Iterable, Iterator, Optional, Tuple, List
+
+from db_session import (
+    ConnectionManager, DEFAULT_COMMIT_EVERY, DEFAULT_COMMIT_INTERVAL,
+    EPOCH_MS_NOW_SQL, ROLLUP_BUCKET_SQL, SCHEMA_V1, SCHEMA_V2, interval_observations, text_to_ms_sql, ts_text_sql,
+)
 
 DB_PATH = Path("perfumex.sqlite3")
 
@@ -20,28 +26,264 @@ CREATE TABLE IF NOT EXISTS prices (
     price_minor INTEGER NOT NULL, -- цена в минимальных единицах (центы)
     currency TEXT NOT NULL,       -- 'USD', 'RUB', ...
     checked_at TEXT NOT NULL DEFAULT (datetime('now')),
+    last_seen TEXT,                          -- режим intervals: последний замер с той же ценой подряд
+    check_count INTEGER NOT NULL DEFAULT 1,  -- сколько замеров свёрнуто в строку
     FOREIGN KEY(product_id) REFERENCES products(id)
 );
 
 CREATE INDEX IF NOT EXISTS idx_prices_product_time ON prices(product_id, checked_at);
+
+-- Кэш для --skip-unchanged: валидаторы HTTP и хэш извлечённых полей по каждому URL
+CREATE TABLE IF NOT EXISTS page_cache (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    checked_at TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+-- История доступности URL (для порядка фоллбэков): успехи/ошибки и средняя задержка
+CREATE TABLE IF NOT EXISTS url_stats (
+    url TEXT PRIMARY KEY,
+    successes INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    avg_ms REAL,
+    last_ok_at TEXT,
+    last_fail_at TEXT
+);
+
+-- Последняя и предыдущая цена по каждому товару: поддерживается триггерами при вставке в prices,
+-- чтобы текущие цены читались за O(товаров), а не сканом всей истории.
+-- changed_at — с какого замера держится текущая цена; observations — сколько всего замеров.
+CREATE TABLE IF NOT EXISTS latest_prices (
+    product_id INTEGER PRIMARY KEY,
+    price_minor INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    prev_minor INTEGER,
+    checked_at TEXT NOT NULL,
+    changed_at TEXT NOT NULL,
+    observations INTEGER NOT NULL DEFAULT 1,
+    FOREIGN KEY(product_id) REFERENCES products(id)
+);
+
+-- Настройки хранения (history_mode: points — строка на каждый замер, intervals — см. ниже)
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+-- Агрегаты по дням/неделям/месяцам для трендов: обновляются после fetch только по затронутым
+-- периодам (refresh_rollups), целиком — командой backfill-rollups. Строка-интервал (режим intervals)
+-- считается двумя точками: первый замер и последний (на него приходятся остальные check_count - 1).
+CREATE TABLE IF NOT EXISTS price_rollups (
+    period TEXT NOT NULL,         -- 'day' | 'week' | 'month'
+    product_id INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    bucket TEXT NOT NULL,         -- начало периода 'YYYY-MM-DD'
+    min_minor INTEGER NOT NULL,
+    max_minor INTEGER NOT NULL,
+    avg_minor REAL NOT NULL,
+    last_minor INTEGER NOT NULL,
+    checks INTEGER NOT NULL,
+    first_at TEXT NOT NULL,
+    last_at TEXT NOT NULL,
+    PRIMARY KEY (period, product_id, currency, bucket)
+) WITHOUT ROWID;
+
+-- Интервалы (check_count > 1) по last_seen — для refresh_rollups; в режиме points индекс пуст
+CREATE INDEX IF NOT EXISTS idx_prices_intervals ON prices(product_id, last_seen) WHERE check_count > 1;
+
+-- Что учтено в price_rollups по товару: счётчик замеров и время последней строки на момент обновления
+CREATE TABLE IF NOT EXISTS price_rollups_state (
+    product_id INTEGER PRIMARY KEY,
+    observations INTEGER NOT NULL,
+    last_row_at NOT NULL
+);
+
+-- Триггеры пересоздаются при каждом init_db(), чтобы старые БД получали актуальные версии
+DROP TRIGGER IF EXISTS trg_prices_latest;
+DROP TRIGGER IF EXISTS trg_prices_latest_backfill;
+DROP TRIGGER IF EXISTS trg_prices_collapse;
+
+-- Режим intervals: замер с той же ценой и валютой, что и последний, не добавляет строку,
+-- а продлевает последнюю (last_seen, check_count); latest_prices обновляется как при вставке
+CREATE TRIGGER trg_prices_collapse BEFORE INSERT ON prices
+WHEN (SELECT value FROM meta WHERE key = 'history_mode') = 'intervals'
+ AND EXISTS (SELECT 1 FROM latest_prices WHERE product_id = NEW.product_id
+             AND price_minor = NEW.price_minor AND currency = NEW.currency AND checked_at <= NEW.checked_at)
+BEGIN
+    UPDATE prices SET last_seen = NEW.checked_at, check_count = check_count + 1
+    WHERE id = (SELECT id FROM prices WHERE product_id = NEW.product_id ORDER BY checked_at DESC, id DESC LIMIT 1);
+    UPDATE latest_prices SET prev_minor = price_minor, checked_at = NEW.checked_at, observations = observations + 1
+    WHERE product_id = NEW.product_id;
+    SELECT RAISE(IGNORE);
+END;
+
+-- Обычный случай: новый замер не старше текущего
+CREATE TRIGGER trg_prices_latest AFTER INSERT ON prices
+WHEN NOT EXISTS (SELECT 1 FROM latest_prices WHERE product_id = NEW.product_id AND checked_at > NEW.checked_at)
+BEGIN
+    INSERT INTO latest_prices(product_id, price_minor, currency, prev_minor, checked_at, changed_at, observations)
+    VALUES (NEW.product_id, NEW.price_minor, NEW.currency, NULL, NEW.checked_at, NEW.checked_at, 1)
+    ON CONFLICT(product_id) DO UPDATE SET
+        prev_minor = latest_prices.price_minor,
+        changed_at = CASE WHEN excluded.price_minor <> latest_prices.price_minor
+                            OR excluded.currency <> latest_prices.currency
+                          THEN excluded.checked_at ELSE latest_prices.changed_at END,
+        price_minor = excluded.price_minor,
+        currency = excluded.currency,
+        checked_at = excluded.checked_at,
+        observations = latest_prices.observations + 1;
+END;
+
+-- Загрузка старой истории (import-csv): текущая цена та же, но «предыдущая» и дата смены
+-- могли сдвинуться — пересчитываются по индексу только для этого товара.
+-- Если последняя строка — интервал из нескольких замеров, предыдущий замер был с той же ценой.
+CREATE TRIGGER trg_prices_latest_backfill AFTER INSERT ON prices
+WHEN EXISTS (SELECT 1 FROM latest_prices WHERE product_id = NEW.product_id AND checked_at > NEW.checked_at)
+BEGIN
+    UPDATE latest_prices SET
+        observations = observations + 1,
+        prev_minor = (SELECT CASE WHEN last.check_count > 1 THEN last.price_minor ELSE (
+                          SELECT price_minor FROM prices WHERE product_id = NEW.product_id
+                          ORDER BY checked_at DESC, id DESC LIMIT 1 OFFSET 1) END
+                      FROM (SELECT price_minor, check_count FROM prices WHERE product_id = NEW.product_id
+                            ORDER BY checked_at DESC, id DESC LIMIT 1) last),
+        changed_at = COALESCE(
+            (SELECT MIN(checked_at) FROM prices WHERE product_id = NEW.product_id AND (checked_at, id) > (
+                SELECT checked_at, id FROM prices WHERE product_id = NEW.product_id
+                  AND (price_minor <> latest_prices.price_minor OR currency <> latest_prices.currency)
+                ORDER BY checked_at DESC, id DESC LIMIT 1)),
+            (SELECT MIN(checked_at) FROM prices WHERE product_id = NEW.product_id))
+    WHERE product_id = NEW.product_id;
+END;
 """
 
+# Схема v2 (init-db --schema 2 или migrate-db): время замера — INTEGER, мс Unix-времени (UTC),
+# и покрывающий индекс — последние цены и диапазоны по товару читаются из одного индекса.
+# Остальные таблицы и триггеры — из SCHEMA_SQL (они от типа checked_at не зависят).
+SCHEMA_V2_SQL = f"""
+CREATE TABLE IF NOT EXISTS prices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    price_minor INTEGER NOT NULL, -- цена в минимальных единицах (центы)
+    currency TEXT NOT NULL,       -- 'USD', 'RUB', ...
+    checked_at INTEGER NOT NULL DEFAULT ({EPOCH_MS_NOW_SQL}),
+    last_seen INTEGER,
+    check_count INTEGER NOT NULL DEFAULT 1,
+    FOREIGN KEY(product_id) REFERENCES products(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_prices_product_time ON prices(product_id, checked_at, price_minor, currency);
+
+CREATE TABLE IF NOT EXISTS latest_prices (
+    product_id INTEGER PRIMARY KEY,
+    price_minor INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    prev_minor INTEGER,
+    checked_at INTEGER NOT NULL,
+    changed_at INTEGER NOT NULL,
+    observations INTEGER NOT NULL DEFAULT 1,
+    FOREIGN KEY(product_id) REFERENCES products(id)
+);
+"""
+
+_connections = ConnectionManager(lambda: DB_PATH)
+_MAX_VARS = 500  # параметров в одном IN (...) — с запасом до лимита SQLite
+
+
 def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA foreign_keys=ON;")
-    return conn
+    return _connections.connect()
 
 
-def init_db() -> None:
-    conn = get_conn()
-    with conn:
+def session(commit_every: int = DEFAULT_COMMIT_EVERY, commit_interval: float = DEFAULT_COMMIT_INTERVAL):
+    """
+    `with db.session():` — одно соединение на прогон, записи коммитятся пачками
+    (каждые commit_every изменений или commit_interval секунд) и при выходе.
+    """
+    return _connections.session(commit_every, commit_interval)
+
+
+def init_db(schema: int = SCHEMA_V1) -> None:
+    """Создать таблицы; schema=2 действует только для новой БД (старую переводит migrate_to_v2)."""
+    with _connections.connection(write=True) as conn:
+        is_new = conn.execute("SELECT 1 FROM sqlite_master WHERE name='prices'").fetchone() is None
+        if is_new and schema >= SCHEMA_V2:
+            conn.executescript(SCHEMA_V2_SQL + f"PRAGMA user_version={SCHEMA_V2};")
+        _add_missing_columns(conn)
         conn.executescript(SCHEMA_SQL)
-    conn.close()
+        _rebuild_latest_if_missing(conn)
+    _connections.forget_schema_version()
 
 
-def upsert_product(name: str) -> int:
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    """БД, созданная до режима intervals: добавить last_seen / check_count в prices."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(prices)")}
+    if cols and "check_count" not in cols:
+        ts_type = "INTEGER" if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_V2 else "TEXT"
+        conn.execute(f"ALTER TABLE prices ADD COLUMN last_seen {ts_type}")
+        conn.execute("ALTER TABLE prices ADD COLUMN check_count INTEGER NOT NULL DEFAULT 1")
+
+
+def schema_version() -> int:
+    return _connections.schema_version()
+
+
+def _checked_at_param_sql() -> str:
+    """Параметр checked_at ('YYYY-MM-DD HH:MM:SS' UTC или None = сейчас) в формате текущей схемы."""
+    if schema_version() >= SCHEMA_V2:
+        return text_to_ms_sql("?")
+    return "COALESCE(?, datetime('now'))"
+
+
+def migrate_to_v2() -> int:
+    """
+    Перевести существующий файл БД на схему v2 на месте (одна транзакция + VACUUM).
+    Возвращает число перенесённых цен; 0 — БД уже в v2.
+    """
+    init_db()
+    if schema_version() >= SCHEMA_V2:
+        return 0
     conn = get_conn()
-    with conn:
+    conn.isolation_level = None  # транзакцией управляем сами: BEGIN … COMMIT
+    try:
+        conn.execute("PRAGMA foreign_keys=OFF")
+        conn.execute("BEGIN IMMEDIATE")
+        for stmt in (
+            "DROP TRIGGER IF EXISTS trg_prices_latest",
+            "DROP TRIGGER IF EXISTS trg_prices_latest_backfill",
+            "DROP TRIGGER IF EXISTS trg_prices_collapse",
+            "DROP INDEX IF EXISTS idx_prices_product_time",
+            "DROP TABLE IF EXISTS latest_prices",
+            "ALTER TABLE prices RENAME TO prices_v1",
+            *(sql for sql in SCHEMA_V2_SQL.split(";") if sql.strip()),
+        ):
+            conn.execute(stmt)
+        moved = conn.execute(
+            "INSERT INTO prices(id, product_id, price_minor, currency, checked_at, last_seen, check_count) "
+            f"SELECT id, product_id, price_minor, currency, {text_to_ms_sql('checked_at')}, "
+            f"CASE WHEN last_seen IS NOT NULL THEN {text_to_ms_sql('last_seen')} END, check_count "
+            "FROM prices_v1 ORDER BY id"
+        ).rowcount
+        conn.execute("DROP TABLE prices_v1")
+        _reset_rollups(conn)  # rollup_latest_at был в формате v1
+        conn.execute(f"PRAGMA user_version={SCHEMA_V2}")
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    _connections.forget_schema_version()
+    init_db()  # триггеры и заполнение latest_prices
+    vacuum()
+    return moved
+
+
+def upsert_product(name: str) -> int:
+    with _connections.connection(write=True) as conn:
         cur = conn.execute(
             "INSERT INTO products(name) VALUES(?) "
             "ON CONFLICT(name) DO UPDATE SET name=excluded.name "
@@ -49,33 +291,693 @@ def upsert_product(name: str) -> int:
             (name,),
         )
         row = cur.fetchone()
-    conn.close()
     return int(row[0])
 
 
 def insert_price(product_id: int, price_minor: int, currency: str) -> None:
-    conn = get_conn()
-    with conn:
+    with _connections.connection(write=True) as conn:
         conn.execute(
             "INSERT INTO prices(product_id, price_minor, currency) VALUES(?,?,?)",
             (product_id, price_minor, currency),
         )
-    conn.close()
 
 
-def dump_history() -> List[tuple]:
+def latest_price_by_name(name: str) -> Optional[Tuple[int, str]]:
+    """Последняя записанная цена товара по имени: (price_minor, currency); None — товара ещё нет."""
+    with _connections.connection() as conn:
+        row = conn.execute(
+            "SELECT lp.price_minor, lp.currency FROM products p "
+            "JOIN latest_prices lp ON lp.product_id = p.id WHERE p.name = ?",
+            (name,),
+        ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def latest_snapshot() -> List[tuple]:
     """
-    Возвращает полную историю: (product_id, name, price_minor, currency, checked_at)
+    Текущие цены из latest_prices — одна строка на товар:
+    (product_id, name, price_minor, currency, prev_minor, checked_at, changed_at, observations)
     """
-    conn = get_conn()
-    cur = conn.execute(
-        """
-        SELECT p.id, p.name, pr.price_minor, pr.currency, pr.checked_at
-        FROM prices pr
-        JOIN products p ON p.id = pr.product_id
-        ORDER BY p.name, pr.checked_at
-        """
+    with _connections.connection() as conn:
+        cur = conn.execute(
+            f"""
+            SELECT p.id, p.name, lp.price_minor, lp.currency, lp.prev_minor,
+                   {ts_text_sql('lp.checked_at')}, {ts_text_sql('lp.changed_at')}, lp.observations
+            FROM latest_prices lp
+            JOIN products p ON p.id = lp.product_id
+            ORDER BY lp.product_id
+            """
+        )
+        rows = cur.fetchall()
+    return rows
+
+
+def upsert_products(names: Iterable[str]) -> Dict[str, int]:
+    """
+    Пакетный upsert: одна транзакция на весь список, возвращает name -> id.
+    Заменяет цикл upsert_product() при массовой загрузке истории.
+    """
+    with _connections.connection(write=True) as conn:
+        return _upsert_products(conn, names)
+
+
+def find_products(patterns: Iterable[str]) -> List[int]:
+    """id товаров, в имени которых есть хотя бы одна из подстрок patterns (без учёта регистра)."""
+    needles = [p.casefold() for p in patterns]
+    with _connections.connection() as conn:
+        rows = conn.execute("SELECT id, name FROM products ORDER BY name").fetchall()
+    return [pid for pid, name in rows if any(n in name.casefold() for n in needles)]
+
+
+def _upsert_products(conn: sqlite3.Connection, names: Iterable[str]) -> Dict[str, int]:
+    unique = list(dict.fromkeys(n for n in names if n))
+    ids: Dict[str, int] = {}
+    conn.executemany("INSERT INTO products(name) VALUES(?) ON CONFLICT(name) DO NOTHING",
+                     ((n,) for n in unique))
+    for i in range(0, len(unique), _MAX_VARS):
+        chunk = unique[i:i + _MAX_VARS]
+        cur = conn.execute(
+            f"SELECT name, id FROM products WHERE name IN ({','.join('?' * len(chunk))})", chunk
+        )
+        ids.update(cur.fetchall())
+    return ids
+
+
+def insert_prices(rows: Iterable[tuple]) -> int:
+    """
+    rows: (product_id, price_minor, currency) или (..., checked_at) — checked_at=None означает «сейчас».
+    Всё одним executemany в одной транзакции; возвращает число вставленных строк.
+    """
+    with _connections.connection(write=True) as conn:
+        return _insert_prices(conn, rows)
+
+
+def _insert_prices(conn: sqlite3.Connection, rows: Iterable[tuple]) -> int:
+    cur = conn.executemany(
+        "INSERT INTO prices(product_id, price_minor, currency, checked_at) "
+        f"VALUES(?, ?, ?, {_checked_at_param_sql()})",
+        (r if len(r) == 4 else (*r, None) for r in rows),
     )
-    rows = cur.fetchall()
+    return cur.rowcount
+
+
+def ingest_seq() -> int:
+    """Номер последней записи очереди IngestQueue, дошедшей до БД (0 — ещё не было)."""
+    with _connections.connection() as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'ingest_seq'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def ingest_rows(rows: List[tuple], seq: int) -> int:
+    """
+    Пачка IngestQueue: rows (name, price_minor, currency, checked_at) — товары, цены и номер последней записи пачки
+    в meta одной транзакцией (по номеру повтор spill-файла пропускает уже записанное).
+    В сессии коммитится сразу. Возвращает число вставленных цен.
+    """
+    with _connections.connection(write=True) as conn:
+        ids = _upsert_products(conn, (r[0] for r in rows))
+        inserted = _insert_prices(conn, ((ids[r[0]], *r[1:]) for r in rows))
+        conn.execute("INSERT INTO meta(key, value) VALUES('ingest_seq', ?) "
+                     "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (seq,))
+    _connections.commit()
+    return inserted
+
+
+def rebuild_latest_prices() -> int:
+    """Пересобрать latest_prices из prices (после ручных правок/удалений). Возвращает число товаров."""
+    with _connections.connection(write=True) as conn:
+        conn.execute("DELETE FROM latest_prices")
+        cur = conn.execute(
+            """
+            INSERT INTO latest_prices(product_id, price_minor, currency, prev_minor, checked_at, changed_at, observations)
+            SELECT s.product_id, s.price_minor, s.currency, s.prev_minor, s.checked_at,
+                   COALESCE(
+                       (SELECT MIN(p.checked_at) FROM prices p WHERE p.product_id = s.product_id
+                        AND (p.checked_at, p.id) > (
+                           SELECT q.checked_at, q.id FROM prices q WHERE q.product_id = s.product_id
+                             AND (q.price_minor <> s.price_minor OR q.currency <> s.currency)
+                           ORDER BY q.checked_at DESC, q.id DESC LIMIT 1)),
+                       s.first_at),
+                   s.observations
+            FROM (
+                SELECT pr.product_id,
+                       (SELECT price_minor FROM prices WHERE product_id = pr.product_id
+                        ORDER BY checked_at DESC, id DESC LIMIT 1) AS price_minor,
+                       (SELECT currency FROM prices WHERE product_id = pr.product_id
+                        ORDER BY checked_at DESC, id DESC LIMIT 1) AS currency,
+                       -- последняя строка-интервал из нескольких замеров: предыдущий замер был с той же ценой
+                       (SELECT CASE WHEN l.check_count > 1 THEN l.price_minor ELSE (
+                                   SELECT price_minor FROM prices WHERE product_id = pr.product_id
+                                   ORDER BY checked_at DESC, id DESC LIMIT 1 OFFSET 1) END
+                        FROM prices l WHERE l.product_id = pr.product_id
+                        ORDER BY l.checked_at DESC, l.id DESC LIMIT 1) AS prev_minor,
+                       MAX(COALESCE(pr.last_seen, pr.checked_at)) AS checked_at,
+                       MIN(pr.checked_at) AS first_at,
+                       SUM(pr.check_count) AS observations
+                FROM prices pr
+                GROUP BY pr.product_id
+            ) s
+            """
+        )
+        return cur.rowcount
+
+
+# Текущая и предыдущая цена каждого товара, посчитанные по самой истории: один проход
+# ROW_NUMBER()/LAG() по индексу (product_id, checked_at), одна строка на товар. Смысл тот же, что
+# у триггеров latest_prices: предыдущая — цена предыдущего замера (у строки-интервала — та же),
+# changed_at — начало последней серии одинаковых цены и валюты. Для сверки (rebuild-latest --check)
+# и замеров: сам отчёт читает готовую latest_prices, а пересборка идёт по индексу на товар.
+_LATEST_FROM_HISTORY_SQL = """
+    SELECT product_id,
+           MAX(CASE WHEN rn = cnt THEN price_minor END) AS price_minor,
+           MAX(CASE WHEN rn = cnt THEN currency END) AS currency,
+           MAX(CASE WHEN rn = cnt THEN CASE WHEN check_count > 1 THEN price_minor ELSE prev END END) AS prev_minor,
+           MAX(COALESCE(last_seen, checked_at)) AS checked_at,
+           MAX(CASE WHEN prev IS NOT price_minor OR prev_currency IS NOT currency THEN checked_at END) AS changed_at,
+           SUM(check_count) AS observations
+    FROM (
+        SELECT product_id, price_minor, currency, checked_at, last_seen, check_count,
+               LAG(price_minor) OVER w AS prev,
+               LAG(currency) OVER w AS prev_currency,
+               ROW_NUMBER() OVER w AS rn,
+               COUNT(*) OVER (PARTITION BY product_id) AS cnt
+        FROM prices
+        WINDOW w AS (PARTITION BY product_id ORDER BY checked_at, id)
+    )
+    GROUP BY product_id
+"""
+
+
+def latest_snapshot_from_history() -> List[tuple]:
+    """
+    Как latest_snapshot(), но по самой истории (без latest_prices) — одна строка на товар:
+    (product_id, name, price_minor, currency, prev_minor, checked_at, changed_at, observations)
+    """
+    with _connections.connection() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT p.id, p.name, s.price_minor, s.currency, s.prev_minor,
+                   {ts_text_sql('s.checked_at')}, {ts_text_sql('s.changed_at')}, s.observations
+            FROM ({_LATEST_FROM_HISTORY_SQL}) s
+            JOIN products p ON p.id = s.product_id
+            ORDER BY s.product_id
+            """
+        ).fetchall()
+    return rows
+
+
+def check_latest_prices() -> List[int]:
+    """product_id, у которых latest_prices расходится с историей (пусто — таблица верна)."""
+    with _connections.connection() as conn:
+        rows = conn.execute(
+            f"""
+            WITH h AS MATERIALIZED ({_LATEST_FROM_HISTORY_SQL}),
+                 lp AS (SELECT product_id, price_minor, currency, prev_minor, checked_at, changed_at, observations FROM latest_prices)
+            SELECT product_id FROM (SELECT * FROM h EXCEPT SELECT * FROM lp)
+            UNION
+            SELECT product_id FROM (SELECT * FROM lp EXCEPT SELECT * FROM h)
+            ORDER BY product_id
+            """
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+def _rebuild_latest_if_missing(conn: sqlite3.Connection) -> None:
+    """Старая БД без latest_prices: заполнить таблицу один раз при init_db()."""
+    if conn.execute("SELECT EXISTS(SELECT 1 FROM prices) AND NOT EXISTS(SELECT 1 FROM latest_prices)").fetchone()[0]:
+        rebuild_latest_prices()
+
+
+HISTORY_COLUMNS = ("product_id", "name", "price_minor", "currency", "checked_at")
+ARCHIVE_COLUMNS = HISTORY_COLUMNS + ("last_seen", "check_count", "id")  # iter_history(raw=True)
+HISTORY_PAGE_SIZE = 10_000
+
+
+def iter_history(product_ids: Optional[Iterable[int]] = None,
+                 since: Optional[str] = None,
+                 until: Optional[str] = None,
+                 currency: Optional[str] = None,
+                 expand: bool = False,
+                 page_size: int = HISTORY_PAGE_SIZE,
+                 raw: bool = False) -> Iterator[tuple]:
+    """
+    История построчно (product_id, name, price_minor, currency, checked_at) — как dump_history(), но без списка
+    в памяти: страницы по page_size строк читаются keyset-пагинацией по (product_id, checked_at, id)
+    через индекс idx_prices_product_time. Порядок — по имени товара, затем по времени.
+    Фильтры: product_ids, since <= checked_at < until ('YYYY-MM-DD HH:MM:SS', UTC), currency — только эта валюта.
+    expand=True — сразу за строкой-интервалом идёт точка её последнего замера (см. dump_history).
+    raw=True — строки ARCHIVE_COLUMNS как есть (с last_seen, check_count и id, без разворота) — для архива.
+    """
+    where, params = [], []
+    if since is not None:
+        where.append(f"pr.checked_at >= {_checked_at_param_sql()}")
+        params.append(since)
+    if until is not None:
+        where.append(f"pr.checked_at < {_checked_at_param_sql()}")
+        params.append(until)
+    if currency is not None:
+        where.append("pr.currency = ?")
+        params.append(currency)
+    if raw:
+        last_seen_sql = f"{ts_text_sql('pr.last_seen')}, pr.check_count"
+    elif expand:
+        last_seen_sql = (f"CASE WHEN pr.check_count > 1 AND pr.last_seen > pr.checked_at "
+                         f"THEN {ts_text_sql('pr.last_seen')} END")
+    else:
+        last_seen_sql = "NULL"
+    # id и имя товара подставляются параметрами — строки приходят уже в нужном виде
+    sql = f"""
+        SELECT ?, ?, pr.price_minor, pr.currency, {ts_text_sql('pr.checked_at')},
+               {last_seen_sql}, pr.checked_at, pr.id  -- последние две — ключ следующей страницы
+        FROM prices pr
+        WHERE pr.product_id = ? AND (pr.checked_at, pr.id) > (?, ?) {"".join(" AND " + w for w in where)}
+        ORDER BY pr.checked_at, pr.id
+        LIMIT ?
+    """
+    with _connections.connection() as conn:
+        if product_ids is None:
+            products = conn.execute("SELECT id, name FROM products ORDER BY name").fetchall()
+        else:
+            ids = list(dict.fromkeys(product_ids))
+            products = []
+            for i in range(0, len(ids), _MAX_VARS):
+                part = ids[i:i + _MAX_VARS]
+                products += conn.execute(
+                    f"SELECT id, name FROM products WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+            products.sort(key=lambda r: r[1])
+
+    start = (-1, 0)  # INTEGER меньше любого TEXT и любых мс — подходит для обеих схем
+    idx, after = 0, start
+    while idx < len(products):
+        page: List[tuple] = []
+        with _connections.connection() as conn:
+            while idx < len(products) and len(page) < page_size:
+                pid, name = products[idx]
+                limit = page_size - len(page)
+                rows = conn.execute(sql, (pid, name, pid, *after, *params, limit)).fetchall()
+                if raw:
+                    page.extend((*row[:7], row[-1]) for row in rows)
+                elif expand:
+                    for row in rows:
+                        page.append(row[:5])
+                        if row[5] is not None:
+                            page.append((*row[:4], row[5]))
+                else:
+                    page.extend(row[:5] for row in rows)
+                if len(rows) < limit:
+                    idx, after = idx + 1, start
+                else:
+                    after = rows[-1][-2:]  # (checked_at, id) последней строки
+        yield from page
+
+
+def iter_history_frames(kind: str = "pandas", chunk_size: int = HISTORY_PAGE_SIZE, **filters) -> Iterator:
+    """
+    iter_history() пачками по chunk_size строк: kind='pandas' — DataFrame с колонками HISTORY_COLUMNS,
+    kind='arrow' — pyarrow.RecordBatch (pyarrow нужен только для этого режима).
+    filters — аргументы iter_history (product_ids, since, until, currency, expand).
+    """
+    if kind == "pandas":
+        import pandas as pd
+
+        def make(chunk):
+            return pd.DataFrame(chunk, columns=list(HISTORY_COLUMNS))
+    elif kind == "arrow":
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise RuntimeError("Для kind='arrow' нужен pyarrow: pip install pyarrow") from e
+        schema = pa.schema([
+            ("product_id", pa.int64()), ("name", pa.string()), ("price_minor", pa.int64()),
+            ("currency", pa.string()), ("checked_at", pa.string()),
+        ])
+
+        def make(chunk):
+            return pa.RecordBatch.from_arrays(
+                [pa.array(col, type=f.type) for col, f in zip(zip(*chunk), schema)], schema=schema)
+    else:
+        raise ValueError(f"Неизвестный формат пачек истории: {kind!r}")
+    rows = iter_history(page_size=chunk_size, **filters)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield make(chunk)
+
+
+def dump_history(expand: bool = False) -> List[tuple]:
+    """
+    (product_id, name, price_minor, currency, checked_at) по имени и времени — вся история списком (для больших
+    баз — iter_history / iter_history_frames). В режиме intervals строка-интервал отдаётся один раз
+    (на момент первого замера); expand=True добавляет и точку последнего замера серии.
+    """
+    return list(iter_history(expand=expand))
+
+
+def history_bounds() -> Tuple[Optional[str], Optional[str]]:
+    """(первый, последний) checked_at в prices как 'YYYY-MM-DD HH:MM:SS' UTC; (None, None) — истории нет."""
+    with _connections.connection() as conn:
+        first, last = conn.execute("SELECT MIN(checked_at), MAX(checked_at) FROM prices").fetchone()
+        if first is None:
+            return None, None
+        return conn.execute(f"SELECT {ts_text_sql('?1')}, {ts_text_sql('?2')}", (first, last)).fetchone()
+
+
+
+def distinct_prices() -> List[int]:
+    """Все разные price_minor в prices (без архива) — для ширины колонки цены в отчёте."""
+    with _connections.connection() as conn:
+        return [r[0] for r in conn.execute("SELECT DISTINCT price_minor FROM prices")]
+
+def report_watermark() -> Dict[str, object]:
+    """
+    Водяной знак истории для кэша отчёта (report_cache): max(id) и число строк prices, режим
+    хранения, граница prune и версия схемы. Строки только добавлялись — растут max_id и rows.
+    """
+    with _connections.connection() as conn:
+        max_id, rows = conn.execute("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM prices").fetchone()
+        meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('history_mode', 'pruned_before')"))
+    return {"max_id": max_id, "rows": rows, "history_mode": meta.get("history_mode", "points"),
+            "pruned_before": meta.get("pruned_before"), "schema": schema_version()}
+
+
+def history_changes(after_id: int) -> Tuple[int, List[int]]:
+    """(строк prices с id > after_id, product_id этих строк)."""
+    with _connections.connection() as conn:
+        rows = conn.execute("SELECT product_id, COUNT(*) FROM prices WHERE id > ? GROUP BY product_id",
+                            (after_id,)).fetchall()
+    return sum(n for _, n in rows), [pid for pid, _ in rows]
+
+
+HISTORY_MODES = ("points", "intervals")
+
+
+def history_mode() -> str:
+    with _connections.connection() as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'history_mode'").fetchone()
+    return row[0] if row else "points"
+
+
+def set_history_mode(mode: str) -> None:
+    if mode not in HISTORY_MODES:
+        raise ValueError(f"Неизвестный режим хранения истории: {mode!r}")
+    with _connections.connection(write=True) as conn:
+        conn.execute("INSERT INTO meta(key, value) VALUES('history_mode', ?) "
+                     "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (mode,))
+
+
+def compact_history() -> Tuple[int, int]:
+    """
+    Свернуть подряд идущие одинаковые цены (и валюту) каждого товара в интервалы.
+    Возвращает (строк было, строк стало).
+    """
+    with _connections.connection(write=True) as conn:
+        before = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+        conn.execute("DROP TABLE IF EXISTS temp._runs")
+        conn.execute("DROP TABLE IF EXISTS temp._keep")
+        conn.execute(
+            """
+            CREATE TEMP TABLE _runs AS
+            WITH marked AS (
+                SELECT id, product_id, checked_at, COALESCE(last_seen, checked_at) AS seen, check_count,
+                       CASE WHEN price_minor IS LAG(price_minor) OVER w AND currency IS LAG(currency) OVER w
+                            THEN 0 ELSE 1 END AS is_start
+                FROM prices
+                WINDOW w AS (PARTITION BY product_id ORDER BY checked_at, id)
+            ), numbered AS (
+                SELECT *, SUM(is_start) OVER (PARTITION BY product_id ORDER BY checked_at, id) AS run
+                FROM marked
+            )
+            SELECT id, product_id, run, seen, check_count,
+                   ROW_NUMBER() OVER (PARTITION BY product_id, run ORDER BY checked_at, id) AS rn
+            FROM numbered
+            """
+        )
+        conn.execute("CREATE TEMP TABLE _keep (id INTEGER PRIMARY KEY, last_seen, check_count INTEGER)")
+        conn.execute(
+            """
+            INSERT INTO _keep(id, last_seen, check_count)
+            SELECT MAX(CASE WHEN rn = 1 THEN id END), MAX(seen), SUM(check_count)
+            FROM _runs GROUP BY product_id, run HAVING COUNT(*) > 1
+            """
+        )
+        conn.execute(
+            "UPDATE prices SET last_seen = (SELECT last_seen FROM _keep WHERE _keep.id = prices.id), "
+            "check_count = (SELECT check_count FROM _keep WHERE _keep.id = prices.id) "
+            "WHERE id IN (SELECT id FROM _keep)"
+        )
+        conn.execute("DELETE FROM prices WHERE id IN (SELECT id FROM _runs WHERE rn > 1)")
+        conn.execute("DROP TABLE temp._runs")
+        conn.execute("DROP TABLE temp._keep")
+        after = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+        _reset_rollups(conn)
+    return before, after
+
+
+def prune_history(before: str) -> int:
+    """
+    Удалить из prices строки с checked_at < before ('YYYY-MM-DD HH:MM:SS' UTC) — после выгрузки
+    в архив (history_archive). Остаются последняя строка каждого товара (её продлевает режим
+    intervals, от неё считаются новые строки) и интервалы, которые тянутся за before.
+    latest_prices и агрегаты до before не меняются: refresh_rollups() дальше не трогает периоды
+    раньше before. Возвращает число удалённых строк.
+    """
+    with _connections.connection(write=True) as conn:
+        deleted = conn.execute(
+            f"""
+            DELETE FROM prices
+            WHERE checked_at < {_checked_at_param_sql()} AND COALESCE(last_seen, checked_at) < {_checked_at_param_sql()}
+              AND id NOT IN (SELECT (SELECT id FROM prices WHERE product_id = lp.product_id
+                                     ORDER BY checked_at DESC, id DESC LIMIT 1)
+                             FROM latest_prices lp)
+            """,
+            (before, before),
+        ).rowcount
+        conn.execute("INSERT INTO meta(key, value) VALUES('pruned_before', ?) "
+                     "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)", (before,))
+    return deleted
+
+
+def vacuum() -> None:
+    """Вернуть освободившееся место файлу БД (после compact_history/удалений)."""
+    conn = get_conn()
+    conn.isolation_level = None
+    conn.execute("VACUUM")
     conn.close()
+
+
+def _ts_raw_sql(expr: str) -> str:
+    """SQL: текстовая дата (UTC) -> значение checked_at текущей схемы (для сравнения по индексу)."""
+    return text_to_ms_sql(expr) if schema_version() >= SCHEMA_V2 else expr
+
+
+def refresh_rollups(full: bool = False) -> int:
+    """
+    Обновить price_rollups. Пересчитываются только периоды товаров, где с прошлого раза появились
+    замеры: новые строки prices (в т.ч. задним числом из import-csv) или продлённые интервалы.
+    full=True (или первый запуск) — пересчитать всё. Периоды раньше prune_history() не трогаются:
+    их замеров в prices уже нет. Интервал режима intervals раскладывается по всем дням от checked_at
+    до last_seen (замеры внутри — равномерно), как если бы каждый замер был строкой.
+    Возвращает число записанных строк агрегатов.
+    """
+    with _connections.connection(write=True) as conn:
+        mark = conn.execute("SELECT value FROM meta WHERE key = 'rollup_max_id'").fetchone()
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM prices").fetchone()[0]
+        pruned = conn.execute("SELECT value FROM meta WHERE key = 'pruned_before'").fetchone()
+
+        conn.execute("DROP TABLE IF EXISTS temp._rollup_dirty")
+        conn.execute("DROP TABLE IF EXISTS temp._rollup_points")
+        # lo — самый ранний затронутый замер товара; с начала его периодов всё и пересчитывается
+        conn.execute("CREATE TEMP TABLE _rollup_dirty (product_id INTEGER PRIMARY KEY, lo, lo_text TEXT, lo_floor)")
+        if full or mark is None:
+            if pruned is None:
+                conn.execute("DELETE FROM price_rollups")
+            else:
+                for period, bucket_sql in ROLLUP_BUCKET_SQL.items():
+                    conn.execute(f"DELETE FROM price_rollups WHERE period = ? AND bucket >= {bucket_sql.format(ts='?')}",
+                                 (period, pruned[0]))
+            conn.execute("DELETE FROM price_rollups_state")
+            conn.execute("INSERT INTO _rollup_dirty(product_id, lo) SELECT product_id, MIN(checked_at) FROM prices GROUP BY product_id")
+        else:
+            # Счётчик замеров в latest_prices растёт при любой записи, в т.ч. когда режим intervals
+            # продлевает строку. Затронуто всё, начиная с новых строк (id > метки, бывают и задним
+            # числом) и с прежней последней строки товара — только её и мог продлить intervals.
+            conn.execute(
+                """
+                INSERT INTO _rollup_dirty(product_id, lo)
+                SELECT lp.product_id, MIN(COALESCE(s.last_row_at, n.lo), COALESCE(n.lo, s.last_row_at))
+                FROM latest_prices lp
+                LEFT JOIN price_rollups_state s ON s.product_id = lp.product_id
+                LEFT JOIN (SELECT product_id, MIN(checked_at) AS lo FROM prices NOT INDEXED WHERE id > ? GROUP BY product_id) n
+                       ON n.product_id = lp.product_id
+                WHERE s.observations IS NOT lp.observations
+                """,
+                (int(mark[0]),),
+            )
+        if pruned is not None:
+            # раньше pruned_before замеры остались только в архиве — эти периоды агрегатов заморожены
+            conn.execute(f"UPDATE _rollup_dirty SET lo = MAX(lo, {_ts_raw_sql('?')})", (pruned[0],))
+        conn.execute(f"UPDATE _rollup_dirty SET lo_text = {ts_text_sql('lo')}")
+        conn.execute(f"UPDATE _rollup_dirty SET lo_floor = {_ts_raw_sql(ROLLUP_BUCKET_SQL['day'].format(ts='lo_text'))}")
+
+        # Точки затронутых товаров: замеры-строки — как есть, интервалы (check_count > 1) — по дням,
+        # которые они покрывают (interval_observations); интервал, начатый раньше, может тянуться
+        # в пересчитываемый период (idx_prices_intervals)
+        conn.execute(
+            f"""
+            CREATE TEMP TABLE _rollup_points AS
+            SELECT pr.id, pr.product_id, pr.currency, pr.price_minor AS price,
+                   {ts_text_sql('pr.checked_at')} AS ts, 1 AS w
+            FROM _rollup_dirty d CROSS JOIN prices pr  -- CROSS JOIN: сначала товары, затем prices по индексу
+            WHERE pr.product_id = d.product_id AND pr.checked_at >= d.lo_floor AND pr.check_count = 1
+            """
+        )
+        intervals = conn.execute(
+            f"""
+            SELECT pr.id, pr.product_id, pr.currency, pr.price_minor,
+                   {ts_text_sql('pr.checked_at')}, {ts_text_sql('pr.last_seen')}, pr.check_count, substr(d.lo_text, 1, 10)
+            FROM _rollup_dirty d CROSS JOIN prices pr
+            WHERE pr.product_id = d.product_id AND pr.check_count > 1 AND pr.last_seen >= d.lo_floor
+            """
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO _rollup_points VALUES (?, ?, ?, ?, ?, ?)",
+            ((*row[:-4], ts, w) for row in intervals for ts, w in interval_observations(*row[-4:])),
+        )
+        written = 0
+        for period, bucket_sql in ROLLUP_BUCKET_SQL.items():  # day первым: недели и месяцы считаются из дней
+            lo_bucket = bucket_sql.format(ts="d.lo_text")
+            conn.execute(
+                f"DELETE FROM price_rollups WHERE period = ? AND bucket >= ("
+                f"SELECT {lo_bucket} FROM _rollup_dirty d WHERE d.product_id = price_rollups.product_id)",
+                (period,),
+            )
+            if period == "day":
+                # последняя цена дня — у точки с наибольшим (ts, id): склеены в одну строку для MAX(),
+                # чтобы обойтись одним GROUP BY без оконной функции (ts — 19 символов, id — 12)
+                src = f"""
+                    SELECT p.product_id, p.currency, {bucket_sql.format(ts="p.ts")} AS b,
+                           MIN(p.price), MAX(p.price), 1.0 * SUM(p.price * p.w) / SUM(p.w),
+                           CAST(substr(MAX(printf('%s%012d%d', p.ts, p.id, p.price)), 32) AS INTEGER),
+                           SUM(p.w), MIN(p.ts), MAX(p.ts)
+                    FROM _rollup_points p
+                    GROUP BY p.product_id, p.currency, b
+                """
+            else:
+                src = f"""
+                    SELECT r.product_id, r.currency, {bucket_sql.format(ts="r.bucket")} AS b,
+                           MIN(r.min_minor), MAX(r.max_minor), SUM(r.avg_minor * r.checks) / SUM(r.checks),
+                           CAST(substr(MAX(r.last_at || r.last_minor), 20) AS INTEGER),
+                           SUM(r.checks), MIN(r.first_at), MAX(r.last_at)
+                    FROM _rollup_dirty d CROSS JOIN price_rollups r
+                    WHERE r.period = 'day' AND r.product_id = d.product_id AND r.bucket >= {lo_bucket}
+                    GROUP BY r.product_id, r.currency, b
+                """
+            written += conn.execute(
+                f"INSERT INTO price_rollups(period, product_id, currency, bucket, min_minor, max_minor, avg_minor, "
+                f"last_minor, checks, first_at, last_at) SELECT ?, * FROM ({src})",
+                (period,),
+            ).rowcount
+
+        conn.execute(
+            """
+            INSERT INTO price_rollups_state(product_id, observations, last_row_at)
+            SELECT lp.product_id, lp.observations, (SELECT checked_at FROM prices WHERE product_id = lp.product_id
+                                                    ORDER BY checked_at DESC, id DESC LIMIT 1)
+            FROM latest_prices lp WHERE lp.product_id IN (SELECT product_id FROM _rollup_dirty)
+            ON CONFLICT(product_id) DO UPDATE SET observations = excluded.observations, last_row_at = excluded.last_row_at
+            """
+        )
+        conn.execute("DROP TABLE temp._rollup_dirty")
+        conn.execute("DROP TABLE temp._rollup_points")
+        conn.execute("INSERT INTO meta(key, value) VALUES('rollup_max_id', ?) "
+                     "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (max_id,))
+    return written
+
+
+def _reset_rollups(conn: sqlite3.Connection) -> None:
+    """Строки prices переписаны целиком (compact_history, migrate_to_v2) — следующий refresh_rollups полный."""
+    conn.execute("DELETE FROM meta WHERE key = 'rollup_max_id'")
+
+
+def rollups(period: str = "day",
+            product_ids: Optional[Iterable[int]] = None,
+            since: Optional[str] = None,
+            until: Optional[str] = None) -> List[tuple]:
+    """
+    Агрегаты из price_rollups по имени товара и периоду:
+    (product_id, name, currency, bucket, min_minor, max_minor, avg_minor, last_minor, checks).
+    since <= bucket < until ('YYYY-MM-DD'). Свежесть — на момент последнего refresh_rollups().
+    """
+    if period not in ROLLUP_BUCKET_SQL:
+        raise ValueError(f"Неизвестный период агрегатов: {period!r}")
+    where, params = ["r.period = ?"], [period]
+    if since is not None:
+        where.append("r.bucket >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("r.bucket < ?")
+        params.append(until)
+    if product_ids is None:
+        parts: List[Optional[list]] = [None]
+    else:
+        ids = list(dict.fromkeys(product_ids))
+        parts = [ids[i:i + _MAX_VARS] for i in range(0, len(ids), _MAX_VARS)]
+    rows: List[tuple] = []
+    with _connections.connection() as conn:
+        for part in parts:
+            cond = where if part is None else where + [f"r.product_id IN ({','.join('?' * len(part))})"]
+            rows += conn.execute(
+                f"""
+                SELECT p.id, p.name, r.currency, r.bucket, r.min_minor, r.max_minor, r.avg_minor, r.last_minor, r.checks
+                FROM price_rollups r
+                JOIN products p ON p.id = r.product_id
+                WHERE {" AND ".join(cond)}
+                ORDER BY p.name, r.bucket, r.currency
+                """,
+                params + (part or []),
+            ).fetchall()
+    if len(parts) > 1:
+        rows.sort(key=lambda r: (r[1], r[3], r[2]))  # как ORDER BY p.name, r.bucket, r.currency по всем пачкам id
     return rows
+
+
+def load_page_cache() -> Dict[str, Tuple[Optional[str], Optional[str], Optional[str]]]:
+    """url -> (etag, last_modified, content_hash)"""
+    with _connections.connection() as conn:
+        cur = conn.execute("SELECT url, etag, last_modified, content_hash FROM page_cache")
+        rows = {r[0]: (r[1], r[2], r[3]) for r in cur.fetchall()}
+    return rows
+
+
+def save_page_cache(url: str, etag: Optional[str], last_modified: Optional[str], content_hash: Optional[str]) -> None:
+    with _connections.connection(write=True) as conn:
+        conn.execute(
+            "INSERT INTO page_cache(url, etag, last_modified, content_hash) VALUES(?,?,?,?) "
+            "ON CONFLICT(url) DO UPDATE SET etag=excluded.etag, last_modified=excluded.last_modified, "
+            "content_hash=excluded.content_hash, checked_at=datetime('now')",
+            (url, etag, last_modified, content_hash),
+        )
+
+
+def load_url_stats() -> Dict[str, tuple]:
+    """url -> (successes, failures, consecutive_failures, avg_ms)"""
+    with _connections.connection() as conn:
+        cur = conn.execute("SELECT url, successes, failures, consecutive_failures, avg_ms FROM url_stats")
+        rows = {r[0]: tuple(r[1:]) for r in cur.fetchall()}
+    return rows
+
+
+def save_url_stats(rows: List[tuple]) -> None:
+    """rows: (url, successes, failures, consecutive_failures, avg_ms, ok) — одна транзакция на пачку."""
+    with _connections.connection(write=True) as conn:
+        conn.executemany(
+            "INSERT INTO url_stats(url, successes, failures, consecutive_failures, avg_ms, last_ok_at, last_fail_at) "
+            "VALUES(?1, ?2, ?3, ?4, ?5, CASE WHEN ?6 THEN datetime('now') END, CASE WHEN ?6 THEN NULL ELSE datetime('now') END) "
+            "ON CONFLICT(url) DO UPDATE SET successes=excluded.successes, failures=excluded.failures, "
+            "consecutive_failures=excluded.consecutive_failures, avg_ms=excluded.avg_ms, "
+            "last_ok_at=COALESCE(excluded.last_ok_at, url_stats.last_ok_at), "
+            "last_fail_at=COALESCE(excluded.last_fail_at, url_stats.last_fail_at)",
+            rows,
+        )
@@ -22,3 +22,10 @@ PRODUCT_TITLE = (By.ID, 'pagetitle')
 # </span>
 PRICE_VALUE = (By.CSS_SELECTOR, '.values_wrapper .price_value')
 PRICE_CURRENCY = (By.CSS_SELECTOR, '.values_wrapper .price_currency')
+
+# Поля карточки для извлечения за один проход (extract.extract_fields / http_fetch.find_fields)
+PRODUCT_FIELDS = {
+    "name": PRODUCT_TITLE,
+    "price_value": PRICE_VALUE,
+    "price_currency": PRICE_CURRENCY,
+}
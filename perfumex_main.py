@@ -3,6 +3,7 @@
 import argparse
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
 
@@ -14,6 +15,19 @@ from selenium.webdriver.support import expected_conditions as EC
 
 import perfumex_db as db
 import perfumex_locators as L
+from browser_profiles import PROFILES, apply_profile, after_start
+from extract import extract_fields
+from fetch_metrics import NULL_METRICS, RunMetrics
+from change_cache import ChangeCache, UNCHANGED, fetch_html
+from db_session import DEFAULT_COMMIT_EVERY, DEFAULT_COMMIT_INTERVAL
+from driver_pool import DriverPool, DEFAULT_MAX_PAGES
+from fetch_runner import run_groups
+from history_export import COMPRESSIONS, EXPORT_FORMATS, checked_at_arg
+from history_import import DEFAULT_CHUNK_SIZE
+from ingest_queue import DEFAULT_QUEUE_SIZE, IngestQueue, now_text
+from perfumex_session import DEFAULT_SESSION_FILE, PerfumexSession
+from report_cache import HISTORY_SHEET_ROWS
+from url_health import UrlHealth, check_cancelled, try_urls
 from perfumex_utils import parse_price_and_currency, load_env_kv
 
 DEFAULT_LINKS_FILE = Path("links_perfumex.txt")
@@ -41,9 +55,10 @@ def load_links_txt(links_file: Path) -> List[List[str]]:
 
 def build_driver(browser: str = "chrome",
                  headless: bool = True,
-                 driver_path: str | None = None) -> webdriver.Chrome:
+                 driver_path: str | None = None,
+                 profile: str = "full") -> webdriver.Chrome:
     options = ChromeOptions()
-    options.add_argument("--window-size=1920,1080")
+    apply_profile(options, profile)
     if headless:
         options.add_argument("--headless=new")
 
@@ -58,12 +73,16 @@ def build_driver(browser: str = "chrome",
         drv = driver_path or os.environ.get("YA_DRIVER")
         if drv and Path(drv).exists():
             service = ChromeService(executable_path=drv)
-            return webdriver.Chrome(service=service, options=options)
-        # Фоллбэк — пусть Selenium Manager попробует сам
-        return webdriver.Chrome(options=options)
+            driver = webdriver.Chrome(service=service, options=options)
+        else:
+            # Фоллбэк — пусть Selenium Manager попробует сам
+            driver = webdriver.Chrome(options=options)
+    else:
+        # Chrome по умолчанию (Selenium Manager подтянет chromedriver)
+        driver = webdriver.Chrome(options=options)
 
-    # Chrome по умолчанию (Selenium Manager подтянет chromedriver)
-    return webdriver.Chrome(options=options)
+    after_start(driver, profile)
+    return driver
 
 
 def login_once(driver: webdriver.Chrome, email: str, password: str, timeout: int = 30) -> None:
@@ -83,23 +102,54 @@ def login_once(driver: webdriver.Chrome, email: str, password: str, timeout: int
     WebDriverWait(driver, timeout).until(EC.invisibility_of_element_located(L.BTN_LOGIN))
 
 
-def fetch_product(driver: webdriver.Chrome, url: str, timeout: int = 30) -> tuple[str, int, str]:
-    driver.get(url)
+def fetch_product(driver: webdriver.Chrome, url: str, timeout: int = 30,
+                  metrics=NULL_METRICS) -> tuple[str, int, str]:
+    check_cancelled()
+    with metrics.span("navigation", url):
+        driver.get(url)
 
-    # Название
-    title_elt = WebDriverWait(driver, timeout).until(EC.visibility_of_element_located(L.PRODUCT_TITLE))
-    name = title_elt.text.strip()
+    # Название, цена и валюта — одним ожиданием (один execute_script на цикл опроса)
+    with metrics.span("extract", url):
+        fields = extract_fields(driver, L.PRODUCT_FIELDS, timeout=timeout)
+    with metrics.span("parse", url):
+        price_minor, currency = parse_price_and_currency(fields["price_value"], fields["price_currency"])
+    return fields["name"], price_minor, currency
 
-    # Цена + валюта
-    value_elt = WebDriverWait(driver, timeout).until(EC.visibility_of_element_located(L.PRICE_VALUE))
-    curr_elt = WebDriverWait(driver, timeout).until(EC.visibility_of_element_located(L.PRICE_CURRENCY))
-    price_minor, currency = parse_price_and_currency(value_elt.text, curr_elt.text)
-    return name, price_minor, currency
 
-
-def cmd_init_db(_: argparse.Namespace) -> None:
-    db.init_db()
-    print(f"Инициализация БД: {db.DB_PATH.resolve()}")
+def fetch_product_http(url: str, fetcher, cache=None, metrics=NULL_METRICS):
+    """
+    Карточка без браузера: GET с куками авторизованной сессии + те же локаторы.
+    (name, price_minor, currency); None — если в HTML нет названия/цены (нужен браузер);
+    change_cache.UNCHANGED — сервер ответил 304.
+    """
+    from http_fetch import parse_document, find_fields
+
+    with metrics.span("http", url):
+        page_html = fetch_html(fetcher, url, cache)
+    if page_html is UNCHANGED:
+        return UNCHANGED
+    with metrics.span("extract", url):
+        fields = find_fields(parse_document(page_html), L.PRODUCT_FIELDS)
+    if fields is None:
+        return None
+    with metrics.span("parse", url):
+        price_minor, currency = parse_price_and_currency(fields["price_value"], fields["price_currency"])
+    return fields["name"], price_minor, currency
+
+
+def cmd_init_db(args: argparse.Namespace) -> None:
+    db.init_db(schema=args.schema)
+    print(f"Инициализация БД: {db.DB_PATH.resolve()} (схема v{db.schema_version()})")
+
+
+def cmd_migrate_db(_: argparse.Namespace) -> None:
+    size_before = db.DB_PATH.stat().st_size if db.DB_PATH.exists() else 0
+    moved = db.migrate_to_v2()
+    if not moved and db.schema_version() >= 2:
+        print(f"БД уже в схеме v2: {db.DB_PATH.resolve()}")
+        return
+    size_after = db.DB_PATH.stat().st_size
+    print(f"БД переведена на схему v2: {moved} цен, размер {size_before / 1e6:.1f} → {size_after / 1e6:.1f} МБ")
 
 
 def cmd_fetch(args: argparse.Namespace) -> None:
@@ -119,43 +169,276 @@ def cmd_fetch(args: argparse.Namespace) -> None:
         print("Файл со ссылками пуст. Заполните links_perfumex.txt (1 строка = 1 товар, фоллбэки через '|').")
         return
 
-    driver = build_driver(browser=args.browser, headless=not args.headful, driver_path=args.driver_path)
-    try:
+    metrics = RunMetrics("perfumex")
+    total_groups = len(groups)
+
+    # Сохранённая сессия: если куки из прошлого запуска ещё действуют — вход не нужен
+    session = PerfumexSession(Path(args.session_file))
+    if not args.fresh_login and session.restore():
+        print("→ Используется сохранённая сессия (вход не требуется).")
+
+    def _full_login(driver: webdriver.Chrome) -> None:
         print("→ Авторизация на сайте…")
         login_once(driver, email, password, timeout=30)
-        print("   Авторизация успешна.")
-
-        # Обход карточек
-        for urls in groups:
-            last_error = None
-            fetched = False
-            for url in urls:
-                print(f"   Пробую: {url}")
-                try:
-                    name, price_minor, currency = fetch_product(driver, url, timeout=30)
-                    pid = db.upsert_product(name)
-                    latest_latest = db.insert_price(pid, price_minor, currency)
-                    # получим предыдущее значение для сообщения пользователю
-                    # (лучше не делать отдельный запрос — но для краткости оставим так)
-                    print(f"   ОК: {name} — {price_minor/100:.2f} {currency}")
-                    fetched = True
-                    break
-                except Exception as e:
-                    last_error = e
-                    print(f"   Ошибка: {e}")
-            if not fetched:
-                print(f"   Не удалось получить цену ни по одному URL. Последняя ошибка: {last_error}")
-
-    finally:
-        driver.quit()
+        print("   Авторизация успешна, сессия сохранена.")
+
+    def _login(driver: webdriver.Chrome) -> None:
+        # Каждая новая сессия пула получает сохранённые куки или (если их нет) входит сама
+        with metrics.span("login"):
+            session.ensure_login(driver, _full_login)
+
+    def _new_driver() -> webdriver.Chrome:
+        with metrics.span("build_driver"):
+            return build_driver(browser=args.browser, headless=not args.headful,
+                                driver_path=args.driver_path, profile=args.profile)
+
+    workers = max(1, args.workers)
+    pool = DriverPool(
+        _new_driver,
+        size=workers * max(1, args.race),
+        max_pages=args.recycle_after,
+        on_create=_login,
+    )
+    # Цены пишет один поток пачками; воркеры только ставят их в очередь
+    ingest = IngestQueue(db, maxsize=args.queue_size, batch_size=args.commit_every,
+                         flush_interval=args.commit_interval)
+    fetcher = None
+    if args.engine in ("http", "async"):
+        from http_fetch import HttpFetcher
+        fetcher = HttpFetcher(pool_size=max(10, workers))
+
+    cache = ChangeCache(db) if args.skip_unchanged else None
+    health = None if args.keep_order else UrlHealth(db)
+
+    def store(url: str, name: str, price_minor: int, currency: str, log) -> None:
+        with metrics.span("db", url):
+            if cache is not None and cache.unchanged(url, name, price_minor, currency):
+                cache.commit(url, name, price_minor, currency)
+                log(f"   Без изменений: {name} — {price_minor/100:.2f} {currency}")
+                return
+            prev = db.latest_price_by_name(name)  # уникальность по имени товара
+            # страницу в кэше отмечаем, только когда писатель действительно записал цену в БД
+            on_written = None if cache is None else (lambda: cache.commit(url, name, price_minor, currency))
+            ingest.put((name, price_minor, currency, now_text()), on_written)
+        prev_text = f"{prev[0]/100:.2f} {prev[1]}" if prev is not None else "—"
+        log(f"   ОК: {name} — {price_minor/100:.2f} {currency} (предыдущее: {prev_text})")
+
+    def scrape(url: str, log):
+        if args.engine == "http":
+            try:
+                result = fetch_product_http(url, fetcher, cache, metrics)
+            except Exception as e:
+                result = None
+                log(f"   HTTP: {e}")
+            if result is not None:
+                return result
+            log("   HTTP: цена не найдена в HTML — открываю в браузере")
+        check_cancelled()  # гонку уже выиграл другой URL — браузер из пула не занимаем
+        with pool.driver() as driver:
+            return fetch_product(driver, url, timeout=30, metrics=metrics)
+
+    def handle_group(urls, log) -> None:
+        try:
+            # самый быстрый из рабочих URL — первым; с --race K первые K запускаются наперегонки
+            url, result = try_urls(urls, lambda u: scrape(u, log), log, health, race=args.race)
+        except Exception as e:
+            log(f"   Не удалось получить цену ни по одному URL. Последняя ошибка: {e}")
+            return
+        if result is UNCHANGED:
+            log("   Без изменений (304 Not Modified)")
+            return
+        try:
+            store(url, *result, log)
+        except Exception as e:
+            log(f"   Ошибка: {e}")
+
+    # Одно соединение с БД на весь прогон: записи уходят пачками, а не коммитом на каждую цену
+    with db.session(commit_every=args.commit_every, commit_interval=args.commit_interval), ingest:
+        if ingest.replayed:
+            print(f"Дописаны цены прошлого прерванного запуска: {ingest.replayed}")
+        try:
+            with pool:
+                if fetcher is None:
+                    # Все воркеры готовы к работе (вход или восстановление сессии) до обхода
+                    pool.warm_up()
+                else:
+                    if not session.cookies:
+                        # Сохранённой сессии нет — один раз входим через браузер
+                        with pool.driver():
+                            pass
+                    # HTTP-запросы идут с куками авторизованной сессии
+                    fetcher.load_cookies(session.cookies)
+                if args.engine == "async":
+                    groups = _fetch_async_stage(groups, fetcher, cache, health, metrics, args, store)
+                    if groups:
+                        print(f"→ Без цены в HTML осталось товаров: {len(groups)} — обрабатываю в браузере")
+
+                # Обход карточек
+                run_groups(groups, handle_group, workers=workers)
+        finally:
+            if fetcher is not None:
+                fetcher.close()
+            if health is not None:
+                health.flush()
+    if ingest.error is not None:
+        print(f"Не все цены записаны в БД ({ingest.error}). Они сохранены в {ingest.spill_path} "
+              "и будут дописаны при следующем запуске fetch")
+    with metrics.span("db"):
+        db.refresh_rollups()  # агрегаты по дням/неделям/месяцам — только затронутые периоды
+    if cache is not None:
+        print(f"Пропущено без изменений: {cache.skipped}")
+    if args.metrics_out:
+        metrics.print_summary()
+        metrics.write_json(Path(args.metrics_out), engine=args.engine, workers=workers, groups=total_groups)
+        print(f"Замеры сохранены: {Path(args.metrics_out).resolve()}")
+
+
+def _fetch_async_stage(groups, fetcher, cache, health, metrics, args: argparse.Namespace, store):
+    """Все группы разом через asyncio-движок; возвращает те, что не удалось взять из HTML."""
+    from async_fetch import AsyncFetchEngine, load_host_limits
+
+    limits = load_host_limits(Path(args.host_limits) if args.host_limits else None)
+    engine = AsyncFetchEngine(lambda url: fetch_product_http(url, fetcher, cache, metrics), limits=limits,
+                              on_attempt=health.record if health else None)
+    leftovers = []
+    # store() читает SQLite и ждёт места в очереди ingest — в event loop это тормозило бы все загрузки.
+    # Один поток-писатель: цены пишутся по одной, в порядке готовности групп
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+
+    def write(url: str, result: tuple, lines: List[str]) -> None:
+        try:
+            store(url, *result, lines.append)
+        except Exception as e:
+            lines.append(f"   Ошибка записи в БД: {e}")
+        print("\n".join(lines))
+
+    def on_done(i: int, outcome) -> None:
+        lines = [f"→ {groups[i][0]}"]
+        lines += [f"   HTTP: {err}" for err in outcome.errors]
+        if outcome.result is UNCHANGED:
+            lines.append("   Без изменений (304 Not Modified)")
+        elif outcome.result is not None:
+            writer.submit(write, outcome.url, outcome.result, lines)
+            return
+        else:
+            leftovers.append(i)
+        print("\n".join(lines))
+
+    with writer:
+        engine.run_groups([health.order(g) if health else g for g in groups], on_done)
+    return [groups[i] for i in sorted(leftovers)]
+
+
+def cmd_rebuild_latest(args: argparse.Namespace) -> None:
+    db.init_db()
+    if args.check:
+        bad = db.check_latest_prices()
+        print(f"Текущие цены расходятся с историей у {len(bad)} товаров" + (f": {bad[:20]}" if bad else ""))
+        return
+    count = db.rebuild_latest_prices()
+    print(f"Таблица текущих цен пересобрана: {count} товаров")
+
+
+def cmd_history_mode(args: argparse.Namespace) -> None:
+    db.init_db()
+    if args.mode:
+        db.set_history_mode(args.mode)
+    print(f"Режим хранения истории: {db.history_mode()}")
+
+
+def cmd_compact_history(_: argparse.Namespace) -> None:
+    db.init_db()
+    size_before = db.DB_PATH.stat().st_size
+    before, after = db.compact_history()
+    db.set_history_mode("intervals")
+    db.refresh_rollups()
+    db.vacuum()
+    size_after = db.DB_PATH.stat().st_size
+    print(f"История свёрнута: строк {before} → {after}, размер {size_before / 1e6:.1f} → {size_after / 1e6:.1f} МБ; "
+          "дальше одинаковые цены подряд продлевают последнюю строку (режим intervals)")
+
+
+def cmd_backfill_rollups(_: argparse.Namespace) -> None:
+    db.init_db()
+    written = db.refresh_rollups(full=True)
+    print(f"Агрегаты по дням/неделям/месяцам пересчитаны: {written} строк")
+
+
+def cmd_archive_history(args: argparse.Namespace) -> None:
+    from history_archive import archive_cutoff, archive_history
+
+    db.init_db()
+    size_before = db.DB_PATH.stat().st_size
+    archived, pruned, files = archive_history(db, args.older_than, archive_dir=args.archive_dir, prune=args.prune)
+    if pruned:
+        db.vacuum()
+    print(f"В архив (до {archive_cutoff(args.older_than)[:10]}) выгружено строк: {archived}, файлов месяцев: {len(files)}")
+    if args.prune:
+        size_after = db.DB_PATH.stat().st_size
+        print(f"Удалено из БД строк: {pruned}, размер {size_before / 1e6:.1f} → {size_after / 1e6:.1f} МБ")
+
+
+def cmd_export(args: argparse.Namespace) -> None:
+    from history_export import export_history, guess_format
+
+    db.init_db()
+    out_path = Path(args.output)
+    fmt, compression = guess_format(out_path)
+    fmt, compression = args.format or fmt or "csv", args.compression or compression
+    filters = {"since": args.since, "until": args.until}
+    if args.product:
+        filters["product_ids"] = db.find_products(args.product)
+        if not filters["product_ids"]:
+            print("Товары по --product не найдены, выгружать нечего.")
+            return
+    if args.currency:
+        filters["currency"] = args.currency.upper()
+    written = export_history(db, out_path, fmt, compression, expand=args.expand_history,
+                             archive_dir=args.archive_dir, **filters)
+    print(f"Выгружено строк: {written} → {out_path.resolve()} ({fmt}" + (f", {compression})" if compression else ")"))
+
+
+def cmd_import_csv(args: argparse.Namespace) -> None:
+    from history_import import import_rows, normalize_checked_at, read_csv_rows
+
+    db.init_db()
+    bad = 0
+
+    def rows():
+        nonlocal bad
+        for r in read_csv_rows(Path(args.csv)):
+            name = (r.get("name") or "").strip()
+            try:
+                if r.get("price_minor"):
+                    price_minor = int(r["price_minor"])
+                    currency = (r.get("currency") or args.currency).strip().upper()
+                else:
+                    price_minor, currency = parse_price_and_currency(r.get("price", ""),
+                                                                     r.get("currency") or args.currency)
+                checked_at = normalize_checked_at(r.get("checked_at"))
+            except ValueError:
+                name = ""  # цена или дата не разобраны — строка пропускается
+            if not name:
+                bad += 1
+                continue
+            yield name, price_minor, currency, checked_at
+
+    with db.session():
+        products, inserted = import_rows(db, rows(), chunk_size=args.chunk_size,
+                                         on_chunk=lambda n: print(f"   загружено строк: {n}"))
+    db.refresh_rollups()
+    print(f"Импорт завершён: {inserted} цен по {products} товарам" + (f", пропущено строк: {bad}" if bad else ""))
 
 
 def cmd_report(args: argparse.Namespace) -> None:
     from perfumex_report import build_excel_report
+    db.init_db()
+    db.refresh_rollups()
     out_path = Path(args.output)
     try:
-        out_path = build_excel_report(out_path)
-        print(f"Отчёт сформирован: {out_path.resolve()}")
+        build_excel_report(out_path, expand_history=args.expand_history, full=args.full,
+                           history_rows=args.sheet_rows, shard_files=args.shard_files, months=args.months,
+                           log=lambda message: print(f"{message}: {out_path.resolve()}"))
     except PermissionError:
         print("Не удалось записать отчёт. Похоже, файл открыт в Excel/Numbers. Закройте и повторите.")
 
@@ -165,20 +448,114 @@ def main():
     sub = parser.add_subparsers(required=True)
 
     p1 = sub.add_parser("init-db", help="Создать/инициализировать БД perfumex")
+    p1.add_argument("--schema", type=int, default=1, choices=[1, 2],
+                    help="2 — время замера целым числом (мс) и покрывающий индекс: компактнее и быстрее "
+                         "на большой истории. Действует только для новой БД, старую переводит migrate-db.")
     p1.set_defaults(func=cmd_init_db)
 
+    p6 = sub.add_parser("migrate-db", help="Перевести существующую БД на схему v2 (на месте)")
+    p6.set_defaults(func=cmd_migrate_db)
+
     p2 = sub.add_parser("fetch", help="Собрать данные (авторизация + карточки)")
     p2.add_argument("--links", default=str(DEFAULT_LINKS_FILE), help="Файл со ссылками (links_perfumex.txt)")
     p2.add_argument("--secrets", default=str(DEFAULT_SECRETS_FILE), help="Файл с логином/паролем (secrets_perfumex.env)")
     p2.add_argument("--browser", default="chrome", choices=["chrome", "yandex"], help="Браузер: chrome или yandex")
     p2.add_argument("--headful", action="store_true", help="Окно браузера (по умолчанию headless)")
     p2.add_argument("--driver-path", default=None, help="Путь к yandexdriver (для --browser yandex)")
+    p2.add_argument("--profile", default="full", choices=PROFILES,
+                    help="Профиль загрузки: full (по умолчанию), lean — без картинок/шрифтов/счётчиков")
+    p2.add_argument("--recycle-after", type=int, default=DEFAULT_MAX_PAGES,
+                    help="Перезапускать браузер (с повторным входом) после N страниц, 0 — никогда")
+    p2.add_argument("--workers", type=int, default=1, help="Сколько браузеров работают параллельно (каждый со своим входом)")
+    p2.add_argument("--engine", default="browser", choices=["browser", "http", "async"],
+                    help="browser — только браузер; http — сначала HTTP-запрос с куками входа, браузер как запасной; "
+                         "async — все карточки одновременно по HTTP с лимитами на сайт (--host-limits)")
+    p2.add_argument("--commit-every", type=int, default=DEFAULT_COMMIT_EVERY,
+                    help=f"Коммитить записи в БД пачками по N изменений (по умолчанию {DEFAULT_COMMIT_EVERY}).")
+    p2.add_argument("--commit-interval", type=float, default=DEFAULT_COMMIT_INTERVAL,
+                    help=f"…или не реже чем раз в N секунд (по умолчанию {DEFAULT_COMMIT_INTERVAL:g}).")
+    p2.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                    help=f"Сколько цен может ждать записи в БД; при полной очереди воркеры ждут (по умолчанию {DEFAULT_QUEUE_SIZE}).")
+    p2.add_argument("--metrics-out", default=None,
+                    help="Сохранить замеры по фазам (браузер, загрузка, извлечение, разбор, БД) в JSON и напечатать p50/p95/max")
+    p2.add_argument("--host-limits", default=None, help="JSON с лимитами по доменам для --engine async")
+    p2.add_argument("--race", type=int, default=1,
+                    help="Запускать первые N фоллбэков строки одновременно и брать первый успешный")
+    p2.add_argument("--keep-order", action="store_true",
+                    help="Фоллбэки строго по порядку файла (иначе первым — самый быстрый рабочий URL по истории)")
+    p2.add_argument("--skip-unchanged", action="store_true",
+                    help="Не записывать цену, если карточка не изменилась (для http/async — условные запросы)")
+    p2.add_argument("--session-file", default=str(DEFAULT_SESSION_FILE),
+                    help="Где хранить куки авторизации между запусками (perfumex_session.json)")
+    p2.add_argument("--fresh-login", action="store_true", help="Игнорировать сохранённую сессию и войти заново")
     p2.set_defaults(func=cmd_fetch)
 
     p3 = sub.add_parser("report", help="Сформировать Excel-отчёт perfumex")
     p3.add_argument("--output", default="perfumex_report.xlsx", help="Путь к .xlsx")
+    p3.add_argument("--expand-history", action="store_true",
+                    help="В листе «История» показывать и последний замер каждого интервала (режим intervals).")
+    p3.add_argument("--full", action="store_true",
+                    help="Пересобрать отчёт целиком, не используя кэш прошлой сборки (<отчёт>.cache).")
+    p3.add_argument("--sheet-rows", type=int, default=HISTORY_SHEET_ROWS,
+                    help=f"Строк на лист «История» (по умолчанию {HISTORY_SHEET_ROWS}); больше — история делится "
+                         "на листы по диапазонам товаров, а «История» становится оглавлением со ссылками")
+    p3.add_argument("--shard-files", action="store_true",
+                    help="Части «Истории» писать не листами, а отдельными файлами <отчёт>.history-N.xlsx")
+    p3.add_argument("--months", action="store_true",
+                    help="Добавить лист «По месяцам»: мин./макс./средняя/последняя цена за месяц из агрегатов")
     p3.set_defaults(func=cmd_report)
 
+    p4 = sub.add_parser("import-csv", help="Загрузить историю цен из CSV (name, price, currency, checked_at)")
+    p4.add_argument("csv", help="CSV с колонками name/Товар, price/Цена или price_minor, currency/Валюта, "
+                                "checked_at/Когда проверено")
+    p4.add_argument("--currency", default="USD", help="Валюта для строк без колонки currency (по умолчанию USD).")
+    p4.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                    help=f"Строк в одной пачке записи (по умолчанию {DEFAULT_CHUNK_SIZE}).")
+    p4.set_defaults(func=cmd_import_csv)
+
+    p5 = sub.add_parser("rebuild-latest", help="Пересобрать таблицу текущих цен (latest_prices) из истории")
+    p5.add_argument("--check", action="store_true",
+                    help="Только сверить latest_prices с историей (оконными функциями SQL), ничего не меняя")
+    p5.set_defaults(func=cmd_rebuild_latest)
+
+    p7 = sub.add_parser("history-mode", help="Показать/сменить режим хранения истории (points/intervals)")
+    p7.add_argument("mode", nargs="?", choices=db.HISTORY_MODES,
+                    help="points — строка на каждый замер (по умолчанию); intervals — одинаковая цена подряд "
+                         "хранится одной строкой с last_seen и числом замеров.")
+    p7.set_defaults(func=cmd_history_mode)
+
+    p8 = sub.add_parser("compact-history", help="Свернуть повторы цен в интервалы, включить режим intervals и сжать БД")
+    p8.set_defaults(func=cmd_compact_history)
+
+    p9 = sub.add_parser("backfill-rollups", help="Пересчитать агрегаты по дням/неделям/месяцам по всей истории")
+    p9.set_defaults(func=cmd_backfill_rollups)
+
+    p10 = sub.add_parser("archive-history", help="Выгрузить старую историю цен в Parquet помесячно (archive/<БД>/month=YYYY-MM)")
+    p10.add_argument("--older-than", type=int, default=365,
+                     help="Архивировать замеры старше N дней (целыми месяцами; по умолчанию 365)")
+    p10.add_argument("--prune", action="store_true",
+                     help="После выгрузки удалить эти строки из SQLite (отчёт читает их из архива)")
+    p10.add_argument("--archive-dir", default=None,
+                     help="Каталог архива (по умолчанию archive/<имя файла БД>)")
+    p10.set_defaults(func=cmd_archive_history)
+
+    p11 = sub.add_parser("export", help="Выгрузить историю цен в CSV / JSON Lines / Parquet (потоком, для BI)")
+    p11.add_argument("--output", default="perfumex_history.csv",
+                     help="Файл выгрузки; формат и сжатие берутся из имени: .csv, .jsonl, .parquet, + .gz / .zst")
+    p11.add_argument("--format", default=None, choices=EXPORT_FORMATS, help="Формат, если не подходит имя файла")
+    p11.add_argument("--compression", default=None, choices=COMPRESSIONS,
+                     help="Сжатие gzip или zstd (для parquet — кодек внутри файла; zstd для csv/jsonl — пакет zstandard)")
+    p11.add_argument("--product", action="append", default=None,
+                     help="Только товары, в названии которых есть подстрока (можно указать несколько раз)")
+    p11.add_argument("--since", default=None, type=checked_at_arg, help="С даты/времени включительно (YYYY-MM-DD[ HH:MM:SS], UTC)")
+    p11.add_argument("--until", default=None, type=checked_at_arg, help="По дату/время, не включая (YYYY-MM-DD[ HH:MM:SS], UTC)")
+    p11.add_argument("--currency", default=None, help="Только цены в этой валюте (USD, RUB, ...)")
+    p11.add_argument("--expand-history", action="store_true",
+                     help="Добавить последний замер каждого интервала (режим intervals), как в отчёте")
+    p11.add_argument("--archive-dir", default=None,
+                     help="Каталог архива Parquet (по умолчанию archive/<имя файла БД>)")
+    p11.set_defaults(func=cmd_export)
+
     args = parser.parse_args()
     args.func(args)
 
@@ -1,34 +1,24 @@
 # perfumex_report.py — Excel-отчёт для perfumex.ru (с валютой)
 
 from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
 import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils import get_column_letter
 
 import perfumex_db as db
+from history_archive import archive_distinct
+from report_cache import HISTORY_SHEET_ROWS, default_cache_dir
+from report_pipeline import REPORT_MODES, FrameSheet, HistorySheet, LegendSheet, SheetHook, excel_text, run_report
 
 
 def _latest_snapshot_df() -> pd.DataFrame:
-    rows = db.dump_history()
-    # (product_id, name, price_minor, currency, checked_at)
-    df = pd.DataFrame(rows, columns=["product_id", "name", "price_minor", "currency", "checked_at"])
+    # последняя и предыдущая цена уже лежат в latest_prices — одна строка на товар, без скана истории
+    rows = db.latest_snapshot()
+    df = pd.DataFrame(rows, columns=["product_id", "name", "price_minor", "currency", "prev_minor",
+                                     "checked_at", "changed_at", "observations"])
     if df.empty:
         return df
 
-    df_sorted = df.sort_values(["product_id", "checked_at"], ascending=[True, True])
-    latest_idx = df_sorted.groupby("product_id")["checked_at"].idxmax()
-    latest = df_sorted.loc[latest_idx].copy()
-
-    # предыдущая цена
-    second_idx = df_sorted.groupby("product_id").apply(lambda g: g.iloc[-2].name if len(g) >= 2 else None).dropna().astype(int)
-    prev = df_sorted.loc[second_idx] if len(second_idx) else pd.DataFrame(columns=df.columns)
-
-    latest = latest.merge(
-        prev[["product_id", "price_minor"]].rename(columns={"price_minor": "prev_minor"}),
-        on="product_id",
-        how="left",
-    )
+    latest = df[["product_id", "name", "price_minor", "currency", "checked_at", "prev_minor"]].copy()
     latest["price"] = latest["price_minor"] / 100.0
     latest["prev_price"] = latest["prev_minor"] / 100.0
     latest["change"] = latest["price"] - latest["prev_price"]
@@ -36,134 +26,104 @@ def _latest_snapshot_df() -> pd.DataFrame:
     return latest
 
 
-def _autosize(ws, padding=2, min_w=12, max_w=60):
-    dims = {}
-    for row in ws.iter_rows(values_only=True):
-        for i, cell in enumerate(row, 1):
-            if cell is not None:
-                dims[i] = max(dims.get(i, 0), len(str(cell)))
-    for col_idx, width in dims.items():
-        ws.column_dimensions[get_column_letter(col_idx)].width = min(max(width + padding, min_w), max_w)
-
-
-def build_excel_report(out_path: Path) -> Path:
+# Текущие
+def _latest_sheet_df() -> pd.DataFrame:
+    latest = _latest_snapshot_df()
+    if latest.empty:
+        return pd.DataFrame(columns=["Товар", "Валюта", "Цена", "Предыдущая цена", "Изменение (₽)", "Изменение (%)", "Когда проверено"])
+    latest_out = latest[["name", "currency", "price", "prev_price", "change", "change_pct", "checked_at"]].copy()
+    latest_out.rename(columns={"name": "Товар", "currency": "Валюта", "price": "Цена", "prev_price": "Предыдущая цена",
+                               "change": "Изменение (₽)", "change_pct": "Изменение (%)", "checked_at": "Когда проверено"}, inplace=True)
+    return latest_out
+
+
+LATEST_FORMATS = {
+    "Цена": '#,##0.00',
+    "Предыдущая цена": '#,##0.00',
+    "Изменение (₽)": '+#,##0.00;-#,##0.00;0.00',
+    "Изменение (%)": '+0.00;-0.00;0.00',
+}
+# Подсветка ↑/↓ (3 ячейки)
+LATEST_HIGHLIGHT = ("Изменение (₽)", ["Изменение (₽)", "Предыдущая цена", "Цена"])
+
+
+# История — пачками из БД и архива Parquet (archive-history), без всей истории в памяти
+def _history_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.rename(columns={"name": "Товар", "currency": "Валюта", "checked_at": "Когда проверено"})
+    out["Цена"] = df["price_minor"] / 100.0
+    return out
+
+
+def _history_widths() -> Dict[str, int]:
+    # ширины колонок пишутся до первой строки листа: имена и валюты — из снимка, цены — все разные
+    # из prices и архива (длина «12.34» не растёт с ценой, мин./макс. агрегатов её не дают)
+    snapshot = db.latest_snapshot()
+    prices = set(db.distinct_prices()).union(archive_distinct(db, "price_minor"))
+    return {
+        "Товар": max((len(r[1]) for r in snapshot), default=0),
+        "Валюта": max((len(r[3]) for r in snapshot), default=0),
+        "Цена": max((len(excel_text(p / 100.0)) for p in prices), default=0),
+        "Когда проверено": len("YYYY-MM-DD HH:MM:SS") if snapshot else 0,
+    }
+
+
+# По месяцам — из агрегатов price_rollups, а не из всей истории
+def _months_sheet_df() -> pd.DataFrame:
+    month_df = pd.DataFrame(db.rollups("month"), columns=["product_id", "name", "currency", "bucket", "min_minor",
+                                                          "max_minor", "avg_minor", "last_minor", "checks"])
+    for col, title in (("min_minor", "Мин. цена"), ("max_minor", "Макс. цена"),
+                       ("avg_minor", "Средняя цена"), ("last_minor", "Последняя цена")):
+        month_df[title] = month_df[col] / 100.0
+    month_df.rename(columns={"name": "Товар", "currency": "Валюта", "bucket": "Месяц", "checks": "Замеров"}, inplace=True)
+    return month_df[["Товар", "Валюта", "Месяц", "Мин. цена", "Макс. цена", "Средняя цена", "Последняя цена", "Замеров"]]
+
+
+MONTH_FORMATS = {col: '#,##0.00' for col in ("Мин. цена", "Макс. цена", "Средняя цена", "Последняя цена")}
+
+
+LEGEND = [
+    "• «Изменение (₽)» — разница между текущей и предыдущей ценой.",
+    "• «Изменение (%)» — отношение изменения к предыдущей цене × 100.",
+    "• Зелёная подсветка — цена снизилась (подсвечиваются 3 ячейки: Δ, текущая и предыдущая).",
+    "• Розовая подсветка — цена выросла (подсвечиваются 3 ячейки: Δ, текущая и предыдущая).",
+]
+MONTHS_LEGEND = "• «По месяцам» — минимальная, максимальная, средняя и последняя цена за месяц и число замеров."
+
+
+def report_sheets(extra_sheets: Iterable[SheetHook] = (), history_rows: int = HISTORY_SHEET_ROWS,
+                  shard_files: bool = False, months: bool = False) -> list:
+    """
+    Листы отчёта по порядку; extra_sheets встают перед «Легендой» и получают ту же пачку истории.
+    history_rows, shard_files — деление «Истории» на листы или файлы (HistorySheet).
+    months=True — добавить лист «По месяцам» из агрегатов (по умолчанию книга та же, что и раньше).
+    """
+    month_sheets = [FrameSheet("По месяцам", _months_sheet_df, MONTH_FORMATS)] if months else []
+    return [
+        # "Товар" пошире
+        FrameSheet("Текущие цены", _latest_sheet_df, LATEST_FORMATS, LATEST_HIGHLIGHT, wide={"Товар": (4, 24, 70)}),
+        HistorySheet(["Товар", "Валюта", "Цена", "Когда проверено"], _history_chunk, {"Цена": '#,##0.00'},
+                     _history_widths, max_rows=history_rows, shard_files=shard_files),
+        *month_sheets,
+        *extra_sheets,
+        LegendSheet("Обозначения и подсветка", LEGEND + ([MONTHS_LEGEND] if months else [])),
+    ]
+
+
+def build_excel_report(out_path: Path, expand_history: bool = False, extra_sheets: Iterable[SheetHook] = (),
+                       full: bool = False, history_rows: int = HISTORY_SHEET_ROWS,
+                       shard_files: bool = False, months: bool = False,
+                       log: Optional[Callable[[str], None]] = None) -> Path:
+    """
+    Собрать отчёт в out_path. Рядом хранится кэш <отчёт>.cache: если история не менялась, файл
+    не пересобирается, если только дополнялась — перечитываются лишь товары с новыми замерами.
+    full=True — собрать целиком. «История» длиннее history_rows строк делится на листы по диапазонам
+    товаров (shard_files=True — на файлы <отчёт>.history-N.xlsx). months=True — ещё лист «По месяцам».
+    log — куда сообщить, что сделано (собран целиком, обновлён, актуален).
+    """
     out_path = Path(out_path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    latest = _latest_snapshot_df()
-
-    with pd.ExcelWriter(out_path, engine="openpyxl") as xw:
-        # Текущие
-        if latest.empty:
-            latest_out = pd.DataFrame(columns=["Товар", "Валюта", "Цена", "Предыдущая цена", "Изменение (₽)", "Изменение (%)", "Когда проверено"])
-        else:
-            latest_out = latest[["name", "currency", "price", "prev_price", "change", "change_pct", "checked_at"]].copy()
-            latest_out.rename(columns={"name": "Товар", "currency": "Валюта", "price": "Цена", "prev_price": "Предыдущая цена",
-                                       "change": "Изменение (₽)", "change_pct": "Изменение (%)", "checked_at": "Когда проверено"}, inplace=True)
-        latest_out.to_excel(xw, sheet_name="Текущие цены", index=False)
-
-        # История
-        hist_rows = db.dump_history()
-        hist_df = pd.DataFrame(hist_rows, columns=["product_id", "name", "price_minor", "currency", "checked_at"])
-        if not hist_df.empty:
-            hist_df["Цена"] = hist_df["price_minor"] / 100.0
-        hist_df.rename(columns={"name": "Товар", "currency": "Валюта", "checked_at": "Когда проверено"}, inplace=True)
-        hist_df = hist_df[["Товар", "Валюта", "Цена", "Когда проверено"]]
-        hist_df.to_excel(xw, sheet_name="История", index=False)
-
-    wb = openpyxl.load_workbook(out_path)
-    ws = wb["Текущие цены"]
-    ws.freeze_panes = "A2"
-
-    # Заголовки
-    for c in ws[1]:
-        c.font = Font(bold=True)
-        c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    ws.row_dimensions[1].height = 28
-
-    _autosize(ws)
-
-    # Сделать "Товар" пошире
-    headers = {cell.value: cell.column for cell in ws[1]}
-    col_product = headers.get("Товар")
-    col_price = headers.get("Цена")
-    col_prev = headers.get("Предыдущая цена")
-    col_change = headers.get("Изменение (₽)")
-    col_change_pct = headers.get("Изменение (%)")
-
-    if col_product:
-        max_name_len = 0
-        for row in range(2, ws.max_row + 1):
-            v = ws.cell(row=row, column=col_product).value
-            if v:
-                max_name_len = max(max_name_len, len(str(v)))
-        if max_name_len:
-            ws.column_dimensions[get_column_letter(col_product)].width = min(max(max_name_len + 4, 24), 70)
-
-    # Форматы
-    if col_price:
-        for r in range(2, ws.max_row + 1):
-            ws.cell(row=r, column=col_price).number_format = '#,##0.00'
-    if col_prev:
-        for r in range(2, ws.max_row + 1):
-            ws.cell(row=r, column=col_prev).number_format = '#,##0.00'
-    if col_change:
-        for r in range(2, ws.max_row + 1):
-            ws.cell(row=r, column=col_change).number_format = '+#,##0.00;-#,##0.00;0.00'
-    if col_change_pct:
-        for r in range(2, ws.max_row + 1):
-            ws.cell(row=r, column=col_change_pct).number_format = '+0.00;-0.00;0.00'
-
-    # Подсветка ↑/↓ (3 ячейки)
-    if col_change:
-        for r in range(2, ws.max_row + 1):
-            delta_cell = ws.cell(row=r, column=col_change)
-            prev_cell = ws.cell(row=r, column=col_prev) if col_prev else None
-            price_cell = ws.cell(row=r, column=col_price) if col_price else None
-            try:
-                delta = float(delta_cell.value)
-            except (TypeError, ValueError):
-                delta = 0.0
-            if delta < 0:
-                fill = PatternFill(fill_type="solid", fgColor="C6EFCE")  # зелёный
-                for c in (delta_cell, prev_cell, price_cell):
-                    if c is not None:
-                        c.font = Font(bold=True)
-                        c.fill = fill
-            elif delta > 0:
-                fill = PatternFill(fill_type="solid", fgColor="FFC7CE")  # розовый
-                for c in (delta_cell, prev_cell, price_cell):
-                    if c is not None:
-                        c.font = Font(bold=True)
-                        c.fill = fill
-
-    # История — базовые стили
-    if "История" in wb.sheetnames:
-        wh = wb["История"]
-        wh.freeze_panes = "A2"
-        for c in wh[1]:
-            c.font = Font(bold=True)
-            c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        ws.row_dimensions[1].height = 28
-        _autosize(wh)
-        # Числовой формат для цены
-        hdr_h = {cell.value: cell.column for cell in wh[1]}
-        c_price_h = hdr_h.get("Цена")
-        if c_price_h:
-            for r in range(2, wh.max_row + 1):
-                wh.cell(row=r, column=c_price_h).number_format = '#,##0.00'
-
-    # Легенда
-    if "Легенда" in wb.sheetnames:
-        del wb["Легенда"]
-    lg = wb.create_sheet("Легенда")
-    lg["A1"] = "Обозначения и подсветка"
-    lg["A1"].font = Font(bold=True)
-    lg["A3"] = "• «Изменение (₽)» — разница между текущей и предыдущей ценой."
-    lg["A4"] = "• «Изменение (%)» — отношение изменения к предыдущей цене × 100."
-    lg["A5"] = "• Зелёная подсветка — цена снизилась (подсвечиваются 3 ячейки: Δ, текущая и предыдущая)."
-    lg["A6"] = "• Розовая подсветка — цена выросла (подсвечиваются 3 ячейки: Δ, текущая и предыдущая)."
-    _autosize(lg, min_w=30)
-
-    wb.save(out_path)
+    mode, _ = run_report(db, out_path, report_sheets(extra_sheets, history_rows, shard_files, months),
+                         expand_history=expand_history, cache_dir=default_cache_dir(out_path), full=full)
+    if log is not None:
+        log(REPORT_MODES[mode])
     return out_path
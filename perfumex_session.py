@@ -0,0 +1,113 @@
+# perfumex_session.py — сохранённая сессия perfumex.ru: вход один раз, дальше — куки из файла
+#
+# После успешного login_once куки авторизации пишутся в perfumex_session.json.
+# При следующем запуске они проверяются одним лёгким HTTP-запросом (без браузера)
+# и, если сессия жива, подставляются в новые браузеры через CDP — без загрузки
+# главной, попапа и ввода пароля. Входим заново, только если сессия истекла.
+
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from selenium import webdriver
+
+DEFAULT_SESSION_FILE = Path("perfumex_session.json")
+BASE_URL = "https://perfumex.ru/"
+
+# Битрикс кладёт id пользователя в BX.message({... 'USER_ID':'123' ...}); у гостя — пусто
+_USER_ID_RE = re.compile(r"""['"]USER_ID['"]\s*:\s*['"](\d+)['"]""")
+
+_COOKIE_KEYS = ("name", "value", "domain", "path", "secure", "httpOnly", "expiry", "sameSite")
+
+
+def is_logged_in_html(page_html: str) -> bool:
+    m = _USER_ID_RE.search(page_html or "")
+    return bool(m and m.group(1) not in ("", "0"))
+
+
+def load_cookies(path: Path) -> Optional[List[dict]]:
+    """Куки из файла без истёкших; None — если файла нет или он пуст/битый."""
+    if not path.exists():
+        return None
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    now = time.time()
+    cookies = [c for c in data.get("cookies", []) if not c.get("expiry") or c["expiry"] > now]
+    return cookies or None
+
+
+def save_cookies(path: Path, cookies: List[dict]) -> None:
+    payload = {"saved_at": int(time.time()),
+               "cookies": [{k: c[k] for k in _COOKIE_KEYS if k in c} for c in cookies]}
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.chmod(tmp, 0o600)  # в файле — действующая авторизация
+    tmp.replace(path)
+
+
+def session_is_valid(cookies: List[dict], timeout: float = 15) -> bool:
+    """Один GET главной с куками: Битрикс отдаёт USER_ID только авторизованным."""
+    try:
+        from http_fetch import HttpFetcher
+
+        with HttpFetcher(timeout=timeout, pool_size=1) as fetcher:
+            fetcher.load_cookies(cookies)
+            return is_logged_in_html(fetcher.get_html(BASE_URL))
+    except Exception:
+        return False
+
+
+def apply_to_driver(driver: webdriver.Chrome, cookies: List[dict]) -> None:
+    """Подставить куки в браузер до первой навигации (CDP), иначе — через add_cookie на домене."""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        for c in cookies:
+            params = {"name": c["name"], "value": c["value"], "domain": c.get("domain") or "perfumex.ru",
+                      "path": c.get("path", "/"), "secure": c.get("secure", False),
+                      "httpOnly": c.get("httpOnly", False)}
+            if c.get("expiry"):
+                params["expires"] = c["expiry"]
+            driver.execute_cdp_cmd("Network.setCookie", params)
+    except Exception:
+        driver.get(BASE_URL + "robots.txt")  # лёгкая страница на нужном домене
+        for c in cookies:
+            driver.add_cookie({k: c[k] for k in _COOKIE_KEYS if k in c})
+
+
+class PerfumexSession:
+    """
+    Общая для всех воркеров сессия: первый, кому нужен вход, логинится и сохраняет куки,
+    остальные берут готовые (под замком — без параллельных логинов).
+    """
+
+    def __init__(self, path: Path = DEFAULT_SESSION_FILE):
+        self.path = Path(path)
+        self.cookies: Optional[List[dict]] = None
+        self._lock = threading.Lock()
+
+    def restore(self) -> bool:
+        cookies = load_cookies(self.path)
+        if cookies and session_is_valid(cookies):
+            self.cookies = cookies
+            return True
+        return False
+
+    def ensure_login(self, driver: webdriver.Chrome, login: Callable[[webdriver.Chrome], None]) -> bool:
+        """
+        Готовит браузер к работе. True — подставлена сохранённая сессия, False — выполнен вход.
+        """
+        with self._lock:
+            if self.cookies:
+                apply_to_driver(driver, self.cookies)
+                return True
+            login(driver)
+            self.cookies = driver.get_cookies()
+            save_cookies(self.path, self.cookies)
+            return False
+
@@ -1,195 +1,149 @@
 from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
 import pandas as pd
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils import get_column_letter
 
 import db
+from history_archive import archive_distinct
+from report_cache import HISTORY_SHEET_ROWS, default_cache_dir
+from report_pipeline import REPORT_MODES, FrameSheet, HistorySheet, LegendSheet, SheetHook, run_report
 
 
 def _latest_snapshot_df() -> pd.DataFrame:
-    rows = db.dump_history()
-    # dump_history() возвращает: (product_id, name, price, checked_at)
-    df = pd.DataFrame(rows, columns=["product_id", "name", "price", "checked_at"])
+    # последняя и предыдущая цена уже лежат в latest_prices — одна строка на товар, без скана истории
+    rows = db.latest_snapshot()
+    df = pd.DataFrame(
+        rows, columns=["product_id", "name", "price", "prev_price", "checked_at", "changed_at", "observations"]
+    )
     if df.empty:
         return df
-
-    # сортируем и берём последний замер по каждому товару
-    df_sorted = df.sort_values(["product_id", "checked_at"], ascending=[True, True])
-    latest_idx = df_sorted.groupby("product_id")["checked_at"].idxmax()
-    latest = df_sorted.loc[latest_idx].copy()
-
-    # предыдущая цена (если есть)
-    second_idx = (
-        df_sorted.groupby("product_id")
-        .apply(lambda g: g.iloc[-2].name if len(g) >= 2 else None)
-        .dropna()
-        .astype(int)
-    )
-    prev = df_sorted.loc[second_idx] if len(second_idx) else pd.DataFrame(columns=df.columns)
-
-    latest = latest.merge(
-        prev[["product_id", "price"]].rename(columns={"price": "prev_price"}),
-        on="product_id",
-        how="left",
-    )
+    latest = df[["product_id", "name", "price", "checked_at", "prev_price"]].copy()
     latest["change"] = latest["price"] - latest["prev_price"]
     latest["change_pct"] = (latest["change"] / latest["prev_price"]) * 100
     return latest
 
 
-def build_excel_report(out_path: Path) -> Path:
-    out_path = Path(out_path)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
+# === Лист «Текущие цены» ===
 
+def _latest_sheet_df() -> pd.DataFrame:
     latest = _latest_snapshot_df()
-
-    # === Формируем листы ===
-    with pd.ExcelWriter(out_path, engine="openpyxl") as xw:
-        # Лист «Текущие цены»
-        if latest.empty:
-            latest_out = pd.DataFrame(
-                columns=["Товар", "Цена (₽)", "Предыдущая цена (₽)", "Изменение (₽)", "Изменение (%)", "Когда проверено"]
-            )
-            latest_out.to_excel(xw, sheet_name="Текущие цены", index=False)
-        else:
-            latest_out = latest[["name", "price", "prev_price", "change", "change_pct", "checked_at"]].copy()
-            latest_out.rename(
-                columns={
-                    "name": "Товар",
-                    "price": "Цена (₽)",
-                    "prev_price": "Предыдущая цена (₽)",
-                    "change": "Изменение (₽)",
-                    "change_pct": "Изменение (%)",
-                    "checked_at": "Когда проверено",
-                },
-                inplace=True,
-            )
-            latest_out.to_excel(xw, sheet_name="Текущие цены", index=False)
-
-        # Лист «История»
-        hist_rows = db.dump_history()
-        hist_df = pd.DataFrame(hist_rows, columns=["product_id", "name", "price", "checked_at"])
-        hist_df.rename(
-            columns={"name": "Товар", "price": "Цена (₽)", "checked_at": "Когда проверено"},
-            inplace=True,
+    if latest.empty:
+        return pd.DataFrame(
+            columns=["Товар", "Цена (₽)", "Предыдущая цена (₽)", "Изменение (₽)", "Изменение (%)", "Когда проверено"]
         )
-        hist_df.to_excel(xw, sheet_name="История", index=False)
-
-    # === Стилизация ===
-    wb = openpyxl.load_workbook(out_path)
-    ws = wb["Текущие цены"]
-
-    # зафиксировать заголовок
-    ws.freeze_panes = "A2"
-
-    # автоширина колонок по содержимому
-    def autosize(ws, padding=2, min_w=12, max_w=60):
-        dims = {}
-        for row in ws.iter_rows(values_only=True):
-            for i, cell in enumerate(row, 1):
-                if cell is not None:
-                    dims[i] = max(dims.get(i, 0), len(str(cell)))
-        for col_idx, width in dims.items():
-            ws.column_dimensions[get_column_letter(col_idx)].width = min(max(width + padding, min_w), max_w)
-
-    autosize(ws)
-
-    # заголовки — жирные, по центру, перенос
-    for c in ws[1]:
-        c.font = Font(bold=True)
-        c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    ws.row_dimensions[1].height = 28
-
-    # сделать колонку «Товар» широкой по максимальной длине наименования
-    headers = {cell.value: cell.column for cell in ws[1]}
-    col_product = headers.get("Товар")
-    if col_product:
-        max_name_len = 0
-        for row in range(2, ws.max_row + 1):
-            v = ws.cell(row=row, column=col_product).value
-            if v:
-                max_name_len = max(max_name_len, len(str(v)))
-        if max_name_len:
-            ws.column_dimensions[get_column_letter(col_product)].width = min(max(max_name_len + 4, 24), 70)
-
-    # применить числовые форматы с «+» для положительных значений
-    col_change = headers.get("Изменение (₽)")
-    col_price = headers.get("Цена (₽)")
-    col_prev = headers.get("Предыдущая цена (₽)")
-    col_change_pct = headers.get("Изменение (%)")
-
-    if col_price:
-        for row in range(2, ws.max_row + 1):
-            ws.cell(row=row, column=col_price).number_format = "#,##0"
-    if col_prev:
-        for row in range(2, ws.max_row + 1):
-            ws.cell(row=row, column=col_prev).number_format = "#,##0"
-    if col_change:
-        for row in range(2, ws.max_row + 1):
-            # формат с плюсом: positive;negative;zero
-            ws.cell(row=row, column=col_change).number_format = "+#,##0;-#,##0;0"
-    if col_change_pct:
-        for row in range(2, ws.max_row + 1):
-            # формат с плюсом и двумя знаками после запятой
-            ws.cell(row=row, column=col_change_pct).number_format = "+0.00;-0.00;0.00"
-
-    # подсветка изменений
-    if col_change:
-        for row in range(2, ws.max_row + 1):
-            cell = ws.cell(row=row, column=col_change)
-            prev_cell = ws.cell(row=row, column=col_prev) if col_prev else None
-            price_cell = ws.cell(row=row, column=col_price) if col_price else None
-            try:
-                delta = float(cell.value)
-            except (TypeError, ValueError):
-                delta = 0.0
-
-            if delta < 0:
-                # зелёный — цена снизилась (закрашиваем Δ, текущую цену и предыдущую)
-                fill = PatternFill(fill_type="solid", fgColor="C6EFCE")
-                for c in (cell, prev_cell, price_cell):
-                    if c is not None:
-                        c.font = Font(bold=True)
-                        c.fill = fill
-            elif delta > 0:
-                # розовый — цена выросла (тоже закрашиваем Δ, текущую и предыдущую)
-                fill = PatternFill(fill_type="solid", fgColor="FFC7CE")
-                for c in (cell, prev_cell, price_cell):
-                    if c is not None:
-                        c.font = Font(bold=True)
-                        c.fill = fill
-
-    # Стили для «История»
-    if "История" in wb.sheetnames:
-        wh = wb["История"]
-        wh.freeze_panes = "A2"
-        autosize(wh)
-        for c in wh[1]:
-            c.font = Font(bold=True)
-            c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        wh.row_dimensions[1].height = 28
-        # форматы чисел
-        hdrs_h = {cell.value: cell.column for cell in wh[1]}
-        c_price_h = hdrs_h.get("Цена (₽)")
-        if c_price_h:
-            for row in range(2, wh.max_row + 1):
-                wh.cell(row=row, column=c_price_h).number_format = "#,##0"
-
-    # Лист «Легенда» с объяснениями
-    sheet_name = "Легенда"
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    lg = wb.create_sheet(sheet_name)
-    lg["A1"] = "Обозначения и подсветка"
-    lg["A1"].font = Font(bold=True)
-    lg["A3"] = "• «Изменение (₽)» — разница между текущей и предыдущей ценой."
-    lg["A4"] = "• «Изменение (%)» — отношение изменения к предыдущей цене × 100."
-    lg["A5"] = "• Зелёная подсветка — цена снизилась (подсвечиваются 3 ячейки: Δ, текущая и предыдущая цена)."
-    lg["A6"] = "• Розовая подсветка — цена выросла (подсвечиваются 3 ячейки: Δ, текущая и предыдущая цена)."
-    lg["A7"] = "• Для положительных чисел проставляется знак «+» в столбцах «Изменение (₽)» и «Изменение (%)»."
-    lg["A8"] = "• Если предыдущей цены нет (первый замер), изменение не вычисляется."
-
-    autosize(lg, min_w=30)
-    wb.save(out_path)
+    latest_out = latest[["name", "price", "prev_price", "change", "change_pct", "checked_at"]].copy()
+    latest_out.rename(
+        columns={
+            "name": "Товар",
+            "price": "Цена (₽)",
+            "prev_price": "Предыдущая цена (₽)",
+            "change": "Изменение (₽)",
+            "change_pct": "Изменение (%)",
+            "checked_at": "Когда проверено",
+        },
+        inplace=True,
+    )
+    return latest_out
+
+
+LATEST_FORMATS = {
+    "Цена (₽)": "#,##0",
+    "Предыдущая цена (₽)": "#,##0",
+    "Изменение (₽)": "+#,##0;-#,##0;0",  # формат с плюсом: positive;negative;zero
+    "Изменение (%)": "+0.00;-0.00;0.00",  # формат с плюсом и двумя знаками после запятой
+}
+# подсветка изменений: Δ<0 — зелёный, Δ>0 — розовый (закрашиваем Δ, текущую цену и предыдущую)
+LATEST_HIGHLIGHT = ("Изменение (₽)", ["Изменение (₽)", "Цена (₽)", "Предыдущая цена (₽)"])
+
+
+# === Лист «История» — пачками из БД и архива Parquet (archive-history), без всей истории в памяти ===
+
+def _history_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    return df.rename(columns={"name": "Товар", "price": "Цена (₽)", "checked_at": "Когда проверено"})
+
+
+def _history_widths() -> Dict[str, int]:
+    # ширины колонок пишутся до первой строки листа: id и имена берём из снимка (строка на товар),
+    # цены — DISTINCT по prices и архиву (агрегаты могут отставать и не видят архив), без прохода по истории
+    snapshot = db.latest_snapshot()
+    prices = set(db.distinct_prices()).union(archive_distinct(db, "price"))
+    return {
+        "product_id": max((len(str(r[0])) for r in snapshot), default=0),
+        "Товар": max((len(r[1]) for r in snapshot), default=0),
+        "Цена (₽)": max((len(str(p)) for p in prices), default=0),
+        "Когда проверено": len("YYYY-MM-DD HH:MM:SS") if snapshot else 0,
+    }
+
+
+# === Лист «По месяцам» — из агрегатов price_rollups, а не из всей истории ===
+
+def _months_sheet_df() -> pd.DataFrame:
+    month_df = pd.DataFrame(
+        db.rollups("month"),
+        columns=["product_id", "name", "bucket", "min_price", "max_price", "avg_price", "last_price", "checks"],
+    )
+    month_df = month_df[["name", "bucket", "min_price", "max_price", "avg_price", "last_price", "checks"]]
+    month_df.rename(
+        columns={
+            "name": "Товар",
+            "bucket": "Месяц",
+            "min_price": "Мин. цена (₽)",
+            "max_price": "Макс. цена (₽)",
+            "avg_price": "Средняя цена (₽)",
+            "last_price": "Последняя цена (₽)",
+            "checks": "Замеров",
+        },
+        inplace=True,
+    )
+    return month_df
+
+
+MONTH_FORMATS = {col: "#,##0" for col in ("Мин. цена (₽)", "Макс. цена (₽)", "Средняя цена (₽)", "Последняя цена (₽)")}
+
+LEGEND = [
+    "• «Изменение (₽)» — разница между текущей и предыдущей ценой.",
+    "• «Изменение (%)» — отношение изменения к предыдущей цене × 100.",
+    "• Зелёная подсветка — цена снизилась (подсвечиваются 3 ячейки: Δ, текущая и предыдущая цена).",
+    "• Розовая подсветка — цена выросла (подсвечиваются 3 ячейки: Δ, текущая и предыдущая цена).",
+    "• Для положительных чисел проставляется знак «+» в столбцах «Изменение (₽)» и «Изменение (%)».",
+    "• Если предыдущей цены нет (первый замер), изменение не вычисляется.",
+]
+MONTHS_LEGEND = "• «По месяцам» — минимальная, максимальная, средняя и последняя цена товара за месяц и число замеров."
+
+
+def report_sheets(extra_sheets: Iterable[SheetHook] = (), history_rows: int = HISTORY_SHEET_ROWS,
+                  shard_files: bool = False, months: bool = False) -> list:
+    """
+    Листы отчёта по порядку; extra_sheets встают перед «Легендой» и получают ту же пачку истории.
+    history_rows, shard_files — деление «Истории» на листы или файлы (HistorySheet).
+    months=True — добавить лист «По месяцам» из агрегатов (по умолчанию книга та же, что и раньше).
+    """
+    month_sheets = [FrameSheet("По месяцам", _months_sheet_df, MONTH_FORMATS)] if months else []
+    return [
+        # колонка «Товар» — широкая, по максимальной длине наименования
+        FrameSheet("Текущие цены", _latest_sheet_df, LATEST_FORMATS, LATEST_HIGHLIGHT, wide={"Товар": (4, 24, 70)}),
+        HistorySheet(["product_id", "Товар", "Цена (₽)", "Когда проверено"], _history_chunk, {"Цена (₽)": "#,##0"},
+                     _history_widths, max_rows=history_rows, shard_files=shard_files),
+        *month_sheets,
+        *extra_sheets,
+        LegendSheet("Обозначения и подсветка", LEGEND + ([MONTHS_LEGEND] if months else [])),
+    ]
+
+
+def build_excel_report(out_path: Path, expand_history: bool = False, extra_sheets: Iterable[SheetHook] = (),
+                       full: bool = False, history_rows: int = HISTORY_SHEET_ROWS,
+                       shard_files: bool = False, months: bool = False,
+                       log: Optional[Callable[[str], None]] = None) -> Path:
+    """
+    Собрать отчёт в out_path. Рядом хранится кэш <отчёт>.cache: если история не менялась, файл
+    не пересобирается, если только дополнялась — перечитываются лишь товары с новыми замерами.
+    full=True — собрать целиком. «История» длиннее history_rows строк делится на листы по диапазонам
+    товаров (shard_files=True — на файлы <отчёт>.history-N.xlsx). months=True — ещё лист «По месяцам».
+    log — куда сообщить, что сделано (собран целиком, обновлён, актуален).
+    """
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    mode, _ = run_report(db, out_path, report_sheets(extra_sheets, history_rows, shard_files, months),
+                         expand_history=expand_history, cache_dir=default_cache_dir(out_path), full=full)
+    if log is not None:
+        log(REPORT_MODES[mode])
     return out_path
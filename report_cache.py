@@ -0,0 +1,149 @@
+# report_cache.py — кэш отчёта Excel и его инкрементальная пересборка (report_pipeline.run_report)
+#
+# Дорого в отчёте чтение и преобразование истории. Поэтому готовые строки листа «История»
+# (значения колонок) кэшируются кусками по товарам, а при следующей сборке строки неизменившихся
+# товаров берутся из кэша и пишутся в книгу так же, как новые, — через openpyxl (ws.append).
+# Куски и водяной знак БД хранятся рядом с отчётом в <отчёт>.cache/:
+#   history.bin — куски (JSON + zlib) подряд в порядке листа;
+#   state.json  — водяной знак (max(prices.id), число строк, режим истории, граница архива,
+#                 схема), observations каждого товара из latest_prices и оглавление кусков.
+# При следующей сборке:
+#   * история не менялась и файлы отчёта те же — сборка пропускается;
+#   * строки только добавлялись или продлевались — из истории читаются только товары с новыми
+#     замерами, строки остальных берутся из кэша;
+#   * иначе (compact-history, prune, другой режим, формат листа) — полная сборка.
+# «Текущие цены» и «По месяцам» строятся каждый раз: это строка на товар и агрегаты, не история.
+
+import json
+import os
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+CACHE_FORMAT = 3  # 3 — куски со значениями строк (JSON); 2 — XML листа
+STATE_FILE = "state.json"
+FRAGMENTS_FILE = "history.bin"
+
+EXCEL_MAX_ROWS = 1_048_576  # предел строк листа Excel, вместе с заголовком
+HISTORY_SHEET_ROWS = 250_000  # строк «Истории» на лист; больше — лист делится по диапазонам товаров
+
+
+def default_cache_dir(out_path: Path) -> Path:
+    """<отчёт>.cache рядом с файлом отчёта."""
+    out_path = Path(out_path)
+    return out_path.with_name(out_path.name + ".cache")
+
+
+def encode_rows(rows: Sequence[Sequence]) -> bytes:
+    """Строки товара (значения колонок листа) -> кусок кэша: JSON, сжатый zlib."""
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 1)
+
+
+def decode_rows(data: bytes) -> List[list]:
+    return json.loads(zlib.decompress(data))
+
+
+class HistoryFragments:
+    """
+    Строки листа «История» по товарам в одном файле: кусок товара — encode_rows его строк.
+    index — [product_id, имя, смещение, длина, строк] в порядке листа (по имени товара).
+    """
+
+    def __init__(self, path: Path, index: Optional[List[list]] = None):
+        self.path = Path(path)
+        self.index = index or []
+        self._f = None
+
+    @property
+    def rows(self) -> int:
+        return sum(e[4] for e in self.index)
+
+    def open(self) -> None:
+        self._f = self.path.open("wb")
+        self.index = []
+
+    def add(self, product_id: int, name: str, rows: Sequence[Sequence], data: Optional[bytes] = None) -> None:
+        """Кусок товара; data — уже готовый кусок тех же строк (копия из прошлой сборки)."""
+        if data is None:
+            data = encode_rows(rows)
+        self.index.append([product_id, name, self._f.tell(), len(data), len(rows)])
+        self._f.write(data)
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def iter_products(self, skip: Iterable[int] = ()) -> Iterator[Tuple[list, bytes]]:
+        """(запись index, кусок) по порядку листа; товары skip пропускаются."""
+        skip = set(skip)
+        with self.path.open("rb") as f:
+            for entry in self.index:
+                if entry[0] in skip:
+                    continue
+                f.seek(entry[2])
+                yield entry, f.read(entry[3])
+
+
+class ReportCache:
+    """Водяной знак и куски «Истории» прошлой сборки в cache_dir; layout — всё, что задаёт вид листов."""
+
+    def __init__(self, cache_dir: Path, layout: dict):
+        self.dir = Path(cache_dir)
+        self.layout = layout
+        self.state = None
+        state_path = self.dir / STATE_FILE
+        if state_path.exists():
+            try:
+                self.state = json.loads(state_path.read_text(encoding="utf-8"))
+            except ValueError:
+                self.state = None  # оборванный файл — как будто кэша нет
+        self.fragments = HistoryFragments(self.dir / FRAGMENTS_FILE, self.state["fragments"] if self.state else None)
+        self._new: Dict[str, object] = {}
+
+    @staticmethod
+    def _stamp(out_path: Path) -> List[int]:
+        st = out_path.stat()
+        return [st.st_size, st.st_mtime_ns]
+
+    def plan(self, db_module, out_path: Path) -> Tuple[str, Optional[List[int]]]:
+        """
+        ('skip', None) — отчёт актуален; ('incremental', product_ids) — перечитать историю этих товаров;
+        ('full', None) — полная сборка.
+        """
+        watermark = db_module.report_watermark()
+        snapshot = db_module.latest_snapshot()
+        observations = {str(r[0]): r[-1] for r in snapshot}
+        names = {r[0]: r[1] for r in snapshot}
+        self._new = {"format": CACHE_FORMAT, "layout": self.layout, "watermark": watermark,
+                     "observations": observations}
+        st = self.state
+        if (st is None or st.get("format") != CACHE_FORMAT or st.get("layout") != self.layout
+                or not out_path.exists() or not self.fragments.path.exists()
+                or any(not Path(p).exists() or self._stamp(Path(p)) != stamp for p, stamp in st["outputs"].items())):
+            return "full", None
+        old = st["watermark"]
+        if any(old.get(k) != v for k, v in watermark.items() if k not in ("max_id", "rows")):
+            return "full", None
+        added, products = db_module.history_changes(old["max_id"])
+        if watermark["rows"] != old["rows"] + added:
+            return "full", None  # строки удалялись или переписывались (compact-history, prune)
+        changed = set(products) | {int(pid) for pid, n in observations.items() if st["observations"].get(pid) != n}
+        changed |= {e[0] for e in self.fragments.index if names.get(e[0], e[1]) != e[1]}  # переименованные
+        if not changed:
+            return "skip", None
+        return "incremental", sorted(changed)
+
+    def commit(self, outputs: Sequence[Path], fragments: HistoryFragments) -> None:
+        """
+        Запомнить сборку: куски переезжают в кэш, водяной знак и отметки записанных файлов (отчёт
+        и файлы листов «Истории», если они отдельно) — в state.json.
+        """
+        (self.dir / STATE_FILE).unlink(missing_ok=True)  # упали между шагами — следующая сборка полная
+        os.replace(fragments.path, self.fragments.path)
+        self.fragments = HistoryFragments(self.fragments.path, fragments.index)
+        state = dict(self._new, fragments=fragments.index, outputs={str(p): self._stamp(Path(p)) for p in outputs})
+        tmp = self.dir / (STATE_FILE + ".tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.dir / STATE_FILE)
+        self.state = state
@@ -0,0 +1,489 @@
+# report_pipeline.py — сборка Excel-отчёта за один проход по истории (report.py, perfumex_report.py)
+#
+# Отчёт — это список листов (SheetHook). История читается один раз (load_history_frames:
+# SQLite + архив Parquet) пачками DataFrame, и каждая пачка по очереди отдаётся всем листам,
+# которым она нужна. Листы без истории (снимок latest_prices, агрегаты price_rollups, легенда)
+# в этом проходе не участвуют. Новый лист — ещё один SheetHook в списке: если ему нужна история,
+# он получает те же пачки, лишнего чтения БД не будет.
+#
+# Книга пишется openpyxl в режиме write-only: строки уходят в файл сразу, память не растёт
+# с историей. Стили ставятся при записи строки, книга после сохранения не перечитывается.
+# Ширина колонок и закрепление заголовка в этом режиме задаются до первой строки листа, поэтому
+# ширину считают заранее: по DataFrame небольших листов и по подсказке для «Истории».
+
+import math
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.hyperlink import Hyperlink
+
+from history_archive import load_history_frames
+from report_cache import (EXCEL_MAX_ROWS, FRAGMENTS_FILE, HISTORY_SHEET_ROWS, HistoryFragments, ReportCache,
+                          decode_rows)
+
+BOLD = Font(bold=True)
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center", wrap_text=True)
+HEADER_HEIGHT = 28
+DOWN_FILL = PatternFill(fill_type="solid", fgColor="C6EFCE")  # зелёный — цена снизилась
+UP_FILL = PatternFill(fill_type="solid", fgColor="FFC7CE")  # розовый — цена выросла
+LINK_FONT = Font(color="0563C1", underline="single")
+
+# (отступ, минимум, максимум) ширины колонки
+DEFAULT_WIDTH = (2, 12, 60)
+
+# что сделала сборка run_report — для сообщения в CLI
+REPORT_MODES = {
+    "full": "Отчёт сформирован",
+    "incremental": "Отчёт обновлён (пересобраны товары с новыми замерами)",
+    "skip": "Отчёт актуален, новых замеров нет",
+}
+
+
+def _width(length: int, limits: Tuple[int, int, int] = DEFAULT_WIDTH) -> int:
+    padding, min_w, max_w = limits
+    return min(max(length + padding, min_w), max_w)
+
+
+def _column_values(s: pd.Series) -> list:
+    """Значения колонки обычными типами Python; NaN -> None (пустая ячейка, как у DataFrame.to_excel)."""
+    values = s.tolist()
+    if s.hasnans:
+        values = [None if isinstance(v, float) and math.isnan(v) else v for v in values]
+    return values
+
+
+def excel_text(value) -> str:
+    """
+    str(cell.value) значения, записанного в xlsx и прочитанного обратно, — по нему автоширина считалась
+    до write-only: openpyxl пишет float как '%.16g' (12345.0 -> 12345, 17 знаков -> 16).
+    """
+    if isinstance(value, float):
+        text = "%.16g" % value
+        return str(float(text)) if any(c in text for c in ".eE") else text
+    return str(value)
+
+
+def value_lengths(df: pd.DataFrame) -> Dict[str, int]:
+    """Длина самого длинного значения каждой колонки (без заголовка) — как str(cell.value) в Excel."""
+    lengths = {}
+    for col in df.columns:
+        lengths[col] = max((len(excel_text(v)) for v in df[col].dropna().tolist()), default=0)
+    return lengths
+
+
+def setup_sheet(ws, columns: Sequence[str], widths: Dict[str, int]):
+    """Оформить пустой лист write-only: ширины колонок, закреплённый и оформленный заголовок."""
+    ws.freeze_panes = "A2"
+    for i, col in enumerate(columns, 1):
+        if col in widths:
+            ws.column_dimensions[get_column_letter(i)].width = widths[col]
+    ws.row_dimensions[1].height = HEADER_HEIGHT
+    header = []
+    for col in columns:
+        cell = WriteOnlyCell(ws, col)
+        cell.font = BOLD
+        cell.alignment = HEADER_ALIGNMENT
+        header.append(cell)
+    ws.append(header)
+    return ws
+
+
+def open_sheet(wb: Workbook, name: str, columns: Sequence[str], widths: Dict[str, int], index: Optional[int] = None):
+    """Создать лист write-only (index — позиция в книге, по умолчанию в конец) и оформить его (setup_sheet)."""
+    return setup_sheet(wb.create_sheet(name, index), columns, widths)
+
+
+def append_frame(ws,
+                 df: pd.DataFrame,
+                 number_formats: Dict[str, str],
+                 highlight: Optional[Tuple[str, Sequence[str]]] = None) -> None:
+    """
+    Дописать строки df на лист. number_formats — формат по заголовку колонки. highlight=(колонка Δ,
+    колонки) — при Δ<0 эти ячейки зелёные, при Δ>0 розовые, в обоих случаях жирные.
+    """
+    columns = list(df.columns)
+    formats = [number_formats.get(col) for col in columns]
+    marked = set()
+    if highlight is not None:
+        delta_col, targets = highlight
+        delta_idx = columns.index(delta_col)
+        marked = {columns.index(c) for c in targets if c in columns}
+    # одна оформленная ячейка на (колонку, заливку): ws.append пишет строку в файл сразу,
+    # поэтому ячейку можно переиспользовать, а не создавать и стилизовать заново на каждое значение
+    styled = {}
+
+    def cell_for(i, fill):
+        fill = fill if i in marked else None
+        cell = styled.get((i, fill))
+        if cell is None:
+            cell = styled[i, fill] = WriteOnlyCell(ws)
+            if formats[i] is not None:
+                cell.number_format = formats[i]
+            if fill is not None:
+                cell.font = BOLD
+                cell.fill = fill
+        return cell
+
+    for values in zip(*(_column_values(df[col]) for col in columns)):
+        fill = None
+        if marked:
+            delta = values[delta_idx] or 0
+            fill = DOWN_FILL if delta < 0 else UP_FILL if delta > 0 else None
+        row = []
+        for i, value in enumerate(values):
+            if formats[i] is None and (fill is None or i not in marked):
+                row.append(value)
+                continue
+            cell = cell_for(i, fill)
+            cell.value = value
+            row.append(cell)
+        ws.append(row)
+
+
+class SheetHook:
+    """
+    Лист отчёта. start(wb) — до прохода по истории (здесь лист создаётся, порядок листов в книге —
+    порядок в списке); on_chunk(df) — на каждую пачку истории, если needs_history; finish(wb) —
+    после прохода. Пачка общая для всех листов: менять её на месте нельзя. Книга write-only:
+    лист можно только дописывать, ширины колонок — до первой строки.
+    """
+
+    name = ""
+    needs_history = False
+
+    def start(self, wb: Workbook) -> None:
+        pass
+
+    def on_chunk(self, df: pd.DataFrame) -> None:
+        pass
+
+    def finish(self, wb: Workbook) -> None:
+        pass
+
+
+class FrameSheet(SheetHook):
+    """
+    Лист из одного DataFrame без истории (снимок, агрегаты). Ширина колонок — по содержимому;
+    wide — свои пределы (отступ, минимум, максимум) для колонки по длине её значений.
+    """
+
+    def __init__(self,
+                 name: str,
+                 frame: Callable[[], pd.DataFrame],
+                 number_formats: Optional[Dict[str, str]] = None,
+                 highlight: Optional[Tuple[str, Sequence[str]]] = None,
+                 wide: Optional[Dict[str, Tuple[int, int, int]]] = None):
+        self.name = name
+        self.frame = frame
+        self.number_formats = number_formats or {}
+        self.highlight = highlight
+        self.wide = wide or {}
+
+    def start(self, wb: Workbook) -> None:
+        df = self.frame()
+        lengths = value_lengths(df)
+        widths = {col: _width(max(len(col), lengths[col])) for col in df.columns}
+        for col, limits in self.wide.items():
+            if lengths.get(col):
+                widths[col] = _width(lengths[col], limits)
+        ws = open_sheet(wb, self.name, list(df.columns), widths)
+        append_frame(ws, df, self.number_formats, self.highlight)
+
+
+class HistorySheet(SheetHook):
+    """
+    Лист «История». Строки пишутся ws.append пачками по товарам и заодно складываются в кэш
+    (report_cache.HistoryFragments): в следующей сборке строки неизменившихся товаров берутся оттуда,
+    а не из БД. transform(df) превращает пачку HISTORY_COLUMNS в колонки columns (новый DataFrame);
+    number_formats — формат по заголовку; width_hint() — длины самых длинных значений колонок,
+    известные без прохода по истории.
+
+    Больше max_rows строк — история делится по диапазонам товаров на листы «История 1», «История 2», …
+    (shard_files=True — в отдельные файлы <отчёт>.history-N.xlsx рядом с отчётом), а сам лист
+    становится оглавлением со ссылками на них. Товар целиком переходит на следующую часть, если
+    не помещается в текущую; режется по строкам, только если сам длиннее части.
+    """
+
+    needs_history = True
+
+    def __init__(self,
+                 columns: Sequence[str],
+                 transform: Callable[[pd.DataFrame], pd.DataFrame],
+                 number_formats: Optional[Dict[str, str]] = None,
+                 width_hint: Optional[Callable[[], Dict[str, int]]] = None,
+                 name: str = "История",
+                 max_rows: int = HISTORY_SHEET_ROWS,
+                 shard_files: bool = False):
+        if not 0 < max_rows < EXCEL_MAX_ROWS:
+            raise ValueError(f"Строк на лист «{name}» должно быть от 1 до {EXCEL_MAX_ROWS - 1}: {max_rows}")
+        self.name = name
+        self.columns = list(columns)
+        self.transform = transform
+        self.number_formats = number_formats or {}
+        self.width_hint = width_hint
+        self.max_rows = max_rows
+        self.shard_files = shard_files
+        self.out_path: Optional[Path] = None
+        self.fragments: Optional[HistoryFragments] = None
+        self.base: Optional[HistoryFragments] = None
+        self.product_ids: Optional[List[int]] = None
+        self.shards: List[list] = []  # [лист или файл, первый товар, последний товар, строк]
+        self.files: List[Path] = []  # записанные части во временном каталоге (shard_files)
+        self._wb = None
+        self._position = 0
+        self._ws = None
+        self._book = None
+        self._cells: List[Tuple[int, WriteOnlyCell]] = []
+        self._widths: Dict[str, int] = {}
+        self._product = None
+        self._rows: List[tuple] = []
+        self._cached = iter(())
+        self._next_cached = None
+
+    def bind(self, out_path: Path, fragments: HistoryFragments, base: Optional[HistoryFragments] = None,
+             product_ids: Optional[List[int]] = None) -> None:
+        """
+        Задаёт run_report до start: файл отчёта, куда складывать строки для кэша и, при инкрементальной
+        сборке, прежний кэш base, из которого берутся все товары, кроме product_ids.
+        """
+        self.out_path = Path(out_path)
+        self.fragments = fragments
+        self.base = base
+        self.product_ids = product_ids
+
+    def shard_path(self, k: int) -> Path:
+        return self.out_path.with_name(f"{self.out_path.stem}.history-{k}{self.out_path.suffix}")
+
+    def start(self, wb: Workbook) -> None:
+        hint = self.width_hint() if self.width_hint is not None else {}
+        self._widths = {col: _width(max(len(col), hint.get(col, 0))) for col in self.columns}
+        self._wb = wb
+        self._position = len(wb.worksheets)
+        self.shards, self.files = [], []
+        if not self.shard_files:
+            self._open_part(self.name, wb, self._position)
+        self.fragments.open()
+        if self.base is not None:
+            self._cached = self.base.iter_products(skip=self.product_ids)
+            self._next_cached = next(self._cached, None)
+
+    def _open_part(self, title: str, wb: Workbook, index: Optional[int] = None) -> None:
+        self._ws = open_sheet(wb, title, self.columns, self._widths, index)
+        # одна оформленная ячейка на колонку с форматом — как в append_frame
+        self._cells = []
+        for i, col in enumerate(self.columns):
+            fmt = self.number_formats.get(col)
+            if fmt is not None:
+                cell = WriteOnlyCell(self._ws)
+                cell.number_format = fmt
+                self._cells.append((i, cell))
+        self.shards.append([title, None, None, 0])
+
+    def _next_part(self) -> None:
+        k = len(self.shards) + 1
+        title = f"{self.name} {k}"
+        if self.shard_files:
+            self._save_book()
+            self._book = Workbook(write_only=True)
+            self._open_part(title, self._book)
+        else:
+            if k == 2:
+                self._ws.title = self.shards[0][0] = f"{self.name} 1"
+            self._open_part(title, self._wb, self._position + k - 1)
+
+    def _save_book(self) -> None:
+        if self._book is not None:
+            path = self.fragments.path.with_name(self.shard_path(len(self.shards)).name)
+            self._book.save(path)
+            self.files.append(path)
+            self._book = None
+
+    def _append(self, name: str, rows: Sequence[Sequence]) -> None:
+        shard = self.shards[-1]
+        if shard[1] is None:
+            shard[1] = name
+        shard[2] = name
+        shard[3] += len(rows)
+        ws, cells = self._ws, self._cells
+        for values in rows:
+            row = list(values)
+            for i, cell in cells:
+                cell.value = row[i]
+                row[i] = cell
+            ws.append(row)
+
+    def _write_product(self, product_id: int, name: str, rows: Sequence[Sequence],
+                       data: Optional[bytes] = None) -> None:
+        self.fragments.add(product_id, name, rows, data)
+        if not self.shards or (self.shards[-1][3] and self.shards[-1][3] + len(rows) > self.max_rows):
+            self._next_part()
+        done = 0
+        while len(rows) - done > self.max_rows - self.shards[-1][3]:
+            take = self.max_rows - self.shards[-1][3]
+            self._append(name, rows[done:done + take])
+            done += take
+            self._next_part()
+        if len(rows) > done:
+            self._append(name, rows[done:])
+
+    def _write_cached(self, before: Optional[str] = None) -> None:
+        """Товары из прошлой сборки, которые по порядку листа идут до before (None — все оставшиеся)."""
+        while self._next_cached is not None and (before is None or self._next_cached[0][1] < before):
+            entry, data = self._next_cached
+            self._write_product(entry[0], entry[1], decode_rows(data), data)
+            self._next_cached = next(self._cached, None)
+
+    def _flush(self) -> None:
+        if self._rows:
+            product_id, name = self._product
+            self._write_cached(name)
+            self._write_product(product_id, name, self._rows)
+            self._rows = []
+
+    def on_chunk(self, df: pd.DataFrame) -> None:
+        out = self.transform(df)[self.columns]
+        products = zip(df["product_id"].tolist(), df["name"].tolist())
+        for product, values in zip(products, zip(*(_column_values(out[col]) for col in self.columns))):
+            if product != self._product:
+                self._flush()
+                self._product = product
+            self._rows.append(values)
+
+    def finish(self, wb: Workbook) -> None:
+        self._flush()
+        self._write_cached()
+        self.fragments.close()
+        if self.shard_files and len(self.shards) <= 1:
+            # история влезла в одну часть — отдельный файл не нужен: строки из кэша переносятся
+            # на обычный лист «История» книги, а начатая книга части закрывается без сохранения
+            if self._book is not None:
+                for ws in self._book.worksheets:
+                    ws.close()
+            self._book, self.shards = None, []
+            self._open_part(self.name, wb, self._position)
+            for entry, data in self.fragments.iter_products():
+                self._append(entry[1], decode_rows(data))
+        elif len(self.shards) > 1:
+            self._write_index(wb)
+
+    def _write_index(self, wb: Workbook) -> None:
+        self._save_book()
+        ws = wb.create_sheet(self.name, self._position)
+        link_title = "Файл" if self.shard_files else "Лист"
+        rows = []
+        for k, (title, first, last, n) in enumerate(self.shards, 1):
+            if self.shard_files:
+                target = self.shard_path(k).name
+                link = WriteOnlyCell(ws, target)
+                link.hyperlink = target
+            else:
+                link = WriteOnlyCell(ws, title)
+                link.hyperlink = Hyperlink(ref="", location=f"'{title}'!A1")
+            link.font = LINK_FONT
+            rows.append([link, first, last, n])
+        names = [r[1] for r in rows] + [r[2] for r in rows]
+        setup_sheet(ws, [link_title, "Товары с", "Товары по", "Строк"], {
+            link_title: _width(max(len(r[0].value) for r in rows)),
+            "Товары с": _width(max(map(len, names)), (2, 12, 70)),
+            "Товары по": _width(max(map(len, names)), (2, 12, 70)),
+        })
+        for row in rows:
+            ws.append(row)
+
+    def place_files(self, out_path: Path) -> List[Path]:
+        """
+        Перенести записанные части (shard_files) на место рядом с отчётом; части прошлой сборки,
+        которых больше нет, удаляются. Возвращает отчёт и файлы частей.
+        """
+        outputs = [out_path]
+        for k, path in enumerate(self.files, 1):
+            target = self.shard_path(k)
+            os.replace(path, target)
+            outputs.append(target)
+        pattern = f"{out_path.stem}.history-*{out_path.suffix}"
+        for stale in out_path.parent.glob(pattern):
+            if stale not in outputs:
+                stale.unlink()
+        return outputs
+
+
+class LegendSheet(SheetHook):
+    """Лист с пояснениями: заголовок в A1, строки — с A3."""
+
+    def __init__(self, title: str, lines: Iterable[str], name: str = "Легенда"):
+        self.name = name
+        self.title = title
+        self.lines = list(lines)
+
+    def start(self, wb: Workbook) -> None:
+        lg = wb.create_sheet(self.name)
+        lg.column_dimensions["A"].width = _width(max(len(s) for s in [self.title, *self.lines]), (2, 30, 60))
+        title = WriteOnlyCell(lg, self.title)
+        title.font = BOLD
+        lg.append([title])
+        lg.append([])
+        for line in self.lines:
+            lg.append([line])
+
+
+def run_report(db_module,
+               out_path: Path,
+               sheets: List[SheetHook],
+               expand_history: bool = False,
+               cache_dir: Optional[Path] = None,
+               full: bool = False) -> Tuple[str, int]:
+    """
+    Записать книгу из листов sheets за один проход по истории. cache_dir — кэш прошлой сборки
+    (report_cache): история не менялась — сборка пропускается, только дополнялась — перечитываются
+    лишь товары с новыми замерами; full=True — собрать целиком (кэш всё равно обновится).
+    Возвращает (режим 'full' / 'incremental' / 'skip', строк истории прочитано).
+    """
+    out_path = Path(out_path)
+    history_sheets = [s for s in sheets if s.needs_history]
+    history = next((s for s in history_sheets if isinstance(s, HistorySheet)), None)
+    cache, mode, product_ids = None, "full", None
+    if cache_dir is not None and history is not None:
+        layout = {"sheets": [s.name for s in sheets], "columns": history.columns,
+                  "formats": history.number_formats, "expand_history": expand_history,
+                  "max_rows": history.max_rows, "shard_files": history.shard_files}
+        cache = ReportCache(cache_dir, layout)
+        mode, product_ids = cache.plan(db_module, out_path)
+        if mode == "skip" and not full:
+            return mode, 0
+        if full or len(history_sheets) > 1:  # другим листам по истории нужна вся история
+            mode, product_ids = "full", None
+        cache.dir.mkdir(parents=True, exist_ok=True)
+
+    rows = 0
+    # всё пишется во временный каталог рядом с отчётом и переносится на место, только когда готово
+    with tempfile.TemporaryDirectory(dir=cache.dir if cache else out_path.parent) as tmp:
+        tmp = Path(tmp)
+        if history is not None:
+            history.bind(out_path, HistoryFragments(tmp / FRAGMENTS_FILE),
+                         cache.fragments if product_ids is not None else None, product_ids)
+        wb = Workbook(write_only=True)
+        for sheet in sheets:
+            sheet.start(wb)
+        if history_sheets:
+            for df in load_history_frames(db_module, expand=expand_history, product_ids=product_ids):
+                rows += len(df)
+                for sheet in history_sheets:
+                    sheet.on_chunk(df)
+        for sheet in sheets:
+            sheet.finish(wb)
+        book = tmp / out_path.name
+        wb.save(book)
+        os.replace(book, out_path)
+        if history is None:
+            return mode, rows
+        outputs = history.place_files(out_path)
+        if cache is not None:
+            cache.commit(outputs, history.fragments)
+    return mode, rows
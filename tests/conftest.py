@@ -0,0 +1,25 @@
+# Модули проекта лежат в корне репозитория — тесты импортируют их напрямую (import db, main, ...)
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def price_db(tmp_path, monkeypatch):
+    """db.py на временной БД."""
+    import db
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "price_tracker.sqlite3")
+    db.init_db()
+    return db
+
+
+@pytest.fixture
+def perfumex_db(tmp_path, monkeypatch):
+    """perfumex_db.py на временной БД."""
+    import perfumex_db
+    monkeypatch.setattr(perfumex_db, "DB_PATH", tmp_path / "perfumex.sqlite3")
+    perfumex_db.init_db()
+    return perfumex_db
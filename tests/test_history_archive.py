@@ -0,0 +1,52 @@
+# Архив истории (archive-history) и чтение «SQLite + архив» через load_history
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from history_archive import archive_history, load_history
+
+ROWS = [
+    ("Духи", 1000, "2024-03-01 10:00:00"),
+    ("Духи", 1000, "2024-03-02 10:00:00"),
+    ("Духи", 1000, "2024-03-03 10:00:00"),
+    ("Духи", 1100, "2024-04-01 10:00:00"),
+    ("Вода", 500, "2024-03-01 10:00:00"),
+    ("Вода", 500, "2024-03-01 10:00:00"),
+]
+
+
+@pytest.fixture(params=[1, 2], ids=["v1", "v2"])
+def history_db(request, price_db):
+    price_db.ingest_rows(ROWS, 1)
+    if request.param == 2:
+        price_db.migrate_to_v2()
+    return price_db
+
+
+@pytest.mark.parametrize("expand", [False, True])
+def test_archive_then_compact_has_no_duplicates(history_db, tmp_path, expand):
+    archive_dir = tmp_path / "archive"
+    exported, pruned, files = archive_history(history_db, 30, archive_dir=archive_dir)
+    assert (exported, pruned, len(files)) == (6, 0, 2)
+    assert list(load_history(history_db, archive_dir, expand=expand)) == history_db.dump_history(expand=expand)
+
+    history_db.compact_history()  # Духи 01–03.03 — одна строка-интервал, в архиве остались три точки
+    assert list(load_history(history_db, archive_dir, expand=expand)) == history_db.dump_history(expand=expand)
+
+
+def test_pruned_history_comes_from_archive(history_db, tmp_path):
+    archive_dir = tmp_path / "archive"
+    full = history_db.dump_history()
+    _, pruned, _ = archive_history(history_db, 30, archive_dir=archive_dir, prune=True)
+    assert pruned == 4  # последняя строка товара остаётся в SQLite
+    assert list(load_history(history_db, archive_dir)) == full
+
+
+def test_perfumex_archive_round_trip(perfumex_db, tmp_path):
+    archive_dir = tmp_path / "archive"
+    perfumex_db.ingest_rows([(name, price, cur, at) for name, price, at in ROWS for cur in ("USD", "EUR")], 1)
+    full = perfumex_db.dump_history()
+    archive_history(perfumex_db, 30, archive_dir=archive_dir, prune=True)
+    assert len(perfumex_db.dump_history()) < len(full)
+    assert list(load_history(perfumex_db, archive_dir)) == full
+    assert list(load_history(perfumex_db, archive_dir, currency="EUR")) == [r for r in full if r[3] == "EUR"]
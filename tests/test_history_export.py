@@ -0,0 +1,79 @@
+# export: выгрузка истории читается обратно той же историей (и через import-csv — в новую БД)
+import argparse
+import csv
+import gzip
+import json
+
+import pytest
+
+ROWS = [
+    ("Духи", 1000, "2024-01-15 10:00:00"),
+    ("Духи", 1000, "2024-01-16 10:00:00"),
+    ("Духи", 1200, "2024-03-01 10:00:00"),
+    ('Вода "Морская", 100 мл', 500, "2024-02-01 12:30:00"),
+]
+
+
+def _export(tmp_path, name, **kw):
+    import main
+
+    args = dict(output=str(tmp_path / name), format=None, compression=None, product=None,
+                since=None, until=None, expand_history=False, archive_dir=str(tmp_path / "archive"))
+    args.update(kw)
+    main.cmd_export(argparse.Namespace(**args))
+    return tmp_path / name
+
+
+def _read(path):
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        return [(r["product_id"], r["name"], r["price"], str(r["checked_at"]))
+                for r in pq.read_table(path).to_pylist()]
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        if ".jsonl" in path.suffixes:
+            return [tuple(json.loads(line).values()) for line in f]
+        rows = list(csv.reader(f))
+    assert rows[0] == ["product_id", "name", "price", "checked_at"]
+    return [(int(pid), name, int(price), at) for pid, name, price, at in rows[1:]]
+
+
+@pytest.mark.parametrize("name", ["history.csv", "history.csv.gz", "history.jsonl", "history.parquet"])
+def test_export_round_trip(price_db, tmp_path, name, capsys):
+    if name.endswith(".parquet"):
+        pytest.importorskip("pyarrow")
+    price_db.ingest_rows(ROWS, 1)
+    path = _export(tmp_path, name)
+    assert f"Выгружено строк: {len(ROWS)}" in capsys.readouterr().out
+    assert _read(path) == price_db.dump_history()
+
+
+def test_export_filters(price_db, tmp_path):
+    price_db.ingest_rows(ROWS, 1)
+    path = _export(tmp_path, "part.csv", product=["духи"], since="2024-01-16 00:00:00", until="2024-03-01 10:00:00")
+    assert [r[2:] for r in _read(path)] == [(1000, "2024-01-16 10:00:00")]
+
+
+def test_export_includes_archive(price_db, tmp_path):
+    pytest.importorskip("pyarrow")
+    import main
+
+    price_db.ingest_rows(ROWS, 1)
+    full = price_db.dump_history()
+    main.cmd_archive_history(argparse.Namespace(older_than=30, archive_dir=str(tmp_path / "archive"), prune=True))
+    assert len(price_db.dump_history()) < len(full)
+    assert _read(_export(tmp_path, "all.csv")) == full
+
+
+def test_export_then_import_csv(price_db, tmp_path, monkeypatch):
+    import main
+
+    price_db.set_history_mode("intervals")
+    price_db.ingest_rows(ROWS, 1)
+    path = _export(tmp_path, "history.csv", expand_history=True)
+    expected = [r[1:] for r in price_db.dump_history(expand=True)]
+
+    monkeypatch.setattr(price_db, "DB_PATH", tmp_path / "restored.sqlite3")
+    main.cmd_import_csv(argparse.Namespace(csv=str(path), chunk_size=2))
+    assert [r[1:] for r in price_db.dump_history()] == expected
+    assert price_db.check_latest_prices() == []
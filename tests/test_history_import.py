@@ -0,0 +1,69 @@
+# import-csv: даты проверяются по-настоящему, строки с неразобранной датой пропускаются
+import argparse
+
+import pytest
+
+from history_import import normalize_checked_at
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-03-01 10:00:00", "2024-03-01 10:00:00"),
+    ("2024-03-01", "2024-03-01 00:00:00"),
+    ("2024-03-01T13:00:00+03:00", "2024-03-01 10:00:00"),
+    ("31.12.2024 12:00:00", "2024-12-31 12:00:00"),
+    ("31.12.2024 12:00", "2024-12-31 12:00:00"),
+    ("31.12.2024", "2024-12-31 00:00:00"),
+    ("", None),
+])
+def test_normalize_checked_at(value, expected):
+    assert normalize_checked_at(value) == expected
+
+
+@pytest.mark.parametrize("value", ["2024-02-30 10:00:00", "2024/01/02", "вчера", "32.01.2024 10:00:00"])
+def test_normalize_checked_at_rejects_non_dates(value):
+    with pytest.raises(ValueError):
+        normalize_checked_at(value)
+
+
+def test_import_csv_skips_bad_dates(price_db, tmp_path, capsys):
+    import main
+
+    csv_path = tmp_path / "history.csv"
+    csv_path.write_text(
+        "Товар;Цена (₽);Когда проверено\n"
+        "Духи;1 000 ₽;2024-12-30 10:00:00\n"
+        "Духи;1 100 ₽;31.12.2024 12:00:00\n"
+        "Духи;9 999 ₽;2024/01/02\n"
+        "Духи;8 888 ₽;2024-13-01 10:00:00\n"
+        "Вода;500 ₽;01.01.2025\n",
+        encoding="utf-8",
+    )
+    main.cmd_import_csv(argparse.Namespace(csv=str(csv_path), chunk_size=2))
+    assert "пропущено строк: 2" in capsys.readouterr().out
+    assert [r[1:] for r in price_db.dump_history()] == [
+        ("Вода", 500, "2025-01-01 00:00:00"),
+        ("Духи", 1000, "2024-12-30 10:00:00"),
+        ("Духи", 1100, "2024-12-31 12:00:00"),
+    ]
+    snapshot = {r[1]: r[2:4] for r in price_db.latest_snapshot()}
+    assert snapshot["Духи"] == (1100, 1000)  # последняя и предыдущая по времени, а не по тексту
+    assert price_db.check_latest_prices() == []
+    assert [(r[1], r[2]) for r in price_db.rollups("day")] == [
+        ("Вода", "2025-01-01"), ("Духи", "2024-12-30"), ("Духи", "2024-12-31")]
+
+
+def test_perfumex_import_csv_skips_bad_dates(perfumex_db, tmp_path, capsys):
+    import perfumex_main
+
+    csv_path = tmp_path / "history.csv"
+    csv_path.write_text(
+        "name,price_minor,currency,checked_at\n"
+        "Item,1000,USD,30.12.2024 10:00\n"
+        "Item,1100,USD,2024/01/02\n"
+        "Item,1200,USD,2024-12-31 10:00:00\n",
+        encoding="utf-8",
+    )
+    perfumex_main.cmd_import_csv(argparse.Namespace(csv=str(csv_path), chunk_size=50, currency="USD"))
+    assert "пропущено строк: 1" in capsys.readouterr().out
+    assert [r[2:5] for r in perfumex_db.latest_snapshot()] == [(1200, "USD", 1000)]
+    assert perfumex_db.check_latest_prices() == []
@@ -0,0 +1,92 @@
+# Хранение истории: перевод на схему v2 (migrate_to_v2) и режим intervals — та же история,
+# те же текущие цены и агрегаты, что и до/без них
+import argparse
+
+import pytest
+
+ROWS = [
+    ("Духи", 1000, "2024-03-01 10:00:00"),
+    ("Духи", 1000, "2024-03-02 10:00:00"),
+    ("Духи", 1000, "2024-03-03 10:00:00"),
+    ("Духи", 1100, "2024-03-04 10:00:00"),
+    ("Духи", 1000, "2024-03-09 10:00:00"),
+    ("Вода", 500, "2024-02-28 23:59:59"),
+    ("Вода", 500, "2024-03-01 00:00:00"),
+]
+
+
+def _state(db):
+    return (db.dump_history(), db.dump_history(expand=True), db.latest_snapshot(),
+            [db.rollups(period) for period in ("day", "week", "month")])
+
+
+def test_migrate_to_v2_keeps_history(price_db, capsys):
+    import main
+
+    price_db.ingest_rows(ROWS, 1)
+    price_db.set_history_mode("intervals")
+    price_db.ingest_rows([("Духи", 1000, "2024-03-10 10:00:00")], 2)  # продлевает интервал
+    price_db.refresh_rollups()
+    before = _state(price_db)
+    assert price_db.schema_version() == 1
+
+    main.cmd_migrate_db(argparse.Namespace())
+    assert "переведена на схему v2" in capsys.readouterr().out
+    assert price_db.schema_version() == 2
+    assert price_db.migrate_to_v2() == 0
+    price_db.refresh_rollups()
+    assert _state(price_db) == before
+    assert price_db.check_latest_prices() == []
+    assert price_db.ingest_seq() == 2 and price_db.history_mode() == "intervals"
+
+    # после перевода запись и чтение идут как обычно
+    price_db.ingest_rows([("Духи", 1200, "2024-03-11 10:00:00")], 3)
+    assert price_db.dump_history()[-1][2:] == (1200, "2024-03-11 10:00:00")
+    assert list(price_db.iter_history(page_size=2)) == price_db.dump_history()
+    assert price_db.check_latest_prices() == []
+
+
+def test_perfumex_migrate_to_v2_keeps_history(perfumex_db):
+    perfumex_db.ingest_rows([(name, price, "USD", at) for name, price, at in ROWS], 1)
+    perfumex_db.refresh_rollups()
+    before = _state(perfumex_db)
+    assert perfumex_db.migrate_to_v2() == len(ROWS)
+    perfumex_db.refresh_rollups()
+    assert perfumex_db.schema_version() == 2
+    assert _state(perfumex_db) == before
+    assert perfumex_db.check_latest_prices() == []
+
+
+@pytest.mark.parametrize("schema", [1, 2])
+def test_intervals_mode_round_trip(price_db, tmp_path, monkeypatch, schema, capsys):
+    import main
+
+    def fill(mode):
+        price_db.init_db(schema=schema)
+        main.cmd_history_mode(argparse.Namespace(mode=mode))
+        for seq, row in enumerate(ROWS, 1):  # по одному замеру, как fetch
+            price_db.ingest_rows([row], seq)
+        price_db.refresh_rollups()
+        return _state(price_db)
+
+    points = fill("points")
+    assert "Режим хранения истории: points" in capsys.readouterr().out
+    monkeypatch.setattr(price_db, "DB_PATH", tmp_path / "intervals.sqlite3")
+    history, expanded, snapshot, rollups = fill("intervals")
+    assert "Режим хранения истории: intervals" in capsys.readouterr().out
+
+    assert len(history) == 4  # одинаковые цены подряд — одна строка
+    assert [r[2:] for r in history if r[1] == "Духи"] == [
+        (1000, "2024-03-01 10:00:00"), (1100, "2024-03-04 10:00:00"), (1000, "2024-03-09 10:00:00")]
+    # с последним замером интервала — все точки, кроме середины серии (Духи 02.03)
+    assert expanded == [r for r in points[1] if r[3] != "2024-03-02 10:00:00"]
+    assert snapshot == points[2]
+    assert rollups == points[3]
+    assert price_db.check_latest_prices() == []
+
+    # compact-history сворачивает историю points в то же самое
+    monkeypatch.setattr(price_db, "DB_PATH", tmp_path / "points.sqlite3")
+    fill("points")
+    main.cmd_compact_history(argparse.Namespace())
+    assert price_db.history_mode() == "intervals"
+    assert _state(price_db) == (history, expanded, snapshot, rollups)
@@ -0,0 +1,109 @@
+# Быстрый путь без браузера (http_fetch, main.fetch_http) на локальном HTTP-сервере вместо сайта
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import locators
+import main
+from change_cache import UNCHANGED, ChangeCache
+from http_fetch import HttpFetcher, find_fields, parse_document
+
+ETAG = '"v1"'
+PAGES = {
+    # карточка, отрендеренная на сервере: оба локатора есть в HTML
+    "/product": """<html><body>
+        <h1 class="switcher-title">  Духи\n  Тест   50 мл </h1>
+        <span class="price__old-val">15 000 ₽</span>
+        <span class="price__new-val">12 345 ₽</span>
+    </body></html>""",
+    # цену дорисовывает JS — в HTML её нет, нужен браузер
+    "/js-only": """<html><body>
+        <h1 class="switcher-title">Духи Тест 50 мл</h1>
+        <span class="price__new-val"></span><script>renderPrice()</script>
+    </body></html>""",
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requests = []  # (путь, If-None-Match) каждого запроса
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        body = PAGES.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    _Handler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    with HttpFetcher(timeout=5) as f:
+        yield f
+
+
+def test_find_fields_reads_name_and_price(site, fetcher):
+    doc = parse_document(fetcher.get_html(f"{site}/product"))
+    assert find_fields(doc, locators.FIELDS) == {"name": "Духи Тест 50 мл", "price": "12 345 ₽"}
+    assert main.fetch_http(f"{site}/product", fetcher) == ("Духи Тест 50 мл", 12345)
+
+
+def test_missing_price_locator_falls_back_to_browser(site, fetcher):
+    assert find_fields(parse_document(fetcher.get_html(f"{site}/js-only")), locators.FIELDS) is None
+    assert main.fetch_http(f"{site}/js-only", fetcher) is None  # None — cmd_fetch откроет страницу в Selenium
+
+
+def test_not_modified_returns_unchanged(site, fetcher, price_db):
+    url = f"{site}/product"
+    cache = ChangeCache(price_db)
+    name, price = main.fetch_http(url, fetcher, cache)
+    cache.commit(url, name, price)  # как store() после записи цены
+
+    cache = ChangeCache(price_db)  # следующий прогон: валидаторы берутся из БД
+    assert main.fetch_http(url, fetcher, cache) is UNCHANGED
+    assert _Handler.requests == [("/product", None), ("/product", ETAG)]
+    assert cache.skipped == 1
+
+
+@pytest.mark.parametrize("engine", ["http", "async"])
+def test_fetch_round_trip_without_browser(site, price_db, tmp_path, monkeypatch, capsys, engine):
+    # spill-файл очереди и кэш страниц — рядом с временной БД, браузер не нужен: цена есть в HTML
+    monkeypatch.chdir(tmp_path)
+    links = tmp_path / "links.txt"
+    links.write_text(f"{site}/missing | {site}/product\n", encoding="utf-8")
+    argv = ["main.py", "fetch", "--links", str(links), "--engine", engine, "--skip-unchanged"]
+    monkeypatch.setattr("sys.argv", argv)
+    main.main()
+    assert "ОК: Духи Тест 50 мл — 12345 ₽" in capsys.readouterr().out
+    assert [r[1:3] for r in price_db.dump_history()] == [("Духи Тест 50 мл", 12345)]
+
+    main.main()  # страница не менялась — 304, новой цены нет
+    assert "Без изменений (304 Not Modified)" in capsys.readouterr().out
+    assert len(price_db.dump_history()) == 1
+    assert price_db.check_latest_prices() == []
@@ -0,0 +1,81 @@
+# IngestQueue: on_written вызывается только после того, как пачка записана в БД
+def test_on_written_runs_after_rows_are_in_db(price_db, tmp_path):
+    from ingest_queue import IngestQueue
+
+    seen = []
+    with IngestQueue(price_db, spill_path=tmp_path / "spill.jsonl") as ingest:
+        ingest.put(("Духи", 1000, "2024-03-01 10:00:00"),
+                   lambda: seen.append(price_db.latest_price_by_name("Духи")))
+        ingest.put(("Без отметки", 500, "2024-03-01 10:00:00"))
+    assert seen == [1000]
+    assert ingest.error is None and ingest.written == 2
+
+
+def test_on_written_skipped_when_write_fails(price_db, tmp_path, monkeypatch):
+    from ingest_queue import IngestQueue
+
+    def broken(rows, seq):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(price_db, "ingest_rows", broken)
+    seen = []
+    spill = tmp_path / "spill.jsonl"
+    with IngestQueue(price_db, spill_path=spill) as ingest:
+        ingest.put(("Духи", 1000, "2024-03-01 10:00:00"), lambda: seen.append("commit"))
+    assert seen == []
+    assert isinstance(ingest.error, RuntimeError)
+    assert spill.exists()  # запись дождётся следующего fetch
+
+
+def _fail_after_first_row(monkeypatch, db_module):
+    real = db_module._insert_prices
+
+    def half_done(conn, rows):
+        rows = list(rows)
+        real(conn, rows[:1])
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr(db_module, "_insert_prices", half_done)
+    return real
+
+
+def test_failed_batch_in_session_leaves_no_partial_rows(price_db, tmp_path, monkeypatch):
+    from ingest_queue import IngestQueue
+
+    spill = tmp_path / "spill.jsonl"
+    rows = [("Духи", 1000 + k, f"2024-03-0{k + 1} 10:00:00") for k in range(4)]
+    with price_db.session():
+        with IngestQueue(price_db, batch_size=2, flush_interval=60, spill_path=spill) as ingest:
+            ingest.put(rows[0])
+            ingest.put(rows[1])
+        assert ingest.error is None
+        real = _fail_after_first_row(monkeypatch, price_db)
+        with IngestQueue(price_db, batch_size=2, flush_interval=60, spill_path=spill) as ingest:
+            ingest.put(rows[2])
+            ingest.put(rows[3])
+        assert isinstance(ingest.error, RuntimeError)
+        price_db.upsert_product("Вода")  # следующая запись сессии коммитит транзакцию
+    monkeypatch.setattr(price_db, "_insert_prices", real)
+
+    assert price_db.ingest_seq() == 2
+    assert [r[2] for r in price_db.dump_history()] == [1000, 1001]  # половина пачки не закоммичена
+    with IngestQueue(price_db, spill_path=spill) as ingest:
+        pass
+    assert ingest.replayed == 2
+    assert [r[2] for r in price_db.dump_history()] == [1000, 1001, 1002, 1003]
+    assert price_db.check_latest_prices() == []
+
+
+def test_session_commits_only_completed_writes(price_db, monkeypatch):
+    import pytest
+
+    with pytest.raises(RuntimeError):
+        with price_db.session():
+            price_db.ingest_rows([("Духи", 1000, "2024-03-01 10:00:00")], 1)
+            real = _fail_after_first_row(monkeypatch, price_db)
+            price_db.ingest_rows([("Духи", 1100, "2024-03-02 10:00:00"),
+                                  ("Вода", 500, "2024-03-02 10:00:00")], 3)
+    monkeypatch.setattr(price_db, "_insert_prices", real)
+    assert price_db.ingest_seq() == 1
+    assert [r[1:3] for r in price_db.dump_history()] == [("Духи", 1000)]
+    assert price_db.find_products(["Вода"]) == []
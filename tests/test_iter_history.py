@@ -0,0 +1,65 @@
+# iter_history: keyset-пагинация по (товар, время, id) отдаёт ту же историю, что один запрос по prices,
+# при любом размере страницы, с фильтрами и в обеих схемах
+import pytest
+
+from db_session import ts_text_sql
+
+ROWS = [
+    ("Духи", 1000, "2024-03-01 10:00:00"),
+    ("Духи", 1100, "2024-03-01 10:00:00"),  # тот же момент — порядок по id
+    ("Духи", 1200, "2024-03-02 10:00:00"),
+    ("Вода", 500, "2024-03-03 10:00:00"),
+    ("Вода", 400, "2024-02-01 10:00:00"),  # задним числом
+    ("Ёлка", 700, "2024-03-01 12:00:00"),
+    ("Аромат", 300, "2024-03-05 10:00:00"),
+]
+
+
+def _reference(db, where="1", params=()):
+    """Вся история одним запросом без пагинации — с чем сверяем."""
+    conn = db.get_conn()
+    rows = conn.execute(
+        f"SELECT p.id, p.name, pr.price, {ts_text_sql('pr.checked_at')} FROM prices pr "
+        f"JOIN products p ON p.id = pr.product_id WHERE {where} ORDER BY p.name, pr.checked_at, pr.id",
+        params,
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.fixture(params=[1, 2], ids=["v1", "v2"])
+def history_db(request, price_db):
+    if request.param == 2:
+        price_db.migrate_to_v2()
+    price_db.ingest_rows(ROWS, 1)
+    return price_db
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 1000])
+def test_pages_match_single_query(history_db, page_size):
+    db = history_db
+    assert list(db.iter_history(page_size=page_size)) == _reference(db)
+    ids = db.find_products(["духи", "ёлка"])
+    assert list(db.iter_history(product_ids=ids, page_size=page_size)) == [
+        r for r in _reference(db) if r[0] in ids]
+    window = [r for r in _reference(db) if "2024-03-01 10:00:00" <= r[3] < "2024-03-03 10:00:00"]
+    assert list(db.iter_history(since="2024-03-01 10:00:00", until="2024-03-03 10:00:00",
+                                page_size=page_size)) == window
+
+
+def test_frames_match_rows(history_db):
+    pytest.importorskip("pyarrow")
+    db = history_db
+    frames = list(db.iter_history_frames(chunk_size=3))
+    assert [len(f) for f in frames] == [3, 3, 1]
+    assert [tuple(r) for f in frames for r in f.itertuples(index=False)] == _reference(db)
+    batches = list(db.iter_history_frames(kind="arrow", chunk_size=4))
+    assert [tuple(r.values()) for b in batches for r in b.to_pylist()] == _reference(db)
+
+
+def test_perfumex_currency_filter(perfumex_db):
+    rows = [(name, price, cur, at) for name, price, at in ROWS for cur in ("USD", "EUR")]
+    perfumex_db.ingest_rows(rows, 1)
+    usd = list(perfumex_db.iter_history(currency="USD", page_size=2))
+    assert len(usd) == len(ROWS) and {r[3] for r in usd} == {"USD"}
+    assert [r[:3] + r[4:] for r in usd] == [r[:3] + r[4:] for r in perfumex_db.iter_history(currency="EUR")]
@@ -0,0 +1,57 @@
+# latest_prices ведут триггеры trg_prices_* — таблица должна совпадать с тем, что check_latest_prices
+# и latest_snapshot_from_history считают по самой истории, при любом порядке и способе записи
+import pytest
+
+ROWS = [
+    ("Духи", 1000, "2024-03-02 10:00:00"),
+    ("Духи", 1000, "2024-03-03 10:00:00"),
+    ("Духи", 1200, "2024-03-04 10:00:00"),
+    ("Вода", 500, "2024-03-02 10:00:00"),
+]
+# задним числом: раньше последней строки товара (trg_prices_latest_backfill) и в тот же момент
+LATE_ROWS = [
+    ("Духи", 900, "2024-03-01 10:00:00"),
+    ("Вода", 450, "2024-03-02 10:00:00"),
+    ("Вода", 450, "2024-03-05 10:00:00"),
+]
+
+
+@pytest.fixture(params=[(1, "points"), (1, "intervals"), (2, "points"), (2, "intervals")],
+                ids=lambda p: f"v{p[0]}-{p[1]}")
+def tracked_db(request, tmp_path, monkeypatch):
+    import db
+    schema, mode = request.param
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "price_tracker.sqlite3")
+    db.init_db(schema=schema)
+    db.set_history_mode(mode)
+    return db
+
+
+def test_triggers_match_history(tracked_db):
+    db = tracked_db
+    db.ingest_rows(ROWS, 1)
+    assert db.check_latest_prices() == []
+    db.ingest_rows(LATE_ROWS, 2)
+    pid = db.upsert_products(["Духи"])["Духи"]
+    db.insert_prices([(pid, 1200, "2024-03-06 10:00:00"), (pid, 1100, None)])  # None — «сейчас»
+    assert db.check_latest_prices() == []
+    snapshot = db.latest_snapshot()
+    assert snapshot == db.latest_snapshot_from_history()
+    assert {r[1]: r[2:4] for r in snapshot} == {"Духи": (1100, 1200), "Вода": (450, 450)}  # предыдущий замер, а не предыдущая цена
+    assert sum(r[6] for r in snapshot) == len(ROWS) + len(LATE_ROWS) + 2  # observations — все замеры
+
+    with db.session():  # в сессии триггеры работают в той же транзакции
+        db.ingest_rows([("Вода", 600, "2024-03-07 10:00:00")], 3)
+        assert db.check_latest_prices() == []
+    assert db.rebuild_latest_prices() == 2
+    assert db.latest_snapshot() == db.latest_snapshot_from_history()
+
+
+def test_perfumex_triggers_match_history(perfumex_db):
+    db = perfumex_db
+    for mode in ("points", "intervals"):
+        db.set_history_mode(mode)
+        db.ingest_rows([(name, price, "USD", at) for name, price, at in ROWS], 1)
+        db.ingest_rows([(name, price, "EUR", at) for name, price, at in LATE_ROWS], 2)
+        assert db.check_latest_prices() == []
+        assert db.latest_snapshot() == db.latest_snapshot_from_history()
@@ -0,0 +1,74 @@
+# Отчёт: ширины «Истории» — те же, что давала исходная автоширина по прочитанной обратно книге
+import openpyxl
+from openpyxl.utils import get_column_letter
+
+
+def _baseline_widths(ws, padding=2, min_w=12, max_w=60):
+    """autosize() исходного report.py: длина str(значения) каждой ячейки, включая заголовок."""
+    dims = {}
+    for row in ws.iter_rows(values_only=True):
+        for i, cell in enumerate(row, 1):
+            if cell is not None:
+                dims[i] = max(dims.get(i, 0), len(str(cell)))
+    return {get_column_letter(i): min(max(w + padding, min_w), max_w) for i, w in dims.items()}
+
+
+def _history_widths(path):
+    ws = openpyxl.load_workbook(path)["История"]
+    return {k: d.width for k, d in ws.column_dimensions.items() if d.width}, _baseline_widths(ws)
+
+
+def test_history_widths_match_baseline_autosize(price_db, tmp_path):
+    import report
+
+    long_name = "Очень длинное название товара, " * 2
+    # самая длинная цена — старая, её нет ни в снимке, ни в агрегатах (refresh_rollups не вызывался)
+    price_db.ingest_rows([(long_name, 123456789012, "2024-03-01 10:00:00"), (long_name, 1000, "2024-03-02 10:00:00"),
+                          ("Духи", 500, "2024-03-01 10:00:00")], 1)
+    out = tmp_path / "report.xlsx"
+    report.build_excel_report(out)
+    widths, expected = _history_widths(out)
+    assert widths == expected
+    assert openpyxl.load_workbook(out, read_only=True).sheetnames == [
+        "Текущие цены", "История", "Легенда"]
+
+
+def test_history_widths_see_archive(price_db, tmp_path, monkeypatch):
+    import pytest
+    pytest.importorskip("pyarrow")
+    import history_archive
+    import report
+
+    monkeypatch.setattr(history_archive, "ARCHIVE_ROOT", tmp_path / "archive")
+    price_db.ingest_rows([("Духи", 987654321012, "2024-03-01 10:00:00"), ("Духи", 1000, "2024-04-01 10:00:00")], 1)
+    history_archive.archive_history(price_db, 30, prune=True)
+    price_db.refresh_rollups()  # март уже только в архиве — в агрегаты дорогая цена не попала
+    out = tmp_path / "report.xlsx"
+    report.build_excel_report(out)
+    widths, expected = _history_widths(out)
+    assert widths == expected
+
+
+def test_perfumex_history_widths_match_baseline_autosize(perfumex_db, tmp_path):
+    import perfumex_report
+
+    # мин. и макс. пишутся как «100000000» и «200000000» — самая длинная «123456789.01» между ними
+    perfumex_db.ingest_rows([("Item", minor, "USD", f"2024-03-0{k} 10:00:00")
+                             for k, minor in enumerate((10000000000, 12345678901, 20000000000), 1)], 1)
+    perfumex_db.refresh_rollups()
+    out = tmp_path / "report.xlsx"
+    perfumex_report.build_excel_report(out)
+    widths, expected = _history_widths(out)
+    assert widths == expected
+
+
+def test_months_sheet_is_opt_in(price_db, tmp_path):
+    import report
+
+    price_db.ingest_rows([("Духи", 1000, "2024-03-01 10:00:00")], 1)
+    price_db.refresh_rollups()
+    out = tmp_path / "report.xlsx"
+    report.build_excel_report(out, months=True)
+    wb = openpyxl.load_workbook(out, read_only=True)
+    assert wb.sheetnames == ["Текущие цены", "История", "По месяцам", "Легенда"]
+    assert list(wb["По месяцам"].iter_rows(min_row=2, values_only=True))[0][:2] == ("Духи", "2024-03-01")
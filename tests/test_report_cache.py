@@ -0,0 +1,140 @@
+# Кэш отчёта (report_cache) и деление «Истории» (HistorySheet): инкрементальная и поделённая сборка
+# должны давать ту же книгу, что полная, — ячейка в ячейку и стиль в стиль (сверка через openpyxl)
+import math
+
+import openpyxl
+import pytest
+
+from report_pipeline import REPORT_MODES, HistorySheet, run_report
+from report_cache import default_cache_dir
+
+MODES = {message: mode for mode, message in REPORT_MODES.items()}
+
+NAMES = [
+    'Духи <Intense> & "Noir"',
+    "  Пробел в начале",
+    "Пробел в конце  ",
+    "Обычный товар",
+    "Ёлка & <co>",
+    "Zeta",
+]
+
+
+def _dump(path):
+    """Всё, что видно в книге: листы, ширины, закрепление, значения и оформление каждой ячейки."""
+    wb = openpyxl.load_workbook(path)
+    out = [wb.sheetnames]
+    for ws in wb.worksheets:
+        widths = {k: d.width for k, d in ws.column_dimensions.items() if d.width}
+        out.append((ws.title, ws.freeze_panes, widths, ws.row_dimensions[1].height))
+        for row in ws.iter_rows():
+            for c in row:
+                link = (c.hyperlink.location, c.hyperlink.target) if c.hyperlink else None
+                out.append((ws.title, c.coordinate, c.value, c.number_format, c.font.b, c.font.u,
+                            c.fill.fgColor.rgb if c.fill.fill_type else None,
+                            c.alignment.horizontal, c.alignment.wrap_text, link))
+    return out
+
+
+def _rows(path, sheets=None):
+    wb = openpyxl.load_workbook(path, read_only=True)
+    rows = []
+    for title in sheets or ["История"]:
+        rows += list(wb[title].iter_rows(min_row=2, values_only=True))
+    return rows
+
+
+def _fill(db, names, seq, base_price=1000, checks=3, day=1):
+    rows = [(name, base_price + 10 * i + k, f"2024-03-{day + k:02d} 10:00:00")
+            for i, name in enumerate(names) for k in range(checks)]
+    db.ingest_rows(rows, seq)
+    db.refresh_rollups()
+
+
+def _build(out, **kw):
+    import report
+    got = []
+    report.build_excel_report(out, log=got.append, **kw)
+    return MODES[got[0]]
+
+
+def test_incremental_matches_full_build(price_db, tmp_path):
+    _fill(price_db, NAMES, 1)
+    out, ref = tmp_path / "report.xlsx", tmp_path / "ref.xlsx"
+    assert _build(out) == "full"
+    assert _build(out) == "skip"
+
+    # новые замеры у части товаров и новый товар, который по имени встаёт между старыми
+    _fill(price_db, [NAMES[0], NAMES[2], "Новый <товар>"], 2, base_price=900, checks=2, day=10)
+    assert _build(out) == "incremental"
+    assert _build(ref, full=True) == "full"
+    assert _dump(out) == _dump(ref)
+    names = {r[1] for r in _rows(out)}
+    assert {"  Пробел в начале", "Пробел в конце  ", 'Духи <Intense> & "Noir"'} <= names
+
+
+@pytest.mark.parametrize("shard_files", [False, True])
+def test_sharded_incremental_matches_full_build(price_db, tmp_path, shard_files):
+    _fill(price_db, NAMES, 1, checks=4)
+    out, ref = tmp_path / "report.xlsx", tmp_path / "ref.xlsx"
+    assert _build(out, history_rows=7, shard_files=shard_files) == "full"
+    _fill(price_db, [NAMES[3], "Аааа новый"], 2, checks=9, day=10)  # 9 строк — больше части
+    assert _build(out, history_rows=7, shard_files=shard_files) == "incremental"
+    assert _build(ref, history_rows=7, shard_files=shard_files, full=True) == "full"
+
+    if shard_files:
+        parts = sorted(tmp_path.glob("report.history-*.xlsx"))
+        ref_parts = sorted(tmp_path.glob("ref.history-*.xlsx"))
+        assert len(parts) == len(ref_parts) > 1
+        for part, ref_part in zip(parts, ref_parts):
+            assert _dump(part) == _dump(ref_part)
+        # оглавление ссылается на свои файлы — сравниваем без ссылок
+        assert [r[1:] for r in _rows(out)] == [r[1:] for r in _rows(ref)]
+    else:
+        assert _dump(out) == _dump(ref)
+
+    # части подряд — та же история, что и на одном листе
+    flat = tmp_path / "flat.xlsx"
+    _build(flat)
+    if shard_files:
+        sharded = []
+        for part in sorted(tmp_path.glob("report.history-*.xlsx"), key=lambda p: int(p.stem.rsplit("-", 1)[1])):
+            sharded += _rows(part, openpyxl.load_workbook(part, read_only=True).sheetnames)
+    else:
+        titles = [t for t in openpyxl.load_workbook(out, read_only=True).sheetnames if t.startswith("История ")]
+        assert titles == [f"История {k}" for k in range(1, len(titles) + 1)]
+        sharded = _rows(out, titles)
+    assert sharded == _rows(flat)
+
+
+def test_shard_files_single_part_stays_in_book(price_db, tmp_path):
+    _fill(price_db, NAMES, 1)
+    out = tmp_path / "report.xlsx"
+    _build(out, history_rows=1000, shard_files=True)
+    assert not list(tmp_path.glob("report.history-*.xlsx"))
+    plain = tmp_path / "plain.xlsx"
+    _build(plain)
+    assert _dump(out) == _dump(plain)
+
+
+def test_nan_survives_cache(price_db, tmp_path):
+    import db
+    _fill(price_db, NAMES, 1, checks=5)
+
+    def transform(df):
+        out = df.rename(columns={"name": "Товар"})
+        out["Цена"] = df["price"].where(df["price"] % 2 == 0)  # NaN -> пустая ячейка
+        return out
+
+    def sheets():
+        return [HistorySheet(["Товар", "Цена"], transform, {"Цена": "#,##0"})]
+
+    out, ref = tmp_path / "nan.xlsx", tmp_path / "nan_ref.xlsx"
+    run_report(db, out, sheets(), cache_dir=default_cache_dir(out))
+    _fill(price_db, NAMES[:2], 2, checks=3, day=20)
+    mode, _ = run_report(db, out, sheets(), cache_dir=default_cache_dir(out))
+    assert mode == "incremental"
+    run_report(db, ref, sheets())
+    assert _dump(out) == _dump(ref)
+    prices = [r[1] for r in _rows(out)]
+    assert None in prices and all(p is None or not math.isnan(p) for p in prices)
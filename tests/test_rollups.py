@@ -0,0 +1,69 @@
+# rollups() по длинному списку product_ids: IN (...) режется на пачки по _MAX_VARS
+def test_rollups_chunks_product_ids(price_db):
+    db = price_db
+    names = [f"Товар {i:04d}" for i in range(db._MAX_VARS * 2 + 7)]
+    db.ingest_rows([(n, 1000 + i, "2024-03-01 10:00:00") for i, n in enumerate(names)], 1)
+    db.refresh_rollups()
+    everything = db.rollups("day")
+    ids = [r[0] for r in everything]
+    assert len(ids) == len(names)
+    assert db.rollups("day", product_ids=reversed(ids)) == everything
+    assert db.rollups("day", product_ids=ids[::2]) == everything[::2]
+    assert db.rollups("day", product_ids=[]) == []
+
+
+def test_perfumex_rollups_chunks_product_ids(perfumex_db):
+    db = perfumex_db
+    names = [f"Item {i:04d}" for i in range(db._MAX_VARS + 3)]
+    rows = [(n, 100 * i, cur, "2024-03-01 10:00:00") for i, n in enumerate(names) for cur in ("USD", "EUR")]
+    db.ingest_rows(rows, 1)
+    db.refresh_rollups()
+    everything = db.rollups("day")
+    ids = list(dict.fromkeys(r[0] for r in everything))
+    assert len(everything) == 2 * len(names)
+    assert db.rollups("day", product_ids=ids[::-1]) == everything
+
+
+def _observations():
+    """Замеры дважды в день с паузами в цене; у «Воды» — раз в день через границу недели и месяца."""
+    perfume = [(1000, f"2024-03-{d:02d} {h}:00:00") for d in range(1, 7) for h in (10, 22)]
+    perfume += [(1100, "2024-03-07 10:00:00"), (1100, "2024-03-07 22:00:00"), (1000, "2024-03-08 10:00:00")]
+    water = [(500, f"2024-03-{d:02d} 09:30:00") for d in range(27, 32)]
+    water += [(500, f"2024-04-{d:02d} 09:30:00") for d in range(1, 4)]
+    rows = [("Духи", p, at) for p, at in perfume] + [("Вода", p, at) for p, at in water]
+    return sorted(rows, key=lambda r: r[2])
+
+
+def _rollups_for(db, mode):
+    db.init_db()
+    db.set_history_mode(mode)
+    rows = _observations()
+    # по кусочку, с refresh_rollups между ними: интервалы продлеваются уже после пересчёта
+    for seq, i in enumerate(range(0, len(rows), 7), 1):
+        db.ingest_rows(rows[i:i + 7], seq)
+        db.refresh_rollups()
+    return {period: db.rollups(period) for period in ("day", "week", "month")}
+
+
+def test_intervals_rollups_match_points(price_db, tmp_path, monkeypatch):
+    points = _rollups_for(price_db, "points")
+    monkeypatch.setattr(price_db, "DB_PATH", tmp_path / "intervals.sqlite3")
+    intervals = _rollups_for(price_db, "intervals")
+    assert len(price_db.dump_history()) < len(_observations())  # строки действительно свёрнуты
+    assert len(points["day"]) == 8 + 8  # у каждого дня с замерами — своя строка
+    assert intervals == points
+    price_db.refresh_rollups(full=True)
+    assert {period: price_db.rollups(period) for period in points} == points
+
+
+def test_perfumex_intervals_rollups_match_points(perfumex_db, tmp_path, monkeypatch):
+    def run(mode):
+        perfumex_db.init_db()
+        perfumex_db.set_history_mode(mode)
+        perfumex_db.ingest_rows([(name, price, "USD", at) for name, price, at in _observations()], 1)
+        perfumex_db.refresh_rollups()
+        return [perfumex_db.rollups(period) for period in ("day", "week", "month")]
+
+    points = run("points")
+    monkeypatch.setattr(perfumex_db, "DB_PATH", tmp_path / "intervals.sqlite3")
+    assert run("intervals") == points
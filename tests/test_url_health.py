@@ -0,0 +1,51 @@
+# Гонка --race в url_health.try_urls: проигравшие попытки останавливаются и дожидаются
+import threading
+import time
+
+from url_health import RaceCancelled, check_cancelled, try_urls
+
+
+def test_race_losers_are_cancelled_and_joined():
+    finished = []
+    release_slow = threading.Event()
+
+    def attempt(url):
+        try:
+            if url == "fast":
+                return "price"
+            # «медленная» карточка: ждём полей, проверяя отмену на каждом цикле, как extract_fields
+            while not release_slow.wait(0.01):
+                check_cancelled()
+            return "late"
+        finally:
+            finished.append(url)
+
+    url, result = try_urls(["fast", "slow1", "slow2"], attempt, lambda _: None, race=3)
+    assert (url, result) == ("fast", "price")
+    # к возврату все попытки гонки уже завершены — их браузеры свободны
+    assert sorted(finished) == ["fast", "slow1", "slow2"]
+
+
+def test_cancelled_attempt_is_not_a_url_failure():
+    recorded = []
+
+    class Health:
+        def order(self, urls):
+            return list(urls)
+
+        def record(self, url, ok, elapsed_ms):
+            recorded.append((url, ok))
+
+    def attempt(url):
+        if url == "slow":
+            time.sleep(0.05)
+            check_cancelled()
+        return url
+
+    assert try_urls(["fast", "slow"], attempt, lambda _: None, Health(), race=2) == ("fast", "fast")
+    assert recorded == [("fast", True)]
+
+
+def test_check_cancelled_outside_race_is_noop():
+    check_cancelled()
+    assert issubclass(RaceCancelled, Exception)
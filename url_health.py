@@ -0,0 +1,142 @@
+# url_health.py — «обучаемый» порядок фоллбэков `url1 | url2 | url3` и гонка кандидатов
+#
+# По каждому URL в таблице url_stats копятся успехи/ошибки и средняя задержка.
+# Порядок попыток внутри строки links.txt:
+#   1) проверенные рабочие URL — от самого быстрого к медленному;
+#   2) ещё не встречавшиеся — в порядке файла;
+#   3) падавшие в прошлый раз — в конце (по числу ошибок подряд), но всё равно пробуются:
+#      ожившее зеркало вернётся наверх после первой удачи.
+# С --race K первые K кандидатов запускаются одновременно, берётся первый успешный. Проигравшие
+# останавливаются в точках check_cancelled() (перед навигацией и на каждом цикле ожидания полей)
+# и дожидаются: к возврату из try_urls их браузеры из DriverPool и HTTP-соединения уже свободны.
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+EMA_WEIGHT = 0.3  # вес свежего замера в средней задержке
+
+_race = threading.local()  # .stop — Event гонки, в потоке которой выполняется attempt
+
+
+class RaceCancelled(Exception):
+    """Попытка остановлена: гонку уже выиграл другой URL."""
+
+
+def check_cancelled() -> None:
+    """Точка отмены для attempt: бросает RaceCancelled, если гонка решена; вне гонки ничего не делает."""
+    stop = getattr(_race, "stop", None)
+    if stop is not None and stop.is_set():
+        raise RaceCancelled("гонку выиграл другой URL")
+
+
+class UrlHealth:
+    def __init__(self, db_module):
+        self.db = db_module
+        # url -> [successes, failures, consecutive_failures, avg_ms]
+        self._stats: Dict[str, list] = {u: list(v) for u, v in db_module.load_url_stats().items()}
+        self._dirty: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def order(self, urls: List[str]) -> List[str]:
+        with self._lock:
+            def key(item: Tuple[int, str]):
+                idx, url = item
+                st = self._stats.get(url)
+                if st is None:
+                    return (1, 0, 0.0, idx)
+                successes, _, consecutive, avg_ms = st
+                if consecutive:
+                    return (2, consecutive, 0.0, idx)
+                if not successes:
+                    return (1, 0, 0.0, idx)
+                return (0, 0, avg_ms or 0.0, idx)
+
+            return [u for _, u in sorted(enumerate(urls), key=key)]
+
+    def record(self, url: str, ok: bool, elapsed_ms: float) -> None:
+        with self._lock:
+            st = self._stats.setdefault(url, [0, 0, 0, None])
+            if ok:
+                st[0] += 1
+                st[2] = 0
+                st[3] = elapsed_ms if st[3] is None else (1 - EMA_WEIGHT) * st[3] + EMA_WEIGHT * elapsed_ms
+            else:
+                st[1] += 1
+                st[2] += 1
+            self._dirty[url] = ok
+
+    def flush(self) -> None:
+        """Записать накопленную за прогон статистику одной транзакцией."""
+        with self._lock:
+            rows = [(u, *self._stats[u], ok) for u, ok in self._dirty.items()]
+            self._dirty.clear()
+        if rows:
+            self.db.save_url_stats(rows)
+
+
+def try_urls(urls: List[str],
+             attempt: Callable[[str], Any],
+             log: Callable[[str], None],
+             health: Optional[UrlHealth] = None,
+             race: int = 1) -> Tuple[str, Any]:
+    """
+    Пробует URL группы до первого успеха: attempt(url) возвращает результат или бросает исключение.
+    Возвращает (url, результат); если не вышло ни по одному — пробрасывает последнюю ошибку.
+    """
+    ordered = health.order(urls) if health else list(urls)
+
+    def timed(url: str):
+        started = time.perf_counter()
+        try:
+            result = attempt(url)
+        except RaceCancelled:
+            raise  # не ошибка URL — статистику не портим
+        except Exception:
+            if health:
+                health.record(url, False, (time.perf_counter() - started) * 1000)
+            raise
+        if health:
+            health.record(url, True, (time.perf_counter() - started) * 1000)
+        return result
+
+    last_error: Optional[Exception] = None
+    if race > 1 and len(ordered) > 1:
+        head, ordered = ordered[:race], ordered[race:]
+        log(f"   Гонка: {', '.join(head)}")
+        stop = threading.Event()
+
+        def racer(url: str):
+            _race.stop = stop
+            try:
+                return timed(url)
+            finally:
+                _race.stop = None
+
+        ex = ThreadPoolExecutor(max_workers=len(head), thread_name_prefix="race")
+        try:
+            pending = {ex.submit(racer, u): u for u in head}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    url = pending.pop(f)
+                    try:
+                        return url, f.result()
+                    except Exception as e:
+                        last_error = e
+                        log(f"   Ошибка ({url}): {e}")
+        finally:
+            # Проигравшие бросают работу в ближайшей check_cancelled(); ждём их, чтобы они вернули
+            # браузеры в пул до следующей группы и до pool.close()
+            stop.set()
+            ex.shutdown(wait=True, cancel_futures=True)
+
+    for url in ordered:
+        log(f"   Пробую URL: {url}")
+        try:
+            return url, timed(url)
+        except Exception as e:
+            last_error = e
+            log(f"   Ошибка: {e}")
+    raise last_error or RuntimeError("Пустая группа URL")